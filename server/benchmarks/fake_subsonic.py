@@ -0,0 +1,210 @@
+"""A local stand-in for a Subsonic server, for benchmarks.
+
+Serves a synthetic library of any size with configurable per-request latency:
+getAlbumList2, getAlbum, getCoverArt, stream and ping. Streamed audio is a generated
+WAV tone, so ffmpeg has real audio to decode without any fixtures on disk.
+
+Run standalone with: uv run python -m benchmarks.fake_subsonic --songs 50000
+"""
+
+import argparse
+import asyncio
+import io
+import math
+import socket
+import struct
+import threading
+import time
+import wave
+from dataclasses import dataclass
+from functools import lru_cache
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response
+from PIL import Image
+
+
+@dataclass
+class FakeLibrary:
+    songs: int = 1000
+    songs_per_album: int = 10
+    track_seconds: int = 30
+    latency_ms: float = 0.0
+
+    @property
+    def albums(self) -> int:
+        return math.ceil(self.songs / self.songs_per_album)
+
+    def album(self, index: int) -> dict:
+        album_id = f"al{index:06d}"
+        first_song = index * self.songs_per_album
+        song_count = min(self.songs_per_album, self.songs - first_song)
+        return {
+            "id": album_id,
+            "name": f"Album {index}",
+            "artist": f"Artist {index % 500}",
+            "artistId": f"ar{index % 500:04d}",
+            "coverArt": f"al-{album_id}",
+            "songCount": song_count,
+            "duration": song_count * self.track_seconds,
+            "created": "2024-01-01T00:00:00Z",
+        }
+
+    def songs_for(self, index: int) -> list[dict]:
+        album = self.album(index)
+        first_song = index * self.songs_per_album
+        return [
+            {
+                "id": f"so{first_song + i:07d}",
+                "title": f"Song {first_song + i}",
+                "album": album["name"],
+                "artist": album["artist"],
+                "albumId": album["id"],
+                "track": i + 1,
+                "duration": self.track_seconds,
+                "coverArt": album["coverArt"],
+                "path": f"{album['artist']}/{album['name']}/{i + 1:02d}.wav",
+                "suffix": "wav",
+            }
+            for i in range(album["songCount"])
+        ]
+
+
+def _ok(data: dict) -> JSONResponse:
+    return JSONResponse(
+        {"subsonic-response": {"status": "ok", "version": "1.16.1", "type": "fake", **data}}
+    )
+
+
+def _not_found() -> JSONResponse:
+    return JSONResponse(
+        {
+            "subsonic-response": {
+                "status": "failed",
+                "version": "1.16.1",
+                "error": {"code": 70, "message": "Not found"},
+            }
+        }
+    )
+
+
+@lru_cache(maxsize=8)
+def _tone_wav(seconds: int, sample_rate: int = 22050) -> bytes:
+    buf = io.BytesIO()
+    with wave.open(buf, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(sample_rate)
+        period = [
+            int(8000 * math.sin(2 * math.pi * 440 * i / sample_rate)) for i in range(sample_rate)
+        ]
+        second = struct.pack(f"<{sample_rate}h", *period)
+        wav.writeframes(second * seconds)
+    return buf.getvalue()
+
+
+@lru_cache(maxsize=1)
+def _cover_jpeg() -> bytes:
+    buf = io.BytesIO()
+    Image.new("RGB", (300, 300), (200, 80, 40)).save(buf, "JPEG", quality=80)
+    return buf.getvalue()
+
+
+def create_fake_subsonic(library: FakeLibrary) -> FastAPI:
+    app = FastAPI(title="Fake Subsonic")
+    app.state.request_counts = {}
+
+    @app.middleware("http")
+    async def latency(request: Request, call_next):
+        endpoint = request.url.path.rsplit("/", 1)[-1]
+        counts = app.state.request_counts
+        counts[endpoint] = counts.get(endpoint, 0) + 1
+        if library.latency_ms:
+            await asyncio.sleep(library.latency_ms / 1000)
+        return await call_next(request)
+
+    @app.get("/rest/ping.view")
+    async def ping():
+        return _ok({})
+
+    @app.get("/rest/getAlbumList2.view")
+    async def get_album_list(size: int = 10, offset: int = 0):
+        end = min(offset + size, library.albums)
+        return _ok({"albumList2": {"album": [library.album(i) for i in range(offset, end)]}})
+
+    @app.get("/rest/getAlbum.view")
+    async def get_album(id: str):
+        try:
+            index = int(id.removeprefix("al"))
+        except ValueError:
+            return _not_found()
+        if not 0 <= index < library.albums:
+            return _not_found()
+        return _ok({"album": {**library.album(index), "song": library.songs_for(index)}})
+
+    @app.get("/rest/getCoverArt.view")
+    async def get_cover_art():
+        return Response(_cover_jpeg(), media_type="image/jpeg")
+
+    @app.get("/rest/stream.view")
+    async def stream():
+        return Response(_tone_wav(library.track_seconds), media_type="audio/wav")
+
+    return app
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class FakeSubsonicServer:
+    """Runs the fake server with uvicorn on a background thread.
+
+    Use as a context manager; `url` is the base URL to hand to Settings.subsonic_url.
+    """
+
+    def __init__(self, library: FakeLibrary):
+        self.library = library
+        self.app = create_fake_subsonic(library)
+        self.port = _free_port()
+        self.url = f"http://127.0.0.1:{self.port}"
+        config = uvicorn.Config(self.app, port=self.port, log_level="warning", lifespan="off")
+        self._server = uvicorn.Server(config)
+        self._thread = threading.Thread(target=self._server.run, daemon=True)
+
+    @property
+    def request_counts(self) -> dict[str, int]:
+        return self.app.state.request_counts
+
+    def __enter__(self):
+        self._thread.start()
+        deadline = time.monotonic() + 10
+        while not self._server.started:
+            if time.monotonic() > deadline:
+                raise RuntimeError("Fake Subsonic server did not start")
+            time.sleep(0.01)
+        return self
+
+    def __exit__(self, *args):
+        self._server.should_exit = True
+        self._thread.join()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve a synthetic Subsonic library")
+    parser.add_argument("--songs", type=int, default=1000)
+    parser.add_argument("--songs-per-album", type=int, default=10)
+    parser.add_argument("--track-seconds", type=int, default=30)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--port", type=int, default=4533)
+    args = parser.parse_args()
+
+    library = FakeLibrary(args.songs, args.songs_per_album, args.track_seconds, args.latency_ms)
+    uvicorn.run(create_fake_subsonic(library), port=args.port)
+
+
+if __name__ == "__main__":
+    main()
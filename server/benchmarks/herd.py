@@ -0,0 +1,153 @@
+"""Thundering-herd scenario: a whole VRChat instance starting the same track at once.
+
+Run with: uv run python -m benchmarks.herd [--clients 80] [--ffmpeg-seconds 3]
+
+Every simulated client requests the same cold `/{slot_id}.m3u8` at the same moment and
+then fetches the same leading segments, which is what happens when the host of an
+~80 person instance presses play. Reports playlist and segment latency percentiles,
+the number of ffmpeg launches per slot, and how saturated the default thread pool got.
+Exits non-zero if any slot was transcoded more than once.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+from collections import Counter
+from pathlib import Path
+
+from benchmarks.fake_subsonic import FakeLibrary, FakeSubsonicServer
+from benchmarks.run import FAKE_FFMPEG, _percentiles, _running_app, _settings
+
+
+class ThreadPoolSampler:
+    """Periodically samples the event loop's default executor."""
+
+    def __init__(self, interval: float = 0.01):
+        self._interval = interval
+        self._task: asyncio.Task | None = None
+        self.max_threads = 0
+        self.max_queued = 0
+        self.max_workers = 0
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            executor = loop._default_executor
+            if executor is not None:
+                self.max_workers = executor._max_workers
+                self.max_threads = max(self.max_threads, len(executor._threads))
+                self.max_queued = max(self.max_queued, executor._work_queue.qsize())
+            await asyncio.sleep(self._interval)
+
+    def __enter__(self):
+        self._task = asyncio.create_task(self._run())
+        return self
+
+    def __exit__(self, *args):
+        self._task.cancel()
+
+    def report(self) -> dict:
+        return {
+            "max_workers": self.max_workers,
+            "max_threads": self.max_threads,
+            "max_queued_calls": self.max_queued,
+            "saturated": self.max_queued > 0,
+        }
+
+
+async def _client(http, slot_id: str, segments: int) -> tuple[float, list[float]]:
+    start = time.perf_counter()
+    resp = await http.get(f"/{slot_id}.m3u8")
+    resp.raise_for_status()
+    playlist_latency = time.perf_counter() - start
+
+    urls = [line for line in resp.text.splitlines() if line and not line.startswith("#")]
+    segment_latencies = []
+    for url in urls[:segments]:
+        path = "/" + url.split("://", 1)[-1].split("/", 1)[-1]
+        start = time.perf_counter()
+        seg = await http.get(path)
+        seg.raise_for_status()
+        segment_latencies.append(time.perf_counter() - start)
+    return playlist_latency, segment_latencies
+
+
+async def run_herd(
+    clients: int = 80,
+    slot_ids: tuple[str, ...] = ("0001",),
+    segments: int = 3,
+    ffmpeg_seconds: float = 2.0,
+    work_dir: Path | None = None,
+) -> dict:
+    """Run the scenario in-process with the fake ffmpeg and return a report."""
+    with tempfile.TemporaryDirectory() as tmp:
+        work_dir = work_dir or Path(tmp)
+        wrapper = work_dir / "fake-ffmpeg"
+        wrapper.write_text(f'#!/bin/sh\nexec "{sys.executable}" "{FAKE_FFMPEG}" "$@"\n')
+        wrapper.chmod(0o755)
+        launch_log = work_dir / "launches.log"
+
+        saved_env = {
+            k: os.environ.get(k) for k in ("FAKE_FFMPEG_SECONDS", "FAKE_FFMPEG_LAUNCH_LOG")
+        }
+        os.environ["FAKE_FFMPEG_SECONDS"] = str(ffmpeg_seconds)
+        os.environ["FAKE_FFMPEG_LAUNCH_LOG"] = str(launch_log)
+        try:
+            with FakeSubsonicServer(FakeLibrary(songs=100)) as server:
+                settings = _settings(server, work_dir / "cache", ffmpeg_path=str(wrapper))
+                async with _running_app(settings) as (_, http):
+                    with ThreadPoolSampler() as sampler:
+                        start = time.perf_counter()
+                        results = await asyncio.gather(
+                            *(
+                                _client(http, slot_ids[i % len(slot_ids)], segments)
+                                for i in range(clients)
+                            )
+                        )
+                        elapsed = time.perf_counter() - start
+        finally:
+            for key, value in saved_env.items():
+                if value is None:
+                    os.environ.pop(key, None)
+                else:
+                    os.environ[key] = value
+
+        launches = Counter()
+        if launch_log.exists():
+            for line in launch_log.read_text().splitlines():
+                # The playlist path is .../segments/<slot_id>/index.m3u8
+                launches[Path(line.split(" ", 1)[1]).parent.name] += 1
+
+    return {
+        "clients": clients,
+        "slots": list(slot_ids),
+        "ffmpeg_seconds": ffmpeg_seconds,
+        "wall_seconds": round(elapsed, 3),
+        "playlist_latency": _percentiles([p for p, _ in results]),
+        "segment_latency": _percentiles([s for _, segs in results for s in segs]),
+        "ffmpeg_launches": {slot: launches.get(slot, 0) for slot in slot_ids},
+        "thread_pool": sampler.report(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--clients", type=int, default=80)
+    parser.add_argument("--slots", type=int, default=1, help="Distinct slots requested")
+    parser.add_argument("--segments", type=int, default=3, help="Segments fetched per client")
+    parser.add_argument("--ffmpeg-seconds", type=float, default=3.0)
+    args = parser.parse_args()
+
+    slot_ids = tuple(f"{i + 1:04d}" for i in range(args.slots))
+    report = asyncio.run(run_herd(args.clients, slot_ids, args.segments, args.ffmpeg_seconds))
+    print(json.dumps(report, indent=2))
+    if any(count > 1 for count in report["ffmpeg_launches"].values()):
+        raise SystemExit("FAIL: a slot was transcoded more than once")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""Compare cache file counts and walk times for per-segment vs packed HLS output.
+
+Run with: uv run python -m benchmarks.packing [--slots 1000] [--segments 24]
+
+Builds two synthetic cache trees (one `segNNN.ts` per segment vs one packed `media.ts`
+per track), then times a full directory walk and `CacheManager.cleanup()` over each.
+Results are printed as JSON.
+"""
+
+import argparse
+import json
+import os
+import tempfile
+import time
+from pathlib import Path
+
+from subsonic_proxy.cache import CacheManager
+
+SEGMENT_BYTES = 256 * 1024
+
+
+def _build_tree(root: Path, slots: int, segments: int, packed: bool):
+    for slot in range(1, slots + 1):
+        slot_dir = root / "segments" / f"{slot:04d}"
+        slot_dir.mkdir(parents=True)
+        lines = ["#EXTM3U", "#EXT-X-VERSION:4", "#EXT-X-TARGETDURATION:10"]
+        if packed:
+            for i in range(segments):
+                lines += [
+                    "#EXTINF:10.0,",
+                    f"#EXT-X-BYTERANGE:{SEGMENT_BYTES}@{i * SEGMENT_BYTES}",
+                    "media.ts",
+                ]
+            with open(slot_dir / "media.ts", "wb") as f:
+                f.truncate(SEGMENT_BYTES * segments)
+        else:
+            for i in range(segments):
+                lines += ["#EXTINF:10.0,", f"seg{i:03d}.ts"]
+                with open(slot_dir / f"seg{i:03d}.ts", "wb") as f:
+                    f.truncate(SEGMENT_BYTES)
+        lines.append("#EXT-X-ENDLIST")
+        (slot_dir / "index.m3u8").write_text("\n".join(lines) + "\n")
+        (slot_dir / "cover.jpg").write_bytes(b"\xff\xd8\xff\xe0")
+        (slot_dir / "rendered.jpg").write_bytes(b"\xff\xd8\xff\xe0")
+
+
+def _measure(root: Path, slots: int, segments: int, packed: bool) -> dict:
+    start = time.perf_counter()
+    _build_tree(root, slots, segments, packed)
+    build_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    file_count = sum(len(files) for _, _, files in os.walk(root))
+    walk_s = time.perf_counter() - start
+
+    # Nothing is expired, so this measures the pure scan cost of cleanup()
+    manager = CacheManager(cache_dir=root, ttl_seconds=3600)
+    start = time.perf_counter()
+    manager.cleanup()
+    cleanup_s = time.perf_counter() - start
+
+    return {
+        "files": file_count,
+        "build_seconds": round(build_s, 4),
+        "walk_seconds": round(walk_s, 4),
+        "cleanup_seconds": round(cleanup_s, 4),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--slots", type=int, default=1000)
+    parser.add_argument("--segments", type=int, default=24, help="Segments per track")
+    args = parser.parse_args()
+
+    results = {"slots": args.slots, "segments_per_track": args.segments}
+    for name, packed in (("per_segment", False), ("packed", True)):
+        with tempfile.TemporaryDirectory() as tmp:
+            results[name] = _measure(Path(tmp), args.slots, args.segments, packed)
+
+    results["file_count_ratio"] = round(
+        results["per_segment"]["files"] / results["packed"]["files"], 2
+    )
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,284 @@
+"""Performance benchmarks for the proxy against a local fake Subsonic server.
+
+Run with: uv run python -m benchmarks.run [--sizes 1000,10000,50000] [--output results.json]
+
+Measures metadata build time vs library size, startup time (cold and with cached
+metadata; until the app serves and until metadata is built), /metadata.json throughput,
+playlist latency on transcode cache miss and hit, segment throughput, and concurrent
+transcode throughput. Uses the real ffmpeg when it is on PATH and the fake one from
+tests/ otherwise (reported as "ffmpeg" in the output). Results are emitted as JSON so
+runs can be diffed for regressions.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import asynccontextmanager
+from pathlib import Path
+
+from httpx import ASGITransport, AsyncClient
+
+from benchmarks.fake_subsonic import FakeLibrary, FakeSubsonicServer
+from subsonic_proxy.app import create_app
+from subsonic_proxy.config import Settings
+from subsonic_proxy.metadata import MetadataBuilder
+from subsonic_proxy.subsonic import SubsonicClient
+
+FAKE_FFMPEG = Path(__file__).parent.parent / "tests" / "fake_ffmpeg.py"
+
+
+def _percentiles(samples: list[float]) -> dict:
+    if not samples:
+        return {}
+    ordered = sorted(samples)
+
+    def pct(p: float) -> float:
+        return ordered[min(int(p * len(ordered)), len(ordered) - 1)]
+
+    return {
+        "count": len(ordered),
+        "mean_ms": round(statistics.fmean(ordered) * 1000, 3),
+        "p50_ms": round(pct(0.50) * 1000, 3),
+        "p99_ms": round(pct(0.99) * 1000, 3),
+        "max_ms": round(ordered[-1] * 1000, 3),
+    }
+
+
+def _resolve_ffmpeg(choice: str, work_dir: Path) -> tuple[str, str]:
+    if choice != "fake":
+        path = shutil.which(choice if choice != "auto" else "ffmpeg")
+        if path:
+            return path, "real"
+        if choice != "auto":
+            raise SystemExit(f"{choice} not found on PATH")
+    wrapper = work_dir / "fake-ffmpeg"
+    wrapper.write_text(f'#!/bin/sh\nexec "{sys.executable}" "{FAKE_FFMPEG}" "$@"\n')
+    wrapper.chmod(0o755)
+    return str(wrapper), "fake"
+
+
+def _settings(server: FakeSubsonicServer, cache_dir: Path, **overrides) -> Settings:
+    return Settings(
+        subsonic_url=server.url,
+        subsonic_user="bench",
+        subsonic_password="bench",
+        cache_dir=str(cache_dir),
+        log_level="WARNING",
+        **overrides,
+    )
+
+
+@asynccontextmanager
+async def _running_app(settings: Settings):
+    app = create_app(settings)
+    async with app.router.lifespan_context(app):
+        # Startup serves whatever metadata is cached; wait for the background build
+        if app.state.svc.refresher.current is not None:
+            await app.state.svc.refresher.current.task
+        transport = ASGITransport(app=app)
+        async with AsyncClient(transport=transport, base_url="http://bench") as client:
+            yield app, client
+
+
+async def _gather_limited(coros, concurrency: int):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run(coro):
+        async with semaphore:
+            return await coro
+
+    return await asyncio.gather(*(run(c) for c in coros))
+
+
+async def bench_metadata_build(sizes: list[int], latency_ms: float, work_dir: Path) -> list:
+    results = []
+    for size in sizes:
+        library = FakeLibrary(songs=size, latency_ms=latency_ms)
+        with FakeSubsonicServer(library) as server:
+            settings = _settings(server, work_dir / f"meta-{size}", slot_count=size)
+            async with SubsonicClient(settings) as subsonic:
+                builder = MetadataBuilder(settings=settings, subsonic=subsonic)
+                start = time.perf_counter()
+                metadata = await builder.build(force_refresh=True)
+                elapsed = time.perf_counter() - start
+            results.append(
+                {
+                    "library_songs": size,
+                    "tracks": len(metadata.tracks),
+                    "seconds": round(elapsed, 3),
+                    "subsonic_requests": sum(server.request_counts.values()),
+                }
+            )
+    return results
+
+
+async def bench_startup(server: FakeSubsonicServer, work_dir: Path) -> dict:
+    settings = _settings(server, work_dir / "startup")
+    results = {}
+    for label in ("cold", "cached_metadata"):
+        app = create_app(settings)
+        start = time.perf_counter()
+        async with app.router.lifespan_context(app):
+            ready = time.perf_counter() - start
+            if app.state.svc.refresher.current is not None:
+                await app.state.svc.refresher.current.task
+            results[label] = {
+                "ready_seconds": round(ready, 3),
+                "metadata_seconds": round(time.perf_counter() - start, 3),
+            }
+    return results
+
+
+async def bench_metadata_throughput(client: AsyncClient, requests: int, concurrency: int):
+    async def one():
+        resp = await client.get("/metadata.json")
+        return len(resp.content)
+
+    start = time.perf_counter()
+    sizes = await _gather_limited([one() for _ in range(requests)], concurrency)
+    elapsed = time.perf_counter() - start
+    return {
+        "requests": requests,
+        "concurrency": concurrency,
+        "requests_per_second": round(requests / elapsed, 1),
+        "response_bytes": sizes[0],
+    }
+
+
+async def _timed_get(client: AsyncClient, url: str) -> tuple[float, bytes]:
+    start = time.perf_counter()
+    resp = await client.get(url)
+    resp.raise_for_status()
+    return time.perf_counter() - start, resp.content
+
+
+async def bench_playlists(client: AsyncClient, slots: list[str]) -> dict:
+    misses = [(await _timed_get(client, f"/{slot}.m3u8"))[0] for slot in slots]
+    hits = [(await _timed_get(client, f"/{slot}.m3u8"))[0] for _ in range(20) for slot in slots]
+    return {"miss": _percentiles(misses), "hit": _percentiles(hits)}
+
+
+async def bench_segments(client: AsyncClient, slot: str, requests: int, concurrency: int):
+    playlist = (await client.get(f"/{slot}.m3u8")).text
+    urls = [line for line in playlist.splitlines() if line and not line.startswith("#")]
+    paths = [url.split("://", 1)[-1].split("/", 1)[-1] for url in urls]
+
+    async def one(i: int):
+        return await _timed_get(client, "/" + paths[i % len(paths)])
+
+    start = time.perf_counter()
+    results = await _gather_limited([one(i) for i in range(requests)], concurrency)
+    elapsed = time.perf_counter() - start
+    total_bytes = sum(len(body) for _, body in results)
+    return {
+        "requests": requests,
+        "concurrency": concurrency,
+        "requests_per_second": round(requests / elapsed, 1),
+        "megabytes_per_second": round(total_bytes / elapsed / 1024 / 1024, 2),
+        "latency": _percentiles([latency for latency, _ in results]),
+    }
+
+
+async def bench_concurrent_transcodes(client: AsyncClient, slots: list[str]) -> dict:
+    start = time.perf_counter()
+    latencies = await asyncio.gather(*(_timed_get(client, f"/{slot}.m3u8") for slot in slots))
+    elapsed = time.perf_counter() - start
+    return {
+        "transcodes": len(slots),
+        "seconds": round(elapsed, 3),
+        "transcodes_per_second": round(len(slots) / elapsed, 3),
+        "latency": _percentiles([latency for latency, _ in latencies]),
+    }
+
+
+def _git_revision() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run(args) -> dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        work_dir = Path(tmp)
+        ffmpeg_path, ffmpeg_kind = _resolve_ffmpeg(args.ffmpeg, work_dir)
+
+        results: dict = {
+            "environment": {
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "cpu_count": os.cpu_count(),
+                "ffmpeg": ffmpeg_kind,
+                "git_revision": _git_revision(),
+            },
+            "parameters": vars(args),
+        }
+        results["metadata_build"] = await bench_metadata_build(
+            args.sizes, args.latency_ms, work_dir
+        )
+
+        library = FakeLibrary(
+            songs=args.songs, track_seconds=args.track_seconds, latency_ms=args.latency_ms
+        )
+        with FakeSubsonicServer(library) as server:
+            results["startup"] = await bench_startup(server, work_dir)
+
+            settings = _settings(
+                server,
+                work_dir / "serve",
+                ffmpeg_path=ffmpeg_path,
+                max_concurrent_transcodes=args.transcode_concurrency,
+            )
+            async with _running_app(settings) as (_, client):
+                results["metadata_json"] = await bench_metadata_throughput(
+                    client, args.requests, args.concurrency
+                )
+                results["playlist"] = await bench_playlists(client, ["0001", "0002", "0003"])
+                results["segments"] = await bench_segments(
+                    client, "0001", args.requests, args.concurrency
+                )
+                concurrent_slots = [f"{i:04d}" for i in range(10, 10 + args.transcodes)]
+                results["concurrent_transcodes"] = await bench_concurrent_transcodes(
+                    client, concurrent_slots
+                )
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--sizes",
+        type=lambda s: [int(x) for x in s.split(",")],
+        default=[1000, 10000, 50000],
+        help="Library sizes (songs) for the metadata build benchmark",
+    )
+    parser.add_argument("--songs", type=int, default=2000, help="Library size for serving")
+    parser.add_argument("--track-seconds", type=int, default=30)
+    parser.add_argument("--latency-ms", type=float, default=2.0, help="Fake Subsonic latency")
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--transcodes", type=int, default=6)
+    parser.add_argument("--transcode-concurrency", type=int, default=3)
+    parser.add_argument("--ffmpeg", default="auto", help="auto, fake, or an ffmpeg path")
+    parser.add_argument("--output", type=Path, help="Write JSON here as well as stdout")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    text = json.dumps(results, indent=2, default=str)
+    print(text)
+    if args.output:
+        args.output.write_text(text + "\n")
+
+
+if __name__ == "__main__":
+    main()
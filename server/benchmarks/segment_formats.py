@@ -0,0 +1,117 @@
+"""Compare HLS output size for MPEG-TS vs fMP4 (CMAF) segments.
+
+Run with: uv run python -m benchmarks.segment_formats [--corpus DIR] [--tracks 5]
+
+Transcodes every audio file in the corpus (or a generated corpus of test tones when
+--corpus is omitted) through HLSTranscoder._run_ffmpeg once per segment type, and
+prints total bytes per format as JSON. Requires ffmpeg on PATH.
+"""
+
+import argparse
+import asyncio
+import json
+import shutil
+import subprocess
+import tempfile
+from pathlib import Path
+from unittest.mock import MagicMock
+
+from PIL import Image
+
+from subsonic_proxy.cache import CacheManager
+from subsonic_proxy.config import Settings
+from subsonic_proxy.transcoder import HLSTranscoder
+
+AUDIO_SUFFIXES = {".mp3", ".flac", ".ogg", ".opus", ".m4a", ".wav"}
+
+
+def _generate_corpus(corpus_dir: Path, tracks: int, ffmpeg_path: str) -> list[Path]:
+    corpus_dir.mkdir(parents=True, exist_ok=True)
+    paths = []
+    for i in range(tracks):
+        path = corpus_dir / f"tone{i:02d}.mp3"
+        subprocess.run(
+            [
+                ffmpeg_path,
+                "-y",
+                "-loglevel",
+                "error",
+                "-f",
+                "lavfi",
+                "-i",
+                f"sine=frequency={220 + 110 * i}:duration={60 + 30 * i}",
+                "-b:a",
+                "192k",
+                str(path),
+            ],
+            check=True,
+        )
+        paths.append(path)
+    return paths
+
+
+def _output_bytes(output_dir: Path) -> tuple[int, int]:
+    media = [f for f in output_dir.iterdir() if f.suffix in (".ts", ".m4s", ".mp4")]
+    return sum(f.stat().st_size for f in media), len(media)
+
+
+async def _run(corpus: list[Path], work_dir: Path, ffmpeg_path: str) -> dict:
+    cover_path = work_dir / "rendered.jpg"
+    Image.new("RGB", (640, 640), (26, 26, 46)).save(cover_path, "JPEG", quality=85)
+
+    results: dict[str, dict] = {}
+    for segment_type in ("mpegts", "fmp4"):
+        settings = Settings(
+            subsonic_url="http://unused.invalid",
+            subsonic_user="bench",
+            subsonic_password="bench",
+            cache_dir=str(work_dir / segment_type),
+            ffmpeg_path=ffmpeg_path,
+            hls_segment_type=segment_type,
+        )
+        transcoder = HLSTranscoder(
+            settings=settings,
+            cache_manager=CacheManager(settings.cache_dir, settings.cache_ttl_seconds),
+            subsonic_client=MagicMock(),
+        )
+        per_track = {}
+        for track in corpus:
+            output_dir = work_dir / segment_type / track.stem
+            output_dir.mkdir(parents=True)
+            await transcoder._run_ffmpeg(str(track), output_dir, cover_path)
+            size, files = _output_bytes(output_dir)
+            per_track[track.name] = {"bytes": size, "files": files}
+        results[segment_type] = {
+            "total_bytes": sum(t["bytes"] for t in per_track.values()),
+            "tracks": per_track,
+        }
+
+    ts_bytes = results["mpegts"]["total_bytes"]
+    fmp4_bytes = results["fmp4"]["total_bytes"]
+    results["fmp4_savings_percent"] = round(100 * (ts_bytes - fmp4_bytes) / ts_bytes, 2)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--corpus", type=Path, help="Directory of audio files to transcode")
+    parser.add_argument("--tracks", type=int, default=5, help="Generated tracks if no corpus")
+    parser.add_argument("--ffmpeg", default="ffmpeg")
+    args = parser.parse_args()
+
+    if shutil.which(args.ffmpeg) is None:
+        raise SystemExit(f"{args.ffmpeg} not found on PATH")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        work_dir = Path(tmp)
+        if args.corpus:
+            corpus = sorted(p for p in args.corpus.iterdir() if p.suffix in AUDIO_SUFFIXES)
+        else:
+            corpus = _generate_corpus(work_dir / "corpus", args.tracks, args.ffmpeg)
+        results = asyncio.run(_run(corpus, work_dir, args.ffmpeg))
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
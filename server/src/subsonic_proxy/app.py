@@ -1,26 +1,528 @@
+import asyncio
+import contextlib
 import logging
+import queue
 import re
+import shutil
+import tempfile
+import threading
+import time
+from collections.abc import AsyncIterator, Callable
 from contextlib import asynccontextmanager
+from dataclasses import asdict
+from email.utils import formatdate, parsedate_to_datetime
 from pathlib import Path
 
-from fastapi import FastAPI, HTTPException
+import httpx
+from fastapi import Depends, FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse, Response
+from fastapi.responses import (
+    FileResponse,
+    PlainTextResponse,
+    RedirectResponse,
+    Response,
+    StreamingResponse,
+)
 
-from subsonic_proxy.cache import CacheManager
+from subsonic_proxy import metrics
+from subsonic_proxy.atlas import AtlasBuilder
+from subsonic_proxy.cache import (
+    CachedPlaylist,
+    CacheManager,
+    PlaylistCache,
+    SegmentCache,
+    encode_version,
+)
+from subsonic_proxy.cluster import FORWARDED_HEADER, Cluster
 from subsonic_proxy.config import Settings
-from subsonic_proxy.metadata import MetadataBuilder, MetadataResponse
-from subsonic_proxy.subsonic import SubsonicClient
+from subsonic_proxy.coordination import WorkerCoordinator
+from subsonic_proxy.library import LocalLibrary
+from subsonic_proxy.loudness import LoudnessAnalyzer
+from subsonic_proxy.metadata import MetadataBuilder, MetadataResponse, TrackInfo
+from subsonic_proxy.profiling import (
+    PROFILE_ID_RE,
+    LoopMonitor,
+    ProfilingMiddleware,
+    profile_dir,
+)
+from subsonic_proxy.radio import RadioChannel
+from subsonic_proxy.refresh import RefreshManager, new_job_id
+from subsonic_proxy.snapshot import (
+    METADATA_NAME,
+    Manifest,
+    SnapshotError,
+    install_snapshot,
+    read_snapshot,
+    write_snapshot,
+)
+from subsonic_proxy.subsonic import SubsonicClient, SubsonicUnavailable
 from subsonic_proxy.transcoder import HLSTranscoder, TranscodeError
 
+SEGMENT_MEDIA_TYPES = {
+    ".ts": "video/mp2t",
+    ".m4s": "video/iso.segment",
+    ".mp4": "video/mp4",
+}
+ENCODE_VERSION_RE = re.compile(r"[0-9a-f]+")
+
 
 class AppState:
     settings: Settings
     subsonic: SubsonicClient
     transcoder: HLSTranscoder
     cache: CacheManager
+    playlist_cache: PlaylistCache
+    segment_cache: SegmentCache
     metadata_builder: MetadataBuilder
     metadata: MetadataResponse
+    atlas: AtlasBuilder
+    atlas_task: asyncio.Task | None = None
+    refresher: RefreshManager
+    periodic_refresh_task: asyncio.Task | None = None
+    coordinator: WorkerCoordinator | None = None
+    coordination_task: asyncio.Task | None = None
+    cluster: Cluster | None = None
+    library: LocalLibrary | None = None
+    loudness: LoudnessAnalyzer | None = None
+    loudness_task: asyncio.Task | None = None
+    loop_monitor: LoopMonitor | None = None
+    radio: RadioChannel | None = None
+    radio_task: asyncio.Task | None = None
+
+
+def schedule_atlas_build(state: AppState):
+    """Rebuild cover atlases in the background for the current metadata."""
+    logger = logging.getLogger(__name__)
+
+    async def run():
+        try:
+            atlas_map = await state.atlas.build(state.metadata)
+            logger.info(f"Cover atlas ready: {atlas_map['page_count']} pages")
+        except Exception:
+            logger.exception("Cover atlas build failed")
+
+    state.atlas_task = asyncio.create_task(run())
+
+
+def schedule_loudness_analysis(state: AppState):
+    """Measure the loudness of newly assigned songs in the background."""
+    if state.loudness is None:
+        return
+    logger = logging.getLogger(__name__)
+
+    async def run():
+        songs = [song for _, song in state.metadata_builder.store.slot_songs()]
+        try:
+            await state.loudness.run(songs)
+        except Exception:
+            logger.exception("Loudness analysis failed")
+
+    # Measurements are stored as they finish, so a superseded batch loses nothing
+    if state.loudness_task is not None:
+        state.loudness_task.cancel()
+    state.loudness_task = asyncio.create_task(run())
+
+
+def apply_metadata(state: AppState, metadata: MetadataResponse):
+    """Swap in freshly built metadata and rebuild the atlas for it.
+
+    A single assignment, so requests see either the old metadata or the new, never a
+    mix; until a refresh finishes they keep being served the previous version.
+    """
+    state.metadata = metadata
+    schedule_atlas_build(state)
+    schedule_loudness_analysis(state)
+
+
+def is_leader(state: AppState) -> bool:
+    """Whether this worker builds metadata (always true outside multi_worker mode)."""
+    return state.coordinator is None or state.coordinator.is_leader
+
+
+def start_leader_duties(state: AppState, fresh: bool):
+    """Refresh stale metadata and start periodic refreshes on the leader worker."""
+    if not fresh:
+        logging.getLogger(__name__).info("Metadata missing or stale; refreshing in the background")
+        state.refresher.start("startup")
+    interval = state.settings.metadata_refresh_interval_seconds
+    if interval > 0 and state.periodic_refresh_task is None:
+        state.periodic_refresh_task = asyncio.create_task(state.refresher.run_periodic(interval))
+
+
+def reload_metadata(state: AppState):
+    """Pick up metadata another worker wrote to the store.
+
+    On the leader, metadata it didn't build itself (e.g. a snapshot imported through a
+    follower) also gets its atlas and loudness work; its own builds are already applied.
+    """
+    cached, _ = state.metadata_builder.load_cached()
+    if cached is None:
+        return
+    if not is_leader(state):
+        state.metadata = cached
+    elif cached != state.metadata:
+        apply_metadata(state, cached)
+    else:
+        return
+    logging.getLogger(__name__).info(f"Reloaded metadata from store: {len(cached.tracks)} tracks")
+
+
+async def apply_snapshot(state: AppState, manifest: Manifest, installed: list[str]):
+    """Bring in-memory state in line with an imported snapshot.
+
+    Works from the manifest alone: RAM-cached segments of the replaced slots are
+    dropped and their leading segments preloaded, without walking the cache tree.
+    Rewritten playlists are keyed on the playlist's mtime, so they miss on their own.
+    Only the leader follows the new metadata with atlas and loudness work; followers
+    just reload it.
+    """
+    if is_leader(state):
+        cached, _ = state.metadata_builder.load_cached()
+        if cached is not None:
+            apply_metadata(state, cached)
+    else:
+        reload_metadata(state)
+    slot_files = manifest.slot_files()
+    prefetch = state.settings.segment_cache_prefetch
+    # Superseded hot tier copies were retired by install_snapshot
+    for f in manifest.files:
+        if f.path.startswith("audio/"):
+            state.cache.forget(f.path)
+    for slot_id in installed:
+        state.cache.forget(f"segments/{slot_id}")
+        state.segment_cache.invalidate_slot(slot_id)
+        names = sorted(n for n in slot_files[slot_id] if n.startswith("seg"))[:prefetch]
+        names += sorted(n for n in slot_files[slot_id] if n.startswith("init"))[:1]
+        slot_dir = state.cache.slot_dir(slot_id)
+        version = encode_version(slot_dir / "index.m3u8")
+        for name in names:
+            data = await asyncio.to_thread((slot_dir / name).read_bytes)
+            state.segment_cache.put(slot_id, f"{version}/{name}", data)
+
+
+class _ChunkPipe:
+    """A bounded, file-like pipe between threads, e.g. a worker thread writing while the
+    event loop reads, or the other way round.
+
+    Writes are gathered into chunks of chunk_size bytes, and a writer that gets more
+    than a few chunks ahead of the reader blocks. Once either side stops, writes raise
+    OSError so the writer unwinds.
+    """
+
+    def __init__(self, chunk_size: int = 1024 * 1024, max_chunks: int = 4):
+        self._chunk_size = chunk_size
+        self._buffer = bytearray()
+        self._chunks: queue.Queue[bytes | None] = queue.Queue(max_chunks)
+        self._stopped = threading.Event()
+        self._unread = memoryview(b"")
+        self._ended = False
+
+    def _put(self, item: bytes | None):
+        while not self._stopped.is_set():
+            try:
+                self._chunks.put(item, timeout=0.5)
+                return
+            except queue.Full:
+                continue
+        raise OSError("Reader went away")
+
+    def write(self, data: bytes) -> int:
+        self._buffer += data
+        if len(self._buffer) >= self._chunk_size:
+            self._put(bytes(self._buffer))
+            self._buffer.clear()
+        return len(data)
+
+    def close(self):
+        """Flush what is buffered and mark the end of the stream (writer side)."""
+        if self._buffer:
+            self._put(bytes(self._buffer))
+            self._buffer.clear()
+        self.end()
+
+    def end(self):
+        """Mark the end of the stream without flushing, e.g. after the writer failed."""
+        self._put(None)
+
+    def get(self) -> bytes | None:
+        """The next chunk, or None at the end of the stream (reader side)."""
+        while not self._stopped.is_set():
+            try:
+                return self._chunks.get(timeout=0.5)
+            except queue.Empty:
+                continue
+        return None
+
+    def read(self, size: int = -1) -> bytes:
+        """Up to size bytes, or everything left if size is negative; b"" at the end of the
+        stream (reader side). Like a socket, it returns a short read rather than wait
+        for more data than the current chunk holds."""
+        if size < 0:
+            return b"".join(iter(lambda: self.read(self._chunk_size), b""))
+        if not self._unread and not self._ended:
+            chunk = self.get()
+            if chunk is None:
+                self._ended = True
+            else:
+                self._unread = memoryview(chunk)
+        part = bytes(self._unread[:size])
+        self._unread = self._unread[size:]
+        return part
+
+    def stop(self):
+        self._stopped.set()
+
+
+async def _stream_from_thread(write: Callable[[_ChunkPipe], None]) -> AsyncIterator[bytes]:
+    """Run write(pipe) in a worker thread and yield what it writes as it goes.
+
+    If write raises, the stream ends by raising the same exception, so a response
+    built on it aborts instead of looking complete or hanging.
+    """
+    pipe = _ChunkPipe()
+
+    def run():
+        try:
+            write(pipe)
+        except BaseException:
+            with contextlib.suppress(OSError):  # The reader is already gone
+                pipe.end()
+            raise
+        pipe.close()
+
+    writer = asyncio.ensure_future(asyncio.to_thread(run))
+    # Mark the writer's error retrieved when the reader leaves before the end
+    writer.add_done_callback(lambda t: t.cancelled() or t.exception())
+    try:
+        while (chunk := await asyncio.to_thread(pipe.get)) is not None:
+            yield chunk
+        await writer
+    finally:
+        pipe.stop()
+
+
+def require_admin(request: Request):
+    """Guard /admin routes with the configured admin token, if any."""
+    state: AppState = request.app.state.svc
+    token = state.settings.admin_token
+    if token and request.headers.get("x-admin-token") != token:
+        raise HTTPException(403, "Admin token required")
+
+
+def _rewrite_playlist(content: str, prefix: str) -> str:
+    """Make every relative URI in an HLS playlist absolute under prefix.
+
+    Covers plain URI lines (segments, packed media files) as well as URI="..."
+    attributes on tags such as EXT-X-MAP.
+    """
+    lines = []
+    for line in content.splitlines():
+        if line and not line.startswith("#"):
+            if "://" not in line:
+                line = f"{prefix}/{line}"
+        elif 'URI="' in line:
+            line = re.sub(
+                r'URI="([^"]+)"',
+                lambda m: m.group(0) if "://" in m.group(1) else f'URI="{prefix}/{m.group(1)}"',
+                line,
+            )
+        lines.append(line)
+    return "\n".join(lines) + "\n"
+
+
+def _parse_range(header: str, size: int) -> tuple[int, int] | None:
+    """Parse a single-range `bytes=` header into an inclusive (start, end) pair.
+
+    Returns None for anything else (multiple ranges, malformed or unsatisfiable), in
+    which case callers fall back to FileResponse's full Range handling.
+    """
+    unit, _, spec = header.partition("=")
+    if unit.strip() != "bytes" or "," in spec:
+        return None
+    start_s, _, end_s = spec.strip().partition("-")
+    try:
+        if start_s:
+            start = int(start_s)
+            end = int(end_s) if end_s else size - 1
+        else:
+            start = size - int(end_s)
+            end = size - 1
+    except ValueError:
+        return None
+    end = min(end, size - 1)
+    if start < 0 or start > end:
+        return None
+    return start, end
+
+
+def _bytes_response(
+    data: bytes, request: Request, headers: dict[str, str], media_type: str
+) -> Response | None:
+    """Serve an in-memory segment, honouring single byte ranges for packed media files.
+
+    Returns None if the request's Range header needs the full disk-backed handling.
+    """
+    headers = {**headers, "Accept-Ranges": "bytes"}
+    range_header = request.headers.get("range")
+    if range_header is not None:
+        byte_range = _parse_range(range_header, len(data))
+        if byte_range is None:
+            return None
+        start, end = byte_range
+        headers["Content-Range"] = f"bytes {start}-{end}/{len(data)}"
+        return Response(
+            data[start : end + 1], status_code=206, media_type=media_type, headers=headers
+        )
+    return Response(data, media_type=media_type, headers=headers)
+
+
+def _not_modified(request: Request, playlist: CachedPlaylist) -> bool:
+    """Evaluate conditional request headers against a cached playlist."""
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        return "*" in tags or playlist.etag in tags
+
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since is not None:
+        try:
+            since = parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+        return int(playlist.last_modified) <= since
+
+    return False
+
+
+def _playlist_headers(
+    state: AppState, playlist: CachedPlaylist, m3u8_path: Path, mtime: float
+) -> dict[str, str]:
+    headers = {
+        "ETag": playlist.etag,
+        "Last-Modified": formatdate(playlist.last_modified, usegmt=True),
+    }
+    if playlist.complete:
+        # Finished VOD playlists never change until the cache entry expires or is
+        # refreshed, which the per-file TTL decides
+        max_age = state.cache.max_age(m3u8_path, mtime)
+        headers["Cache-Control"] = f"public, max-age={int(max_age)}"
+    else:
+        headers["Cache-Control"] = "no-cache"
+    return headers
+
+
+def _slot_version(state: AppState, slot_id: str) -> str | None:
+    """The encode version of a slot's current transcode, or None if there is none."""
+    try:
+        return encode_version(state.cache.slot_dir(slot_id) / "index.m3u8")
+    except OSError:
+        return None
+
+
+def _encode_dir(state: AppState, slot_id: str, version: str) -> Path | None:
+    """The directory holding one encode of a slot: its current one, or one retired by a
+    re-encode that clients may still be playing. None if it is gone."""
+    if _slot_version(state, slot_id) == version:
+        return state.cache.slot_dir(slot_id)
+    if not ENCODE_VERSION_RE.fullmatch(version):
+        return None
+    retired = state.cache.retired_slot_dir(slot_id, version)
+    return retired if retired.is_dir() else None
+
+
+def _playlist_response(
+    state: AppState, request: Request, key: str, m3u8_path: Path, slot_id: str, version: str
+) -> Response:
+    """Serve an HLS playlist with its URIs made absolute, cached per encode.
+
+    URIs carry the slot's encode version, so a re-encode of the slot never reuses a
+    segment URL and segments can be cached as immutable.
+    """
+    base_url = state.settings.base_url.rstrip("/")
+    stat = m3u8_path.stat()
+    mtime = stat.st_mtime_ns
+    playlist = state.playlist_cache.get(key, mtime, base_url)
+    if playlist is None:
+        content = _rewrite_playlist(
+            m3u8_path.read_text(), f"{base_url}/segments/{slot_id}/{version}"
+        )
+        playlist = state.playlist_cache.put(key, mtime, base_url, content, mtime / 1e9)
+
+    headers = _playlist_headers(state, playlist, m3u8_path, stat.st_mtime)
+    if _not_modified(request, playlist):
+        return Response(status_code=304, headers=headers)
+    return Response(playlist.body, media_type="application/vnd.apple.mpegurl", headers=headers)
+
+
+def _audio_response(path: Path, slot_id: str) -> FileResponse:
+    return FileResponse(
+        path,
+        media_type="audio/mpeg",
+        headers={
+            "Accept-Ranges": "bytes",
+            "Content-Disposition": f'inline; filename="{slot_id}.mp3"',
+        },
+    )
+
+
+def _local_source(state: AppState, slot_id: str, track: TrackInfo) -> Path | None:
+    """The slot's song file under local_music_root, if that mode is on and it's readable."""
+    if state.library is None:
+        return None
+    song = state.metadata_builder.store.slot_song(slot_id)
+    if song is None or song["id"] != track.id:  # Store already moved on to a new build
+        return None
+    return state.library.resolve(song["path"])
+
+
+def _track_info(state: AppState, slot_id: str, track: TrackInfo) -> dict:
+    """What the transcoder needs to know about a slot's track."""
+    track_info = {
+        "id": track.id,
+        "title": track.title,
+        "artist": track.artist,
+        "album": track.album,
+        "coverArt": track.cover_art,
+        "duration": track.duration,
+    }
+    local_path = _local_source(state, slot_id, track)
+    if local_path is not None:
+        track_info["local_path"] = str(local_path)
+    gain_db = state.loudness.gain_db(track.id) if state.loudness is not None else None
+    if gain_db is not None:
+        track_info["gain_db"] = gain_db
+    return track_info
+
+
+async def _prepare_radio_track(state: AppState, slot_id: str) -> Path:
+    """Transcode a queued radio slot, or find it cached."""
+    track = state.metadata.tracks.get(slot_id)
+    if track is None:  # Dropped by a metadata refresh since it was queued
+        raise TranscodeError(f"Slot {slot_id} is no longer assigned")
+    stream_url = state.subsonic.get_stream_url(track.id)
+    return await state.transcoder.ensure_transcoded(
+        slot_id, stream_url, _track_info(state, slot_id, track)
+    )
+
+
+def _radio(state: AppState) -> RadioChannel:
+    if state.radio is None:
+        raise HTTPException(404, "Radio is disabled in multi-worker mode")
+    return state.radio
+
+
+def _enqueue_radio(state: AppState, slot_id: str, play_next: bool) -> dict:
+    radio = _radio(state)
+    if slot_id not in state.metadata.tracks:
+        raise HTTPException(404, f"Slot {slot_id} not found")
+    if not radio.enqueue(slot_id, play_next=play_next):
+        raise HTTPException(409, "Radio queue is full")
+    return radio.to_dict()
+
+
+def _unavailable(state: AppState, e: SubsonicUnavailable) -> HTTPException:
+    retry_after = round(state.settings.subsonic_breaker_reset_seconds)
+    return HTTPException(503, str(e), headers={"Retry-After": str(retry_after)})
 
 
 def create_app(settings: Settings | None = None) -> FastAPI:
@@ -47,23 +549,128 @@ def create_app(settings: Settings | None = None) -> FastAPI:
         logger = logging.getLogger(__name__)
         logger.info("Starting Subsonic VRChat Proxy")
 
+        hot_dir = settings.hot_cache_dir or None
+        if hot_dir and settings.multi_worker:
+            # Each worker would account for the tier's size on its own and overfill it
+            logger.warning("The hot cache tier is disabled in multi-worker mode")
+            hot_dir = None
+
         state = AppState()
         state.settings = settings
         state.subsonic = SubsonicClient(settings)
         state.cache = CacheManager(
             cache_dir=Path(settings.cache_dir),
             ttl_seconds=settings.cache_ttl_seconds,
+            ttl_jitter=settings.cache_ttl_jitter,
+            popular_hits=settings.cache_popular_hits,
+            popular_multiplier=settings.cache_popular_ttl_multiplier,
+            refresh_ahead=settings.cache_refresh_ahead,
+            retired_seconds=settings.cache_retired_seconds,
+            hot_dir=hot_dir,
+            hot_max_bytes=settings.hot_cache_bytes,
         )
+        state.playlist_cache = PlaylistCache(max_entries=settings.slot_count)
+        state.segment_cache = SegmentCache(max_bytes=settings.segment_cache_bytes)
         state.transcoder = HLSTranscoder(
             settings=settings,
             cache_manager=state.cache,
             subsonic_client=state.subsonic,
+            segment_cache=state.segment_cache,
         )
         state.metadata_builder = MetadataBuilder(settings=settings, subsonic=state.subsonic)
-        state.metadata = await state.metadata_builder.build()
+        if settings.local_music_root:
+            state.library = LocalLibrary(
+                settings.local_music_root, settings.local_music_server_root
+            )
+            logger.info(f"Reading songs from {state.library.root} where possible")
+        if settings.loudness_normalization:
+            state.loudness = LoudnessAnalyzer(
+                settings, state.metadata_builder.store, state.subsonic, state.library
+            )
+        if settings.cluster_nodes:
+            state.cluster = Cluster(settings)
+            logger.info(f"Cluster mode: {len(state.cluster.nodes)} nodes")
+        if settings.multi_worker:
+            state.coordinator = WorkerCoordinator(settings, state.metadata_builder.store)
+            state.coordinator.try_become_leader()
+            logger.info(
+                f"Multi-worker mode: this worker is the "
+                f"{'leader' if state.coordinator.is_leader else 'follower'}"
+            )
+        state.refresher = RefreshManager(
+            state.metadata_builder,
+            on_complete=lambda metadata: apply_metadata(state, metadata),
+            on_update=state.coordinator.publish_job if state.coordinator else None,
+        )
+        state.atlas = AtlasBuilder(
+            settings=settings,
+            cache_manager=state.cache,
+            subsonic_client=state.subsonic,
+        )
+
+        # Serve the last known metadata right away, whatever its age, and crawl the
+        # library in the background so startup time doesn't depend on library size
+        cached, fresh = state.metadata_builder.load_cached()
+        state.metadata = cached if cached is not None else state.metadata_builder.empty()
+        if cached is not None:
+            metrics.CACHE_REQUESTS.labels("metadata", "hit" if fresh else "stale").inc()
+        else:
+            metrics.CACHE_REQUESTS.labels("metadata", "miss").inc()
+        if is_leader(state):
+            if cached is not None:
+                schedule_atlas_build(state)
+                schedule_loudness_analysis(state)
+            start_leader_duties(state, fresh)
+        if state.coordinator is not None:
+            state.coordination_task = asyncio.create_task(
+                state.coordinator.run(
+                    on_metadata_changed=lambda: reload_metadata(state),
+                    on_refresh_requested=lambda job_id: state.refresher.start(
+                        "manual", job_id=job_id
+                    ),
+                    on_promoted=lambda: start_leader_duties(
+                        state, fresh=state.metadata_builder.load_cached()[1]
+                    ),
+                )
+            )
+        if settings.multi_worker:
+            # Each worker would play its own queue, depending on which one a request hit
+            logger.warning("The radio channel is disabled in multi-worker mode")
+        else:
+            state.radio = RadioChannel(
+                prepare=lambda slot_id: _prepare_radio_track(state, slot_id),
+                segment_duration=settings.hls_segment_duration,
+                window_segments=settings.radio_window_segments,
+                prepare_ahead=settings.radio_prepare_ahead,
+                max_queue=settings.radio_max_queue,
+                prepare_timeout=settings.radio_prepare_timeout_seconds,
+            )
+            state.radio_task = asyncio.create_task(state.radio.run())
+        if settings.loop_block_threshold_ms > 0:
+            state.loop_monitor = LoopMonitor(threshold=settings.loop_block_threshold_ms / 1000)
+            state.loop_monitor.start()
         the_app.state.svc = state
         yield
+        refresh_task = state.refresher.current.task if state.refresher.current else None
+        for task in (
+            state.coordination_task,
+            state.periodic_refresh_task,
+            refresh_task,
+            state.atlas_task,
+            state.loudness_task,
+            state.radio_task,
+        ):
+            if task is not None:
+                task.cancel()
+        await asyncio.to_thread(state.atlas.close)
+        if state.coordinator is not None:
+            state.coordinator.release()
+        if state.loop_monitor is not None:
+            state.loop_monitor.stop()
+        if state.cluster is not None:
+            await state.cluster.close()
         await state.subsonic.close()
+        state.metadata_builder.close()
 
     application = FastAPI(title="Subsonic VRChat Proxy", lifespan=lifespan)
 
@@ -73,14 +680,75 @@ def create_app(settings: Settings | None = None) -> FastAPI:
         allow_methods=["*"],
         allow_headers=["*"],
     )
+    application.add_middleware(metrics.MetricsMiddleware)
+    application.add_middleware(ProfilingMiddleware)
+
+    @application.get("/metrics")
+    async def get_metrics():
+        return PlainTextResponse(
+            metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8"
+        )
 
     @application.get("/metadata.json")
     async def get_metadata():
         state: AppState = application.state.svc
         return state.metadata
 
+    @application.get("/atlas.json")
+    async def get_atlas_map():
+        state: AppState = application.state.svc
+        atlas_map = state.atlas.load_map()
+        if atlas_map is None:
+            raise HTTPException(404, "Atlas not built yet")
+        return atlas_map
+
+    @application.get("/atlas/{page}.jpg")
+    async def get_atlas_page(page: int):
+        state: AppState = application.state.svc
+        page_path = state.atlas.get_page_path(page)
+        if not page_path.exists():
+            raise HTTPException(404, "Atlas page not found")
+        return FileResponse(page_path, media_type="image/jpeg")
+
+    # Live radio channel. Every endpoint is a plain GET on a fixed URL, so worlds can
+    # pre-bake them as VRCUrls like the slot URLs
+    @application.get("/radio.m3u8")
+    async def get_radio_playlist():
+        state: AppState = application.state.svc
+        base_url = state.settings.base_url.rstrip("/")
+        content = _rewrite_playlist(_radio(state).playlist(), f"{base_url}/segments")
+        return Response(
+            content,
+            media_type="application/vnd.apple.mpegurl",
+            headers={"Cache-Control": "no-cache"},
+        )
+
+    @application.get("/radio.json")
+    async def get_radio():
+        return _radio(application.state.svc).to_dict()
+
+    @application.get("/radio/queue/{slot_id}")
+    async def queue_radio_track(slot_id: str):
+        return _enqueue_radio(application.state.svc, slot_id, play_next=False)
+
+    @application.get("/radio/next/{slot_id}")
+    async def queue_radio_track_next(slot_id: str):
+        return _enqueue_radio(application.state.svc, slot_id, play_next=True)
+
+    @application.get("/radio/skip")
+    async def skip_radio_track():
+        radio = _radio(application.state.svc)
+        radio.skip()
+        return radio.to_dict()
+
+    @application.get("/radio/clear")
+    async def clear_radio_queue():
+        radio = _radio(application.state.svc)
+        radio.clear()
+        return radio.to_dict()
+
     @application.get("/{slot_id}.m3u8")
-    async def get_hls_playlist(slot_id: str):
+    async def get_hls_playlist(slot_id: str, request: Request):
         state: AppState = application.state.svc
         logger = logging.getLogger(__name__)
 
@@ -89,39 +757,110 @@ def create_app(settings: Settings | None = None) -> FastAPI:
             raise HTTPException(404, f"Slot {slot_id} not found")
 
         track = state.metadata.tracks[slot_id]
-        stream_url = state.subsonic.get_stream_url(track.id)
 
-        # Prepare track info dict
-        track_info = {
-            "title": track.title,
-            "artist": track.artist,
-            "album": track.album,
-            "coverArt": track.cover_art,
-        }
+        forwarded_track = request.headers.get(FORWARDED_HEADER)
+        if forwarded_track is not None and forwarded_track != track.id:
+            raise HTTPException(409, f"Slot {slot_id} holds a different track on this node")
+        if (
+            state.cluster is not None
+            and forwarded_track is None
+            and not state.cluster.is_local(track.id)
+        ):
+            owner = state.cluster.owner(track.id)
+            if state.cluster.redirect:
+                metrics.CLUSTER_PLAYLIST_REQUESTS.labels("redirected").inc()
+                return RedirectResponse(f"{owner}/{slot_id}.m3u8", status_code=307)
+            upstream = await state.cluster.fetch_playlist(owner, slot_id, track.id, request.headers)
+            if upstream is not None:
+                metrics.CLUSTER_PLAYLIST_REQUESTS.labels("proxied").inc()
+                return Response(
+                    upstream.content,
+                    status_code=upstream.status_code,
+                    headers=state.cluster.response_headers(upstream),
+                )
+            # Owner unavailable: transcode here rather than fail the request
+            metrics.CLUSTER_PLAYLIST_REQUESTS.labels("fallback").inc()
 
+        stream_url = state.subsonic.get_stream_url(track.id)
+        track_info = _track_info(state, slot_id, track)
+
+        start = time.perf_counter()
+        cache_result = "hit" if state.transcoder.is_cached(slot_id) else "miss"
         try:
             logger.info(f"Serving HLS for slot {slot_id}: {track.title} - {track.artist}")
             m3u8_path = await state.transcoder.ensure_transcoded(slot_id, stream_url, track_info)
         except TranscodeError as e:
             logger.error(f"Transcoding failed for slot {slot_id}: {e}")
             raise HTTPException(502, f"Transcoding failed: {e}")
+        except SubsonicUnavailable as e:
+            raise _unavailable(state, e)
 
-        content = m3u8_path.read_text()
-        base_url = state.settings.base_url.rstrip("/")
-        content = re.sub(
-            r"(seg\d+\.ts)",
-            lambda m: f"{base_url}/segments/{slot_id}/{m.group(1)}",
-            content,
-        )
-        return Response(content, media_type="application/vnd.apple.mpegurl")
+        version = encode_version(m3u8_path)
+        response = _playlist_response(state, request, slot_id, m3u8_path, slot_id, version)
+        metrics.PLAYLIST_SECONDS.labels(cache_result).observe(time.perf_counter() - start)
+        return response
 
-    @application.get("/segments/{slot_id}/{segment_name}")
-    async def get_segment(slot_id: str, segment_name: str):
+    @application.get("/segments/{slot_id}/{version}/{segment_name}")
+    async def get_segment(slot_id: str, version: str, segment_name: str, request: Request):
         state: AppState = application.state.svc
-        segment_path = Path(state.settings.cache_dir) / "segments" / slot_id / segment_name
+        # A URL names one segment of one encode, so clients and front proxies may keep
+        # it for the life of the cache entry
+        headers = {
+            "Cache-Control": f"public, max-age={state.settings.cache_ttl_seconds}, immutable"
+        }
+        if segment_name.endswith(".m3u8"):
+            # A bitrate ladder's variant playlist, listed in the slot's master playlist
+            encode_dir = _encode_dir(state, slot_id, version)
+            if segment_name == "index.m3u8" or encode_dir is None:
+                raise HTTPException(404, "Playlist not found")
+            m3u8_path = encode_dir / segment_name
+            if not m3u8_path.exists():
+                raise HTTPException(404, "Playlist not found")
+            state.cache.touch(f"segments/{slot_id}")
+            return _playlist_response(
+                state, request, f"{slot_id}/{segment_name}", m3u8_path, slot_id, version
+            )
+        media_type = SEGMENT_MEDIA_TYPES.get(Path(segment_name).suffix)
+        if media_type is None:
+            raise HTTPException(404, "Segment not found")
+
+        # Keyed on the encode version, so RAM never holds another encode's bytes for
+        # this URL, even after a re-encode by another worker
+        cache_name = f"{version}/{segment_name}"
+        data = state.segment_cache.get(slot_id, cache_name)
+        if data is not None:
+            response = _bytes_response(data, request, headers, media_type)
+            if response is not None:
+                metrics.CACHE_REQUESTS.labels("segment", "ram").inc()
+                return response
+
+        encode_dir = _encode_dir(state, slot_id, version)
+        if encode_dir is None:
+            raise HTTPException(404, "Segment not found")
+        segment_path = encode_dir / segment_name
         if not segment_path.exists():
             raise HTTPException(404, "Segment not found")
-        return FileResponse(segment_path, media_type="video/mp2t")
+        state.cache.touch(f"segments/{slot_id}")
+
+        # Packed media files hold a whole track and are read by range, so they stay
+        # on disk, as does anything too big for the cache; check before reading it in
+        if (
+            data is None
+            and not segment_name.startswith("media")
+            and state.segment_cache.fits(segment_path.stat().st_size)
+            and state.segment_cache.should_admit(slot_id, cache_name)
+        ):
+            data = await asyncio.to_thread(segment_path.read_bytes)
+            state.segment_cache.put(slot_id, cache_name, data)
+            response = _bytes_response(data, request, headers, media_type)
+            if response is not None:
+                metrics.CACHE_REQUESTS.labels("segment", "disk").inc()
+                return response
+
+        # Cold segment: FileResponse hands the path to the server for zero-copy sendfile
+        # where the ASGI server supports it
+        metrics.CACHE_REQUESTS.labels("segment", "disk").inc()
+        return FileResponse(segment_path, media_type=media_type, headers=headers)
 
     @application.get("/{slot_id}.mp3")
     async def get_audio(slot_id: str):
@@ -136,47 +875,211 @@ def create_app(settings: Settings | None = None) -> FastAPI:
 
         track = state.metadata.tracks[slot_id]
 
+        # Same format as the library file: send it as is, without caching a copy
+        local_path = _local_source(state, slot_id, track)
+        audio_format = getattr(state.settings, "audio_format", "mp3")
+        if local_path is not None and local_path.suffix.lower() == f".{audio_format}":
+            metrics.SOURCE_READS.labels("audio", "local").inc()
+            return _audio_response(local_path, slot_id)
+
         # Check cache first
-        cache_path = Path(state.settings.cache_dir) / "audio" / f"{slot_id}.mp3"
+        cache_path = state.cache.audio_path(slot_id)
+        state.cache.record_access(cache_path)
         if cache_path.exists() and not state.cache.is_expired(cache_path):
+            metrics.CACHE_REQUESTS.labels("audio", "hit").inc()
+            state.cache.touch(f"audio/{slot_id}.mp3")
             logger.info(f"Serving cached audio for slot {slot_id}: {track.title}")
-            return FileResponse(
-                cache_path,
-                media_type="audio/mpeg",
-                headers={
-                    "Accept-Ranges": "bytes",
-                    "Content-Disposition": f'inline; filename="{slot_id}.mp3"',
-                },
-            )
+            return _audio_response(cache_path, slot_id)
 
         # Download from Subsonic and cache
+        metrics.CACHE_REQUESTS.labels("audio", "miss").inc()
+        metrics.SOURCE_READS.labels("audio", "subsonic").inc()
         logger.info(f"Downloading audio for slot {slot_id}: {track.title} - {track.artist}")
-        audio_format = getattr(state.settings, "audio_format", "mp3")
         max_bitrate = getattr(state.settings, "audio_max_bitrate", 320)
-        audio_data = await state.subsonic.get_audio_stream(
-            track.id, format=audio_format, max_bitrate=max_bitrate
-        )
+        try:
+            audio_data = await state.subsonic.get_audio_stream(
+                track.id, format=audio_format, max_bitrate=max_bitrate
+            )
+        except (SubsonicUnavailable, httpx.HTTPError) as e:
+            # Fall back to an expired copy rather than fail
+            if cache_path.exists():
+                logger.warning(f"Serving expired audio for slot {slot_id}: {e!r}")
+                metrics.CACHE_REQUESTS.labels("audio", "stale").inc()
+                return _audio_response(cache_path, slot_id)
+            if isinstance(e, SubsonicUnavailable):
+                raise _unavailable(state, e)
+            raise HTTPException(502, f"Audio download failed: {e}")
 
         # Save to cache
+        cache_path = state.cache.new_audio_path(slot_id)
         cache_path.parent.mkdir(parents=True, exist_ok=True)
         cache_path.write_bytes(audio_data)
+        await asyncio.to_thread(state.cache.admit, f"audio/{slot_id}.mp3")
 
         logger.info(f"Cached audio for slot {slot_id} ({len(audio_data) / 1024 / 1024:.2f} MB)")
 
-        return FileResponse(
-            cache_path,
-            media_type="audio/mpeg",
-            headers={
-                "Accept-Ranges": "bytes",
-                "Content-Disposition": f'inline; filename="{slot_id}.mp3"',
-            },
+        return _audio_response(cache_path, slot_id)
+
+    @application.get("/admin/transcodes", dependencies=[Depends(require_admin)])
+    async def get_transcode_timings(limit: int = 20):
+        state: AppState = application.state.svc
+        return {
+            "recent": [asdict(t) for t in state.transcoder.recent_timings(limit)],
+            "slowest": [asdict(t) for t in state.transcoder.slowest_timings(limit)],
+        }
+
+    @application.get("/jobs", dependencies=[Depends(require_admin)])
+    async def get_jobs():
+        state: AppState = application.state.svc
+        return {"jobs": [job.to_dict() for job in state.transcoder.jobs.values()]}
+
+    @application.get("/admin/profiles", dependencies=[Depends(require_admin)])
+    async def list_profiles():
+        state: AppState = application.state.svc
+        directory = profile_dir(state.settings)
+        paths = sorted(directory.glob("*.folded"), reverse=True) if directory.exists() else []
+        return {"profiles": [p.stem for p in paths]}
+
+    @application.get("/admin/profiles/{profile_id}", dependencies=[Depends(require_admin)])
+    async def get_profile(profile_id: str):
+        state: AppState = application.state.svc
+        path = profile_dir(state.settings) / f"{profile_id}.folded"
+        if not PROFILE_ID_RE.match(profile_id) or not path.exists():
+            raise HTTPException(404, "Profile not found")
+        return FileResponse(path, media_type="text/plain")
+
+    @application.get("/admin/loop-stalls", dependencies=[Depends(require_admin)])
+    async def get_loop_stalls():
+        state: AppState = application.state.svc
+        if state.loop_monitor is None:
+            return {"enabled": False, "stalls": []}
+        return {"enabled": True, "stalls": list(state.loop_monitor.reports)[::-1]}
+
+    @application.get("/admin/snapshot", dependencies=[Depends(require_admin)])
+    async def export_snapshot(gzip: bool = False):
+        """Download a snapshot of the cache for bootstrapping another node.
+
+        The archive is streamed as it is written, so it never takes up disk space.
+        """
+        state: AppState = application.state.svc
+        cache_dir = Path(state.settings.cache_dir)
+        tmp = Path(tempfile.mkdtemp(dir=cache_dir, prefix=".snapshot-"))
+        db_copy = tmp / METADATA_NAME
+        try:
+            await asyncio.to_thread(state.metadata_builder.store.backup_to, db_copy)
+        except BaseException:
+            shutil.rmtree(tmp, ignore_errors=True)
+            raise
+
+        def write(out: _ChunkPipe):
+            try:
+                manifest = write_snapshot(
+                    out,
+                    cache_dir,
+                    db_copy,
+                    state.settings.cache_ttl_seconds,
+                    gzip,
+                    hot_dir=state.cache.hot_dir,
+                )
+            finally:
+                shutil.rmtree(tmp, ignore_errors=True)
+            logging.getLogger(__name__).info(f"Exported snapshot of {len(manifest.files)} files")
+
+        filename = "snapshot.tar.gz" if gzip else "snapshot.tar"
+        return StreamingResponse(
+            _stream_from_thread(write),
+            media_type="application/gzip" if gzip else "application/x-tar",
+            headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+        )
+
+    @application.post("/admin/snapshot", dependencies=[Depends(require_admin)])
+    async def import_snapshot(request: Request):
+        """Install a snapshot uploaded as the request body, while serving."""
+        state: AppState = application.state.svc
+        cache_dir = Path(state.settings.cache_dir)
+        with tempfile.TemporaryDirectory(dir=cache_dir, prefix=".snapshot-") as tmp:
+            staging = Path(tmp) / "staging"
+            # Extracted as it is uploaded, so the archive itself never touches the disk
+            pipe = _ChunkPipe()
+
+            def extract():
+                try:
+                    return read_snapshot(pipe, staging)
+                finally:
+                    pipe.stop()
+
+            reader = asyncio.ensure_future(asyncio.to_thread(extract))
+            try:
+                async for chunk in request.stream():
+                    await asyncio.to_thread(pipe.write, chunk)
+                await asyncio.to_thread(pipe.close)
+            except OSError:
+                pass  # Extraction stopped reading early; its result says why
+            except BaseException:
+                pipe.stop()
+                await asyncio.gather(reader, return_exceptions=True)
+                raise
+
+            try:
+                manifest = await reader
+            except SnapshotError as e:
+                raise HTTPException(400, f"Invalid snapshot: {e}")
+            installed = await asyncio.to_thread(
+                install_snapshot,
+                staging,
+                cache_dir,
+                manifest,
+                state.cache.hot_dir,
+                retire=state.cache.retire_slot,
+            )
+            await asyncio.to_thread(
+                state.metadata_builder.store.restore_from, staging / METADATA_NAME
+            )
+            await apply_snapshot(state, manifest, installed)
+
+        skipped = sorted(manifest.slot_files().keys() - set(installed))
+        logging.getLogger(__name__).info(
+            f"Imported snapshot: {len(manifest.files)} files, {len(installed)} slots"
         )
+        return {
+            "files": len(manifest.files),
+            "slots": len(installed),
+            "skipped_slots": skipped,
+            "tracks": len(state.metadata.tracks),
+        }
+
+    @application.post("/refresh", status_code=202)
+    async def refresh(response: Response):
+        state: AppState = application.state.svc
+        if not is_leader(state):
+            # Only the leader crawls; hand the request over through the store, under an
+            # id the leader adopts for the job it starts or joins
+            published = state.coordinator.published_job()
+            if published is not None and published["state"] == "running":
+                response.headers["Location"] = f"/refresh/{published['id']}"
+                return {**published, "joined": True}
+            job_id = new_job_id()
+            state.coordinator.request_refresh(job_id)
+            response.headers["Location"] = f"/refresh/{job_id}"
+            return {"id": job_id, "trigger": "manual", "state": "requested", "joined": False}
+        job, started = state.refresher.start("manual")
+        response.headers["Location"] = f"/refresh/{job.id}"
+        return {**job.to_dict(), "joined": not started}
 
-    @application.post("/refresh")
-    async def refresh():
+    @application.get("/refresh/{job_id}")
+    async def get_refresh_job(job_id: str):
         state: AppState = application.state.svc
-        state.metadata = await state.metadata_builder.build(force_refresh=True)
-        return {"status": "ok", "track_count": len(state.metadata.tracks)}
+        job = state.refresher.get(job_id)
+        if job is not None:
+            return job.to_dict()
+        if state.coordinator is not None:
+            published = state.coordinator.published_job(job_id)
+            if published is not None:
+                return published
+            if state.coordinator.requested_job_id() == job_id:
+                # Not picked up by the leader yet
+                return {"id": job_id, "trigger": "manual", "state": "requested"}
+        raise HTTPException(404, "Refresh job not found")
 
     return application
 
@@ -0,0 +1,243 @@
+import asyncio
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import httpx
+from PIL import Image
+
+from subsonic_proxy.cache import CacheManager
+from subsonic_proxy.metadata import MetadataResponse
+from subsonic_proxy.subsonic import SubsonicError, SubsonicUnavailable
+
+logger = logging.getLogger(__name__)
+
+
+def _render_atlas_page(
+    cover_paths: list[str | None],
+    thumb_size: int,
+    atlas_size: int,
+    fallback_color: str,
+    output_path: str,
+):
+    """Pack cover thumbnails into a single atlas image (runs in a worker process).
+
+    Cells are filled left to right, top to bottom. Missing or unreadable covers get a
+    solid fallback tile so the UV map never points at garbage.
+    """
+    color = fallback_color.lstrip("#")
+    rgb = tuple(int(color[i : i + 2], 16) for i in (0, 2, 4))
+    per_row = atlas_size // thumb_size
+
+    atlas = Image.new("RGB", (atlas_size, atlas_size), rgb)
+    for i, cover_path in enumerate(cover_paths):
+        if cover_path is None:
+            continue
+        try:
+            with Image.open(cover_path) as img:
+                thumb = img.convert("RGB").resize(
+                    (thumb_size, thumb_size), Image.Resampling.LANCZOS
+                )
+        except Exception:
+            logger.warning(f"Unreadable cover {cover_path}, using a fallback tile", exc_info=True)
+            continue
+        x = (i % per_row) * thumb_size
+        y = (i // per_row) * thumb_size
+        atlas.paste(thumb, (x, y))
+
+    tmp_path = f"{output_path}.tmp"
+    atlas.save(tmp_path, "JPEG", quality=85)
+    os.replace(tmp_path, output_path)
+
+
+def _file_version(path: str | None) -> str:
+    """mtime and size of a cover file, or "none" if it is missing."""
+    if path is None:
+        return "none"
+    try:
+        st = os.stat(path)
+    except OSError:
+        return "none"
+    return f"{st.st_mtime_ns}-{st.st_size}"
+
+
+class AtlasBuilder:
+    """Builds cover art texture atlases for the in-world browser.
+
+    Each album gets one thumbnail cell; albums are packed in metadata order into
+    fixed-size pages served at `/atlas/NN.jpg`, with `/atlas.json` mapping album ids to
+    page index and UV rect. Pages whose contents haven't changed are not re-rendered.
+
+    Pages are rendered in a process pool that lives as long as the builder; call
+    close() on shutdown.
+    """
+
+    def __init__(self, settings, cache_manager: CacheManager, subsonic_client):
+        self._cache_manager = cache_manager
+        self._subsonic = subsonic_client
+        self._thumb_size = settings.atlas_thumb_size
+        self._atlas_size = settings.atlas_size
+        self._fallback_color = settings.fallback_bg_color
+        self._workers = settings.atlas_workers or os.cpu_count() or 1
+        self._fetch_semaphore = asyncio.Semaphore(settings.atlas_fetch_concurrency)
+        self._atlas_dir = cache_manager.cache_dir / "atlas"
+        self._map_path = self._atlas_dir / "atlas.json"
+        self._lock = asyncio.Lock()
+        # Spawn rather than fork: the server process has live event loop threads.
+        # Worker processes only start once a page needs rendering
+        self._pool = ProcessPoolExecutor(
+            max_workers=self._workers, mp_context=multiprocessing.get_context("spawn")
+        )
+
+    def close(self):
+        """Stop the render pool, abandoning pages that haven't started rendering."""
+        self._pool.shutdown(cancel_futures=True)
+
+    @property
+    def cells_per_page(self) -> int:
+        per_row = self._atlas_size // self._thumb_size
+        return per_row * per_row
+
+    def get_page_path(self, index: int) -> Path:
+        return self._atlas_dir / f"{index:02d}.jpg"
+
+    def load_map(self) -> dict | None:
+        """Load the current album → UV map, or None if no atlas has been built."""
+        if not self._map_path.exists():
+            return None
+        try:
+            return json.loads(self._map_path.read_text())
+        except (OSError, ValueError) as e:
+            logger.warning(f"Failed to load atlas map: {e}")
+            return None
+
+    async def _ensure_cover(self, cover_art_id: str | None) -> str | None:
+        """Return a local path to the cover, fetching it into the cover cache if needed."""
+        if not cover_art_id:
+            return None
+        # Not a listener's request, so it doesn't count towards popularity or metrics
+        if self._cache_manager.has_cover_art(cover_art_id):
+            return str(self._cache_manager.get_cover_art_path(cover_art_id))
+
+        async with self._fetch_semaphore:
+            try:
+                art_data = await self._subsonic.get_cover_art(cover_art_id)
+            except (httpx.HTTPError, SubsonicError, SubsonicUnavailable) as e:
+                logger.warning(f"Failed to fetch cover art {cover_art_id} for atlas: {e}")
+                return None
+        cached_path = await asyncio.to_thread(
+            self._cache_manager.write_cover_art, cover_art_id, art_data
+        )
+        return str(cached_path)
+
+    def _uv_rect(self, cell: int) -> list[float]:
+        """UV rect [u, v, width, height] for a cell, with v measured from the bottom
+        edge as Unity expects."""
+        per_row = self._atlas_size // self._thumb_size
+        size = self._thumb_size / self._atlas_size
+        col = cell % per_row
+        row = cell // per_row
+        return [col * size, 1.0 - (row + 1) * size, size, size]
+
+    async def build(self, metadata: MetadataResponse) -> dict:
+        """Build (or incrementally update) the atlas pages for the given metadata."""
+        async with self._lock:
+            return await self._build(metadata)
+
+    async def _build(self, metadata: MetadataResponse) -> dict:
+        self._atlas_dir.mkdir(parents=True, exist_ok=True)
+
+        # Pick a cover for each album from its first track
+        album_covers: list[tuple[str, str | None]] = []
+        for album_id, album in metadata.albums.items():
+            cover_art_id = None
+            for slot_id in album.track_slots:
+                track = metadata.tracks.get(slot_id)
+                if track is not None and track.cover_art:
+                    cover_art_id = track.cover_art
+                    break
+            album_covers.append((album_id, cover_art_id))
+
+        cover_paths = await asyncio.gather(
+            *(self._ensure_cover(cover_art_id) for _, cover_art_id in album_covers)
+        )
+
+        per_page = self.cells_per_page
+        previous = self.load_map() or {}
+        previous_signatures = previous.get("page_signatures", [])
+        if (
+            previous.get("thumb_size") != self._thumb_size
+            or previous.get("atlas_size") != self._atlas_size
+        ):
+            previous_signatures = []
+
+        albums_map: dict[str, dict] = {}
+        signatures: list[str] = []
+        stale_pages: list[tuple[int, list[str | None]]] = []
+
+        for page_start in range(0, len(album_covers), per_page):
+            page = page_start // per_page
+            page_albums = album_covers[page_start : page_start + per_page]
+            page_paths = list(cover_paths[page_start : page_start + per_page])
+
+            # Cover file mtime and size catch covers re-fetched after changing upstream
+            digest = hashlib.sha1()
+            for (album_id, cover_art_id), path in zip(page_albums, page_paths):
+                digest.update(f"{album_id}:{cover_art_id}:{_file_version(path)}\n".encode())
+            signature = digest.hexdigest()
+            signatures.append(signature)
+
+            up_to_date = (
+                page < len(previous_signatures)
+                and previous_signatures[page] == signature
+                and self.get_page_path(page).exists()
+            )
+            if not up_to_date:
+                stale_pages.append((page, page_paths))
+
+            for cell, (album_id, _) in enumerate(page_albums):
+                albums_map[album_id] = {"atlas": page, "uv": self._uv_rect(cell)}
+
+        if stale_pages:
+            logger.info(
+                f"Rendering {len(stale_pages)} of {len(signatures)} atlas pages "
+                f"({self._workers} workers)"
+            )
+            loop = asyncio.get_running_loop()
+            await asyncio.gather(
+                *(
+                    loop.run_in_executor(
+                        self._pool,
+                        _render_atlas_page,
+                        page_paths,
+                        self._thumb_size,
+                        self._atlas_size,
+                        self._fallback_color,
+                        str(self.get_page_path(page)),
+                    )
+                    for page, page_paths in stale_pages
+                )
+            )
+        else:
+            logger.info("Atlas pages up to date")
+
+        # Drop pages beyond the new page count
+        for stale in self._atlas_dir.glob("*.jpg"):
+            if stale.stem.isdigit() and int(stale.stem) >= len(signatures):
+                stale.unlink()
+
+        atlas_map = {
+            "thumb_size": self._thumb_size,
+            "atlas_size": self._atlas_size,
+            "page_count": len(signatures),
+            "page_signatures": signatures,
+            "albums": albums_map,
+        }
+        tmp_path = self._map_path.with_suffix(".json.tmp")
+        tmp_path.write_text(json.dumps(atlas_map))
+        os.replace(tmp_path, self._map_path)
+        return atlas_map
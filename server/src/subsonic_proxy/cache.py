@@ -1,18 +1,355 @@
+import hashlib
+import os
 import shutil
-from datetime import datetime, timedelta
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
 from pathlib import Path
 
+from filelock import FileLock, Timeout
+
+from subsonic_proxy import metrics
+
+
+class AccessTracker:
+    """Per-key access counts that decay with the given half-life, so an item's count
+    reflects how popular it is now rather than over the life of the process."""
+
+    def __init__(self, half_life_seconds: float, max_entries: int = 10000):
+        self._half_life = half_life_seconds
+        self._max_entries = max_entries
+        self._entries: OrderedDict[str, tuple[float, float]] = OrderedDict()
+
+    def _decayed(self, key: str, now: float) -> float:
+        entry = self._entries.get(key)
+        if entry is None:
+            return 0.0
+        count, at = entry
+        return count * 0.5 ** ((now - at) / self._half_life)
+
+    def record(self, key: str, now: float | None = None):
+        now = time.time() if now is None else now
+        self._entries[key] = (self._decayed(key, now) + 1, now)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self._max_entries:
+            self._entries.popitem(last=False)
+
+    def count(self, key: str, now: float | None = None) -> float:
+        return self._decayed(key, time.time() if now is None else now)
+
 
 class CacheManager:
-    def __init__(self, cache_dir: Path | str, ttl_seconds: int):
+    """Cache layout and expiry policy for cached files, measured from their mtime.
+
+    Each file's TTL is cache_ttl_seconds, spread by ±ttl_jitter (a fraction, fixed
+    per file generation) so items cached together don't all expire together, and
+    stretched towards popular_multiplier × the TTL as its recent access count approaches
+    popular_hits. Rarely used files therefore expire first. Popular files past
+    refresh_ahead of their TTL are due for a background refresh before they expire.
+
+    With a hot_dir (typically on tmpfs), transcodes and audio are tiered: new entries
+    are written to hot_dir, the least recently used are demoted to cache_dir once the
+    hot tier exceeds hot_max_bytes, and popular entries on disk are promoted back.
+    Lookups check the hot tier first. Entries are slot directories under segments/ and
+    files under audio/, addressed by their path relative to the tier root.
+
+    A slot's encode that is replaced by a newer one is retired rather than deleted:
+    renamed to .{slot}@{version} beside it and kept for at least retired_seconds, so
+    clients still playing the old playlist can fetch the rest of its segments.
+    """
+
+    def __init__(
+        self,
+        cache_dir: Path | str,
+        ttl_seconds: int,
+        ttl_jitter: float = 0.0,
+        popular_hits: int = 0,
+        popular_multiplier: float = 1.0,
+        refresh_ahead: float = 0.0,
+        hot_dir: Path | str | None = None,
+        hot_max_bytes: int = 0,
+        retired_seconds: float = 0.0,
+    ):
         self.cache_dir = Path(cache_dir)
-        self.ttl = timedelta(seconds=ttl_seconds)
+        self.ttl_seconds = ttl_seconds
+        self.ttl_jitter = ttl_jitter
+        self.popular_hits = popular_hits
+        self.popular_multiplier = popular_multiplier
+        self.refresh_ahead = refresh_ahead
+        self.retired_seconds = retired_seconds
+        self.access = AccessTracker(half_life_seconds=max(ttl_seconds, 1))
+
+        self.hot_dir = Path(hot_dir) if hot_dir else None
+        self.hot_max_bytes = hot_max_bytes
+        self.hot_size = 0
+        # Hot tier entries in LRU order, with their size in bytes
+        self._hot: OrderedDict[str, int] = OrderedDict()
+        self._hot_lock = threading.Lock()
+        self._demoting: set[str] = set()
+        if self.hot_dir is not None:
+            self._load_hot_tier()
+
+    # Tiers
+
+    def _roots(self) -> list[Path]:
+        return [self.hot_dir, self.cache_dir] if self.hot_dir is not None else [self.cache_dir]
+
+    def _key(self, path: Path) -> str:
+        """Tier-independent key for a cached path, e.g. segments/0001/index.m3u8."""
+        for root in self._roots():
+            if path.is_relative_to(root):
+                return path.relative_to(root).as_posix()
+        return str(path)
+
+    def lookup(self, key: str) -> Path:
+        """Path of an entry in the first tier holding it (cache_dir if none does)."""
+        if self.hot_dir is not None and (self.hot_dir / key).exists():
+            return self.hot_dir / key
+        return self.cache_dir / key
+
+    def write_path(self, key: str) -> Path:
+        """Where a new entry should be written."""
+        return (self.hot_dir or self.cache_dir) / key
+
+    def slot_dir(self, slot_id: str) -> Path:
+        return self.lookup(f"segments/{slot_id}")
+
+    def new_slot_dir(self, slot_id: str) -> Path:
+        return self.write_path(f"segments/{slot_id}")
+
+    def retired_slot_dir(self, slot_id: str, version: str) -> Path:
+        """Where a retired encode of a slot is kept, in whichever tier holds it."""
+        return self.lookup(f"segments/.{slot_id}@{version}")
+
+    def retire_slot(self, slot_dir: Path, keep_seconds: float = 0.0):
+        """Move a slot's encode out of the way of a new one, keeping it servable for
+        max(retired_seconds, keep_seconds). The retired directory's mtime is set to the
+        time it may be removed. Blocking.
+        """
+        keep = max(self.retired_seconds, keep_seconds)
+        try:
+            version = encode_version(slot_dir / "index.m3u8")
+        except OSError:
+            keep = 0  # Unfinished, so nobody can be playing it
+        in_hot_tier = self.hot_dir is not None and slot_dir.is_relative_to(self.hot_dir)
+        key = self._key(slot_dir)
+        if keep <= 0:
+            _remove(slot_dir)
+            if in_hot_tier:
+                self.forget(key)
+            return
+        retired = slot_dir.with_name(f".{slot_dir.name}@{version}")
+        _remove(retired)
+        slot_dir.rename(retired)
+        until = time.time() + keep
+        os.utime(retired, (until, until))
+        if not in_hot_tier:
+            return
+        with self._hot_lock:
+            size = self._hot.pop(key, None)
+            if size is not None:
+                # Still counts against the hot tier, as the first entry to demote
+                self._hot[self._key(retired)] = size
+                self._hot.move_to_end(self._key(retired), last=False)
+
+    def audio_path(self, slot_id: str) -> Path:
+        return self.lookup(f"audio/{slot_id}.mp3")
+
+    def new_audio_path(self, slot_id: str) -> Path:
+        return self.write_path(f"audio/{slot_id}.mp3")
+
+    def _load_hot_tier(self):
+        """Account for entries left in the hot tier by a previous run, oldest first."""
+        entries = []
+        for parent in ("segments", "audio"):
+            directory = self.hot_dir / parent
+            if directory.exists():
+                for path in directory.iterdir():
+                    if not path.name.startswith("."):
+                        entries.append((path.stat().st_mtime, f"{parent}/{path.name}"))
+        for _, key in sorted(entries):
+            size = _tree_size(self.hot_dir / key)
+            self._hot[key] = size
+            self.hot_size += size
+
+    def touch(self, key: str):
+        """Mark a hot tier entry as recently used."""
+        if key in self._hot:
+            with self._hot_lock:
+                if key in self._hot:
+                    self._hot.move_to_end(key)
+
+    def admit(self, key: str):
+        """Account for an entry just written to the hot tier, demoting the least
+        recently used entries to disk while the tier is over hot_max_bytes.
+
+        Blocking; run it off the event loop.
+        """
+        path = self.hot_dir / key if self.hot_dir is not None else None
+        if path is None or not path.exists():
+            return
+        size = _tree_size(path)
+        with self._hot_lock:
+            self.hot_size += size - self._hot.pop(key, 0)
+            self._hot[key] = size
+
+        busy = {key}  # Entries that can't be demoted right now
+        while victims := self._pick_victims(busy):
+            # Copying to slow disk happens outside the lock, so touch() never waits on it
+            for victim in victims:
+                demoted = self._demote(victim)  # False if it is being transcoded
+                with self._hot_lock:
+                    self._demoting.discard(victim)
+                    if demoted:
+                        self.hot_size -= self._hot.pop(victim, 0)
+                    else:
+                        busy.add(victim)
+
+    def _pick_victims(self, busy: set[str]) -> list[str]:
+        """Claim least recently used entries covering the hot tier's excess size."""
+        with self._hot_lock:
+            excess = self.hot_size - self.hot_max_bytes
+            victims = []
+            for candidate, candidate_size in self._hot.items():
+                if excess <= 0:
+                    break
+                if candidate not in busy and candidate not in self._demoting:
+                    victims.append(candidate)
+                    excess -= candidate_size
+            self._demoting.update(victims)
+            return victims
+
+    def forget(self, key: str):
+        """Stop accounting for a hot tier entry removed outside the manager."""
+        with self._hot_lock:
+            self.hot_size -= self._hot.pop(key, 0)
+
+    def _slot_lock(self, key: str) -> FileLock | None:
+        parts = key.split("/")
+        if parts[0] != "segments":
+            return None
+        locks_dir = self.cache_dir / "locks"
+        locks_dir.mkdir(parents=True, exist_ok=True)
+        return FileLock(locks_dir / f"{parts[1]}.lock", thread_local=False)
+
+    def _move(self, src: Path, dst: Path) -> bool:
+        """Copy an entry to another tier, keeping mtimes, swap it in and remove the
+        source. Returns False if the slot is locked by a transcode."""
+        lock = self._slot_lock(self._key(src))
+        try:
+            if lock is not None:
+                lock.acquire(timeout=0)
+        except Timeout:
+            return False
+        try:
+            if not src.exists():
+                return True
+            staging = dst.with_name(f".{dst.name}.moving")
+            _remove(staging)
+            dst.parent.mkdir(parents=True, exist_ok=True)
+            if src.is_dir():
+                shutil.copytree(src, staging)
+            else:
+                shutil.copy2(src, staging)
+            # Readers find the destination before the source disappears
+            replaced = dst.with_name(f".{dst.name}.replaced")
+            if dst.exists():
+                dst.rename(replaced)
+            staging.rename(dst)
+            _remove(replaced)
+            _remove(src)
+            return True
+        finally:
+            if lock is not None:
+                lock.release()
+
+    def _demote(self, key: str) -> bool:
+        moved = self._move(self.hot_dir / key, self.cache_dir / key)
+        if moved:
+            metrics.CACHE_TIER_MOVES.labels("demote").inc()
+        return moved
+
+    def should_promote(self, key: str) -> bool:
+        """True for a popular entry currently served from the disk tier."""
+        # Slot accesses are recorded against the playlist
+        accessed = f"{key}/index.m3u8" if key.startswith("segments/") else key
+        return (
+            self.hot_dir is not None
+            and key not in self._hot
+            and self._popularity_of(accessed, time.time()) >= 1.0
+            and (self.cache_dir / key).exists()
+        )
+
+    def promote(self, key: str):
+        """Copy a popular disk entry into the hot tier. Blocking."""
+        if self._move(self.cache_dir / key, self.hot_dir / key):
+            metrics.CACHE_TIER_MOVES.labels("promote").inc()
+            self.admit(key)
 
-    def is_expired(self, path: Path) -> bool:
-        if not path.exists():
+    # Expiry
+
+    def record_access(self, path: Path, now: float | None = None):
+        self.access.record(self._key(path), now)
+
+    def _popularity_of(self, key: str, now: float) -> float:
+        """Recent accesses relative to popular_hits, capped at 1."""
+        if self.popular_hits <= 0:
+            return 0.0
+        return min(self.access.count(key, now) / self.popular_hits, 1.0)
+
+    def _popularity(self, path: Path, now: float) -> float:
+        return self._popularity_of(self._key(path), now)
+
+    def _base_ttl(self, path: Path, mtime: float) -> float:
+        """TTL of the file at path written at mtime before any popularity bonus."""
+        ttl = self.ttl_seconds
+        if self.ttl_jitter > 0:
+            seed = f"{self._key(path)}:{mtime}".encode()
+            unit = int.from_bytes(hashlib.blake2b(seed, digest_size=8).digest()) / 2**64
+            ttl *= 1 + self.ttl_jitter * (2 * unit - 1)
+        return ttl
+
+    def ttl_for(self, path: Path, mtime: float, now: float | None = None) -> float:
+        """Effective TTL in seconds of the file at path written at mtime."""
+        now = time.time() if now is None else now
+        bonus = (self.popular_multiplier - 1) * self._popularity(path, now)
+        return self._base_ttl(path, mtime) * (1 + bonus)
+
+    def is_expired(self, path: Path, now: float | None = None) -> bool:
+        now = time.time() if now is None else now
+        try:
+            mtime = path.stat().st_mtime
+        except FileNotFoundError:
             return True
-        mtime = datetime.fromtimestamp(path.stat().st_mtime)
-        return datetime.now() - mtime > self.ttl
+        return now - mtime > self.ttl_for(path, mtime, now)
+
+    def should_refresh_ahead(self, path: Path, now: float | None = None) -> bool:
+        """True if a popular, still valid file is close enough to expiry to refresh."""
+        now = time.time() if now is None else now
+        if self.refresh_ahead <= 0 or self._popularity(path, now) < 1.0:
+            return False
+        try:
+            mtime = path.stat().st_mtime
+        except FileNotFoundError:
+            return False
+        age = now - mtime
+        ttl = self.ttl_for(path, mtime, now)
+        return self.refresh_ahead * ttl < age <= ttl
+
+    def max_age(self, path: Path, mtime: float, now: float | None = None) -> float:
+        """Seconds clients may keep the file at path, written at mtime, without
+        revalidating: no later than it may expire or a refresh-ahead may replace it.
+
+        Popularity only extends a TTL for as long as it lasts, so the file is only sure
+        to live for its base TTL.
+        """
+        now = time.time() if now is None else now
+        ttl = self._base_ttl(path, mtime)
+        if self.refresh_ahead > 0:
+            ttl = min(ttl, self.refresh_ahead * self.ttl_for(path, mtime, now))
+        return max(ttl - (now - mtime), 0.0)
 
     def get_cover_art_path(self, cover_art_id: str) -> Path:
         """Get path for cached cover art."""
@@ -21,20 +358,59 @@ class CacheManager:
         return cover_dir / f"{cover_art_id}.jpg"
 
     def is_cover_art_cached(self, cover_art_id: str) -> bool:
-        """Check if cover art is cached and not expired."""
+        """Check if cover art is cached and not expired, counting it as a request."""
+        self.record_access(self.get_cover_art_path(cover_art_id))
+        cached = self.has_cover_art(cover_art_id)
+        metrics.CACHE_REQUESTS.labels("cover", "hit" if cached else "miss").inc()
+        return cached
+
+    def has_cover_art(self, cover_art_id: str) -> bool:
+        """Check if cover art is cached and not expired, without recording an access;
+        for background work such as atlas builds."""
         path = self.get_cover_art_path(cover_art_id)
         return path.exists() and not self.is_expired(path)
 
+    def write_cover_art(self, cover_art_id: str, data: bytes) -> Path:
+        """Store fetched cover art, replacing the file atomically so readers never see
+        a partial one. Blocking."""
+        path = self.get_cover_art_path(cover_art_id)
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            Path(tmp_path).unlink(missing_ok=True)
+            raise
+        return path
+
     def cleanup(self):
-        # Clean up expired segment directories
-        segments_dir = self.cache_dir / "segments"
-        if segments_dir.exists():
-            for slot_dir in segments_dir.iterdir():
-                if not slot_dir.is_dir():
-                    continue
-                m3u8 = slot_dir / "index.m3u8"
-                if self.is_expired(m3u8):
-                    shutil.rmtree(slot_dir)
+        for root in self._roots():
+            # Clean up expired segment directories
+            segments_dir = root / "segments"
+            if segments_dir.exists():
+                for slot_dir in segments_dir.iterdir():
+                    if not slot_dir.is_dir():
+                        continue
+                    if slot_dir.name.startswith("."):
+                        # Retired encodes carry their removal time as mtime; other dot
+                        # directories are refreshes and tier moves being swapped in
+                        if "@" in slot_dir.name and slot_dir.stat().st_mtime < time.time():
+                            shutil.rmtree(slot_dir)
+                            self._expired(root, f"segments/{slot_dir.name}")
+                        continue
+                    m3u8 = slot_dir / "index.m3u8"
+                    if self.is_expired(m3u8):
+                        # Clients may have fetched its playlist just before it expired
+                        self.retire_slot(slot_dir)
+
+            # Clean up expired audio files
+            audio_dir = root / "audio"
+            if audio_dir.exists():
+                for audio_file in audio_dir.iterdir():
+                    if audio_file.is_file() and self.is_expired(audio_file):
+                        audio_file.unlink()
+                        self._expired(root, f"audio/{audio_file.name}")
 
         # Clean up expired cover art
         covers_dir = self.cache_dir / "covers"
@@ -43,9 +419,129 @@ class CacheManager:
                 if cover_file.is_file() and self.is_expired(cover_file):
                     cover_file.unlink()
 
-        # Clean up expired audio files
-        audio_dir = self.cache_dir / "audio"
-        if audio_dir.exists():
-            for audio_file in audio_dir.iterdir():
-                if audio_file.is_file() and self.is_expired(audio_file):
-                    audio_file.unlink()
+    def _expired(self, root: Path, key: str):
+        if root == self.hot_dir:
+            with self._hot_lock:
+                self.hot_size -= self._hot.pop(key, 0)
+
+
+def _tree_size(path: Path) -> int:
+    if path.is_file():
+        return path.stat().st_size
+    return sum(f.stat().st_size for f in path.rglob("*") if f.is_file())
+
+
+def _remove(path: Path):
+    if path.is_dir():
+        shutil.rmtree(path, ignore_errors=True)
+    else:
+        path.unlink(missing_ok=True)
+
+
+@dataclass
+class CachedPlaylist:
+    body: bytes
+    etag: str
+    last_modified: float
+    complete: bool
+
+
+def encode_version(m3u8_path: Path) -> str:
+    """Identifies one encode of a slot: its playlist's mtime, which every transcode,
+    refresh-ahead swap and snapshot import changes while tier moves preserve it."""
+    return format(m3u8_path.stat().st_mtime_ns, "x")
+
+
+class PlaylistCache:
+    """In-memory LRU of rewritten HLS playlists.
+
+    Entries are keyed on (slot, encode version, base_url), where the encode version is
+    the playlist's mtime, so a re-transcode naturally misses instead of needing an
+    explicit invalidation.
+    """
+
+    def __init__(self, max_entries: int):
+        self._max_entries = max_entries
+        self._entries: OrderedDict[tuple[str, int, str], CachedPlaylist] = OrderedDict()
+
+    def get(self, slot_id: str, version: int, base_url: str) -> CachedPlaylist | None:
+        key = (slot_id, version, base_url)
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+        return entry
+
+    def put(
+        self, slot_id: str, version: int, base_url: str, content: str, last_modified: float
+    ) -> CachedPlaylist:
+        body = content.encode()
+        entry = CachedPlaylist(
+            body=body,
+            etag=f'"{hashlib.sha1(body).hexdigest()}"',
+            last_modified=last_modified,
+            # Master playlists are only written once every variant is finished
+            complete="#EXT-X-ENDLIST" in content or "#EXT-X-STREAM-INF" in content,
+        )
+        # Drop older versions of this slot so they don't linger until LRU eviction
+        for key in [k for k in self._entries if k[0] == slot_id]:
+            del self._entries[key]
+        self._entries[(slot_id, version, base_url)] = entry
+        while len(self._entries) > self._max_entries:
+            self._entries.popitem(last=False)
+        return entry
+
+
+class SegmentCache:
+    """Byte-budgeted in-memory LRU of hot HLS segments.
+
+    Segments are admitted either eagerly (the first few segments of a fresh transcode)
+    or on their second read from disk, so one-off plays don't churn the cache.
+    """
+
+    def __init__(self, max_bytes: int, max_segment_bytes: int = 4 * 1024 * 1024):
+        self._max_bytes = max_bytes
+        self._max_segment_bytes = max_segment_bytes
+        self._entries: OrderedDict[tuple[str, str], bytes] = OrderedDict()
+        self._seen: OrderedDict[tuple[str, str], None] = OrderedDict()
+        self.size = 0
+
+    def get(self, slot_id: str, name: str) -> bytes | None:
+        key = (slot_id, name)
+        data = self._entries.get(key)
+        if data is not None:
+            self._entries.move_to_end(key)
+        return data
+
+    def fits(self, size: int) -> bool:
+        """Whether a segment of this many bytes may be held at all."""
+        return size <= self._max_segment_bytes and size <= self._max_bytes
+
+    def put(self, slot_id: str, name: str, data: bytes):
+        if not self.fits(len(data)):
+            return
+        key = (slot_id, name)
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self.size -= len(old)
+        self._entries[key] = data
+        self.size += len(data)
+        while self.size > self._max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.size -= len(evicted)
+
+    def should_admit(self, slot_id: str, name: str) -> bool:
+        """Record a disk read; returns True if the segment was read recently before."""
+        key = (slot_id, name)
+        if key in self._seen:
+            del self._seen[key]
+            return True
+        self._seen[key] = None
+        while len(self._seen) > 4096:
+            self._seen.popitem(last=False)
+        return False
+
+    def invalidate_slot(self, slot_id: str):
+        for key in [k for k in self._entries if k[0] == slot_id]:
+            self.size -= len(self._entries.pop(key))
+        for key in [k for k in self._seen if k[0] == slot_id]:
+            del self._seen[key]
@@ -0,0 +1,114 @@
+"""Slot sharding across several proxy nodes (cluster mode).
+
+Every node lists the same cluster_nodes and builds the same metadata from the same
+Subsonic server. Tracks are assigned to nodes by consistent hashing on the track id, so
+adding or removing a node only moves about 1/N of the tracks. Any node answers
+`/{slot_id}.m3u8`, but only the owning node transcodes: the others fetch the playlist
+from it (its segment URLs already point at the owner) or redirect the client there.
+"""
+
+import bisect
+import hashlib
+import logging
+
+import httpx
+
+from subsonic_proxy.config import Settings
+
+logger = logging.getLogger(__name__)
+
+# Set on playlist requests forwarded between nodes, so the owner serves them itself
+# and can check both nodes agree on which track the slot holds
+FORWARDED_HEADER = "x-cluster-track-id"
+
+# Conditional request headers passed on to the owner, and response headers passed back
+_FORWARD_REQUEST_HEADERS = ("if-none-match", "if-modified-since")
+_FORWARD_RESPONSE_HEADERS = ("content-type", "etag", "last-modified", "cache-control")
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], "big")
+
+
+class HashRing:
+    """Consistent hash ring with virtual nodes for an even spread."""
+
+    def __init__(self, nodes: list[str], replicas: int = 64):
+        if not nodes:
+            raise ValueError("HashRing needs at least one node")
+        points = sorted(
+            (_hash(f"{node}#{i}"), node) for node in set(nodes) for i in range(replicas)
+        )
+        self._hashes = [h for h, _ in points]
+        self._nodes = [node for _, node in points]
+
+    def owner(self, key: str) -> str:
+        i = bisect.bisect(self._hashes, _hash(key)) % len(self._hashes)
+        return self._nodes[i]
+
+
+class Cluster:
+    """This node's view of the cluster: who owns a track, and how to reach them."""
+
+    def __init__(self, settings: Settings):
+        self.self_url = settings.base_url.rstrip("/")
+        nodes = [node.rstrip("/") for node in settings.cluster_nodes]
+        if self.self_url not in nodes:
+            raise ValueError(f"base_url {self.self_url} is not one of cluster_nodes {nodes}")
+        self.nodes = nodes
+        self.ring = HashRing(nodes, settings.cluster_virtual_nodes)
+        self.redirect = settings.cluster_redirect
+        # The owner may have to wait for its slot lock and transcode before it answers;
+        # giving up sooner would start a second transcode of the slot here
+        self._http = httpx.AsyncClient(
+            timeout=httpx.Timeout(
+                10.0,
+                read=settings.transcode_lock_timeout_seconds
+                + settings.transcode_stall_timeout_seconds,
+            )
+        )
+
+    async def close(self):
+        await self._http.aclose()
+
+    def owner(self, track_id: str) -> str:
+        return self.ring.owner(track_id)
+
+    def is_local(self, track_id: str) -> bool:
+        return self.owner(track_id) == self.self_url
+
+    async def fetch_playlist(
+        self, owner: str, slot_id: str, track_id: str, headers
+    ) -> httpx.Response | None:
+        """Fetch a slot's playlist from the node that owns it.
+
+        Returns None if the owner can't be reached, fails with a server error, or holds
+        no track or a different track in that slot (the nodes' metadata is out of step),
+        in which case the caller should serve the slot itself.
+        """
+        request_headers = {FORWARDED_HEADER: track_id}
+        for name in _FORWARD_REQUEST_HEADERS:
+            if name in headers:
+                request_headers[name] = headers[name]
+        try:
+            response = await self._http.get(f"{owner}/{slot_id}.m3u8", headers=request_headers)
+        except httpx.HTTPError as e:
+            logger.warning(f"Cluster node {owner} unreachable for slot {slot_id}: {e}")
+            return None
+        if response.status_code in (404, 409):
+            logger.warning(f"Cluster node {owner} has no or another track in slot {slot_id}")
+            return None
+        if response.status_code >= 500:
+            logger.warning(
+                f"Cluster node {owner} failed slot {slot_id} with HTTP {response.status_code}"
+            )
+            return None
+        return response
+
+    @staticmethod
+    def response_headers(response: httpx.Response) -> dict[str, str]:
+        return {
+            name: response.headers[name]
+            for name in _FORWARD_RESPONSE_HEADERS
+            if name in response.headers
+        }
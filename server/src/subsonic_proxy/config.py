@@ -9,19 +9,77 @@ class Settings(BaseSettings):
     subsonic_password: str
     subsonic_api_version: str = "1.16.1"
     subsonic_client_id: str = "subsonic-udon"
+    # Upstream connection pool, retries and circuit breaker
+    subsonic_timeout_seconds: float = 30.0
+    subsonic_max_connections: int = 20
+    subsonic_max_keepalive_connections: int = 10
+    subsonic_keepalive_expiry_seconds: float = 30.0
+    subsonic_retries: int = 3  # Extra attempts after a timeout, connection error or 5xx
+    subsonic_retry_backoff_seconds: float = 0.5  # Doubled each attempt, with jitter
+    subsonic_endpoint_concurrency: int = 8  # In-flight calls per Subsonic endpoint
+    subsonic_breaker_threshold: int = 5  # Consecutive failures that open the breaker; 0 = off
+    subsonic_breaker_reset_seconds: float = 30.0  # Open this long before a trial call
 
     cache_dir: str = "./cache"
     cache_ttl_seconds: int = 3600
+    cache_ttl_jitter: float = 0.2  # Spread each item's TTL by ±20% so expiries don't cliff
+    cache_popular_hits: int = 5  # Recent accesses at which an item counts as popular
+    cache_popular_ttl_multiplier: float = 4.0  # TTL of popular items, relative to the base
+    cache_refresh_ahead: float = 0.8  # Re-transcode popular slots past this TTL fraction; 0 = off
+    # How long a replaced encode stays servable for clients still playing it; tracks
+    # longer than this are kept for their length
+    cache_retired_seconds: int = 900
+    # RAM-backed hot tier (e.g. a tmpfs path) in front of cache_dir for transcodes and
+    # audio; empty = disk only. Not used with multi_worker
+    hot_cache_dir: str = ""
+    hot_cache_bytes: int = 512 * 1024 * 1024
+    metadata_refresh_interval_seconds: int = 0  # Periodic background refresh; 0 = off
+    # How often a refresh that stops at slot_count still walks the rest of the album
+    # list to drop deleted albums from the store
+    metadata_sweep_interval_seconds: int = 86400
 
     slot_count: int = 1000
     base_url: str = "http://localhost:8000"
 
     ffmpeg_path: str = "ffmpeg"
+    # "url": let ffmpeg fetch the stream URL itself; "pipe": stream the source through the
+    # pooled Subsonic client into ffmpeg's stdin. Pipes can't be seeked, so "pipe" fails
+    # on MP4/M4A files whose index is at the end unless Subsonic transcodes them
+    ffmpeg_input: str = "url"
+    # Local mount of the Subsonic music folder; songs whose path is readable under it are
+    # transcoded and served from disk instead of streamed from Subsonic. Empty = off
+    local_music_root: str = ""
+    # The music folder's path on the Subsonic server, for servers that report absolute
+    # song paths (e.g. Navidrome): it is replaced by local_music_root
+    local_music_server_root: str = ""
     hls_segment_duration: int = 10
     audio_bitrate: str = "192k"
+    hls_single_file: bool = False  # Pack each track into one file with EXT-X-BYTERANGE
+    hls_segment_type: str = "mpegts"  # "mpegts" or "fmp4" (CMAF, with an init segment)
+    # Adaptive bitrate ladder: audio bitrates encoded side by side in one ffmpeg run and
+    # offered through a master playlist, e.g. ["192k", "128k", "64k"]. Players start on
+    # the first one. Empty = a single rendition at audio_bitrate
+    hls_renditions: list[str] = []
+    hls_audio_only_rendition: bool = False  # Also offer audio without video, lowest bitrate
 
     selection_strategy: str = "recent"
 
+    # Live radio channel (/radio.m3u8): queued slots stitched into one live HLS stream.
+    # Not available with multi_worker
+    radio_window_segments: int = 6  # Segments listed in the live playlist
+    radio_prepare_ahead: int = 2  # Queued tracks transcoded ahead of their turn
+    radio_max_queue: int = 100
+    radio_prepare_timeout_seconds: int = 60  # Dead air allowed before a track is skipped
+
+    # Loudness normalization (see loudness.py): songs are measured once in the background
+    # and transcodes apply a fixed gain towards the target in a single pass
+    loudness_normalization: bool = False
+    loudness_target_lufs: float = -16.0
+    loudness_true_peak_db: float = -1.5  # The gain is capped to keep peaks below this
+    loudness_use_replaygain: bool = True  # Trust Subsonic's ReplayGain tags when present
+    loudness_workers: int = 0  # Concurrent measurements; 0 = one per CPU core
+    loudness_retry_seconds: int = 86400  # Before measuring a song that failed again
+
     # Video generation settings
     video_width: int = 640
     video_height: int = 640
@@ -39,9 +97,41 @@ class Settings(BaseSettings):
     # Logging
     log_level: str = "INFO"
 
+    # Set when running `uvicorn --workers N` on one cache_dir: one leader worker builds
+    # metadata for all, and max_concurrent_transcodes applies across workers
+    multi_worker: bool = False
+    worker_sync_interval_seconds: float = 2.0
+
+    # Cluster mode (see cluster.py): public base URLs of every node, this node's
+    # base_url included. Empty = single node
+    cluster_nodes: list[str] = []
+    cluster_virtual_nodes: int = 64
+    cluster_redirect: bool = False  # Redirect to the owning node instead of proxying
+
     # Concurrency limits
     max_concurrent_transcodes: int = 3
+    transcode_lock_timeout_seconds: int = 300  # Extended while the holder makes progress
+    transcode_stall_timeout_seconds: int = 60  # Kill ffmpeg after this long without progress
+
+    # Admin endpoints (/admin/*); leave empty to allow unauthenticated access
+    admin_token: str = ""
+    transcode_history_size: int = 200
+
+    # Profiling (see profiling.py); requests opt in with an X-Profile: 1 header
+    profiling_enabled: bool = False
+    profiling_sample_interval_ms: float = 1.0
+    loop_block_threshold_ms: int = 0  # Report event loop stalls longer than this; 0 = off
 
     # Audio streaming settings
     audio_format: str = "mp3"  # Format for direct streaming
     audio_max_bitrate: int = 320  # Maximum bitrate in kbps
+
+    # In-memory hot segment cache
+    segment_cache_bytes: int = 64 * 1024 * 1024
+    segment_cache_prefetch: int = 3  # Segments loaded into RAM right after a transcode
+
+    # Cover art atlas settings
+    atlas_thumb_size: int = 128
+    atlas_size: int = 2048  # 16x16 thumbnails per page at the defaults
+    atlas_workers: int = 0  # 0 = one render process per CPU core
+    atlas_fetch_concurrency: int = 4
@@ -0,0 +1,172 @@
+"""Coordination between uvicorn workers sharing one cache_dir (multi_worker mode).
+
+One worker holds the leader lock for its lifetime and is the only one that crawls
+Subsonic and renders atlases; it publishes metadata through the SQLite store, and the
+other workers reload it when the store's build time changes. Refresh requests and job
+progress are relayed through store cursors so any worker can accept them. Transcode
+concurrency is capped across all workers with a semaphore built from lock files.
+
+Transcodes are shared through cache_dir itself: segment URLs and rewritten playlists
+are keyed on each encode's version, so per-worker RAM caches never serve a slot that
+another worker re-encoded. The hot tier tracks its size per process and is disabled.
+"""
+
+import asyncio
+import json
+import logging
+import time
+from collections.abc import Callable
+from pathlib import Path
+
+from filelock import FileLock, Timeout
+
+from subsonic_proxy.refresh import RefreshJob
+from subsonic_proxy.store import MetadataStore
+
+logger = logging.getLogger(__name__)
+
+REFRESH_REQUESTED = "refresh_requested_job"
+REFRESH_JOB = "refresh_job"
+
+
+class FileSemaphore:
+    """A counting semaphore shared by every process using the same lock directory.
+
+    Each permit is one lock file; acquiring polls for a free one without blocking the
+    event loop. Usable as an async context manager like asyncio.Semaphore.
+    """
+
+    def __init__(self, lock_dir: Path, name: str, value: int, poll_interval: float = 0.1):
+        lock_dir.mkdir(parents=True, exist_ok=True)
+        self._locks = [
+            FileLock(lock_dir / f"{name}-{i}.lock", thread_local=False) for i in range(value)
+        ]
+        self._poll_interval = poll_interval
+        self._held: dict[asyncio.Task, FileLock] = {}
+
+    def _try_acquire(self) -> FileLock | None:
+        for lock in self._locks:
+            # Locks are reentrant within a process, so skip the ones we already hold
+            if lock.is_locked:
+                continue
+            try:
+                lock.acquire(timeout=0)
+            except Timeout:
+                continue
+            return lock
+        return None
+
+    async def __aenter__(self):
+        while (lock := self._try_acquire()) is None:
+            await asyncio.sleep(self._poll_interval)
+        self._held[asyncio.current_task()] = lock
+
+    async def __aexit__(self, *exc_info):
+        self._held.pop(asyncio.current_task()).release()
+
+
+class WorkerCoordinator:
+    """Leader election and metadata/refresh relay for one worker process."""
+
+    def __init__(self, settings, store: MetadataStore):
+        self._store = store
+        self._interval = settings.worker_sync_interval_seconds
+        lock_dir = Path(settings.cache_dir) / "locks"
+        lock_dir.mkdir(parents=True, exist_ok=True)
+        self._leader_lock = FileLock(lock_dir / "leader.lock", thread_local=False)
+        self._seen_built_at = store.built_at
+        self._seen_request = store.get_cursor(REFRESH_REQUESTED)
+        self._last_publish = 0.0
+        self._last_published: tuple[str, int] | None = None
+
+    @property
+    def is_leader(self) -> bool:
+        return self._leader_lock.is_locked
+
+    def try_become_leader(self) -> bool:
+        if self.is_leader:
+            return True
+        try:
+            self._leader_lock.acquire(timeout=0)
+        except Timeout:
+            return False
+        self._fail_orphaned_job()
+        return True
+
+    def _fail_orphaned_job(self):
+        """Mark a job the previous leader published as running as failed; it went
+        away with that leader, and would otherwise be reported as running forever."""
+        published = self.published_job()
+        if published is None or published["state"] != "running":
+            return
+        published.update(state="failed", finished_at=time.time(), error="Leader worker exited")
+        self._store.set_cursor(REFRESH_JOB, json.dumps(published))
+        logger.warning(f"Refresh job {published['id']} was left running by the previous leader")
+
+    def release(self):
+        if self.is_leader:
+            self._leader_lock.release(force=True)
+
+    def request_refresh(self, job_id: str):
+        """Ask the leader to refresh as job job_id (called by followers)."""
+        self._store.set_cursor(REFRESH_REQUESTED, job_id)
+
+    def requested_job_id(self) -> str | None:
+        """The id of the refresh most recently requested by a follower."""
+        return self._store.get_cursor(REFRESH_REQUESTED)
+
+    def publish_job(self, job: RefreshJob):
+        """Share the leader's refresh job so followers can report on it.
+
+        Progress updates are published at most once a second; a job's start, a request
+        joining it and its end always are.
+        """
+        now = time.monotonic()
+        published = (job.id, len(job.joined_ids))
+        if (
+            job.state == "running"
+            and published == self._last_published
+            and now - self._last_publish < 1.0
+        ):
+            return
+        self._last_publish = now
+        self._last_published = published
+        self._store.set_cursor(REFRESH_JOB, json.dumps(job.to_dict()))
+
+    def published_job(self, job_id: str | None = None) -> dict | None:
+        """The leader's latest refresh job; with job_id, only if it answers to that id."""
+        value = self._store.get_cursor(REFRESH_JOB)
+        job = json.loads(value) if value else None
+        if job is None or job_id is None or job_id in (job["id"], *job.get("joined_ids", [])):
+            return job
+        return None
+
+    async def run(
+        self,
+        on_metadata_changed: Callable[[], None],
+        on_refresh_requested: Callable[[str], None],
+        on_promoted: Callable[[], None],
+    ):
+        """Poll the store forever.
+
+        Followers take over if the leader goes away, and the leader picks up refreshes
+        requested by followers under the job id the follower handed out. Every worker
+        reloads when the store's build time changes, which covers the metadata of a
+        snapshot imported through any worker; only the importing worker updates its
+        in-process cache state for the installed slots.
+        """
+        while True:
+            await asyncio.sleep(self._interval)
+            if not self.is_leader and self.try_become_leader():
+                logger.info("Took over as leader worker")
+                on_promoted()
+
+            if self.is_leader:
+                requested = self._store.get_cursor(REFRESH_REQUESTED)
+                if requested is not None and requested != self._seen_request:
+                    self._seen_request = requested
+                    on_refresh_requested(requested)
+            built_at = self._store.built_at
+            if built_at != self._seen_built_at:
+                self._seen_built_at = built_at
+                on_metadata_changed()
@@ -0,0 +1,43 @@
+"""Local filesystem access to the music library Subsonic serves.
+
+When the library is mounted on the proxy's machine, a song's Subsonic `path` is mapped
+onto local_music_root and the file is read directly: no HTTP copy of the whole file and
+no Subsonic-side work per play. Relative paths are taken as relative to the music
+folder. Absolute paths (e.g. Navidrome's) have local_music_server_root, the music
+folder's path on the Subsonic server, stripped first.
+"""
+
+import logging
+import os
+from pathlib import Path, PurePosixPath
+
+logger = logging.getLogger(__name__)
+
+
+class LocalLibrary:
+    """Maps Subsonic song paths onto a local copy of the music library."""
+
+    def __init__(self, root: Path | str, server_root: str = ""):
+        self.root = Path(root).resolve()
+        self.server_root = PurePosixPath(server_root) if server_root else None
+
+    def resolve(self, song_path: str | None) -> Path | None:
+        """Readable local file for a Subsonic song path, or None to stream over HTTP.
+
+        Absolute paths under server_root are mapped under root; other absolute paths
+        are used as they are. Paths that resolve outside root (e.g. via `..` or
+        symlinks) are refused.
+        """
+        if not song_path:
+            return None
+        server_path = PurePosixPath(song_path)
+        if self.server_root is not None and server_path.is_relative_to(self.server_root):
+            song_path = str(server_path.relative_to(self.server_root))
+        path = (self.root / song_path).resolve()
+        if not path.is_relative_to(self.root):
+            logger.warning(f"Song path {song_path} is outside {self.root}, ignoring")
+            return None
+        if not path.is_file() or not os.access(path, os.R_OK):
+            logger.debug(f"Song file {path} isn't readable, streaming from Subsonic")
+            return None
+        return path
@@ -0,0 +1,192 @@
+"""Loudness measurement for single-pass normalization.
+
+Measuring a track's EBU R128 loudness takes a full decode, so doing it inside every
+transcode would double the work. Instead each Subsonic track is measured once, in a
+background batch, and the result is kept in the metadata store; transcodes then apply
+a fixed gain towards loudness_target_lufs in the same ffmpeg pass. ReplayGain tags
+reported by Subsonic stand in for a measurement when present.
+"""
+
+import asyncio
+import json
+import logging
+import math
+import os
+import time
+from dataclasses import dataclass
+
+from subsonic_proxy import metrics
+from subsonic_proxy.config import Settings
+from subsonic_proxy.library import LocalLibrary
+from subsonic_proxy.store import MetadataStore
+from subsonic_proxy.transcoder import TranscodeError, feed_track
+
+logger = logging.getLogger(__name__)
+
+# ReplayGain 2.0 track gains bring a track to this loudness
+REPLAYGAIN_REFERENCE_LUFS = -18.0
+
+
+class AnalysisError(Exception):
+    pass
+
+
+@dataclass
+class Loudness:
+    integrated: float  # LUFS
+    lra: float | None  # LU; not known for ReplayGain tags
+    true_peak: float  # dBTP
+    source: str  # "analysis" or "replaygain"
+
+
+def parse_loudnorm(stderr: str) -> Loudness:
+    """Read the JSON summary ffmpeg's loudnorm filter prints after a measuring pass."""
+    start, end = stderr.rfind("{"), stderr.rfind("}")
+    if start == -1 or end < start:
+        raise AnalysisError("No loudnorm summary in ffmpeg output")
+    try:
+        data = json.loads(stderr[start : end + 1])
+        return Loudness(
+            integrated=float(data["input_i"]),
+            lra=float(data["input_lra"]),
+            true_peak=float(data["input_tp"]),
+            source="analysis",
+        )
+    except (ValueError, KeyError) as e:
+        raise AnalysisError(f"Unreadable loudnorm summary: {e}") from e
+
+
+def from_replaygain(gain: float | None, peak: float | None) -> Loudness | None:
+    """Loudness implied by a ReplayGain track gain and (linear) peak, if tagged."""
+    if gain is None:
+        return None
+    # A sample peak understates the true peak slightly; untagged, assume full scale
+    true_peak = 20 * math.log10(peak) if peak else 0.0
+    return Loudness(REPLAYGAIN_REFERENCE_LUFS - gain, None, true_peak, "replaygain")
+
+
+class LoudnessAnalyzer:
+    """Measures songs' loudness once and turns measurements into per-track gains."""
+
+    def __init__(
+        self,
+        settings: Settings,
+        store: MetadataStore,
+        subsonic,
+        library: LocalLibrary | None = None,
+    ):
+        self._ffmpeg_path = settings.ffmpeg_path
+        self._target = settings.loudness_target_lufs
+        self._peak_ceiling = settings.loudness_true_peak_db
+        self._use_replaygain = settings.loudness_use_replaygain
+        self._workers = settings.loudness_workers or os.cpu_count() or 1
+        self._retry_seconds = settings.loudness_retry_seconds
+        self._ffmpeg_input = settings.ffmpeg_input
+        self._store = store
+        self._subsonic = subsonic
+        self._library = library
+
+    def gain_db(self, song_id: str) -> float | None:
+        """Gain that brings a song to the target loudness, or None if not measured yet.
+
+        Capped so the true peak stays under the ceiling: a fixed gain can't limit peaks,
+        and loudnorm's dynamic mode would need the two-pass encode this avoids.
+        """
+        measured = self._store.loudness(song_id)
+        if measured is None or not math.isfinite(measured["integrated"]):
+            return None  # Unmeasured, or digital silence
+        return min(
+            self._target - measured["integrated"], self._peak_ceiling - measured["true_peak"]
+        )
+
+    async def measure(self, song: dict) -> Loudness:
+        """Measure one song with ffmpeg's loudnorm filter, from the local library file if
+        there is one, otherwise from Subsonic the way transcodes read it (ffmpeg_input)."""
+        local_path = self._library.resolve(song.get("path")) if self._library else None
+        piped = local_path is None and self._ffmpeg_input == "pipe"
+        if local_path is not None:
+            input_url = str(local_path)
+        elif piped:
+            input_url = "pipe:0"
+        else:
+            input_url = self._subsonic.get_stream_url(song["id"])
+        cmd = [
+            self._ffmpeg_path,
+            "-hide_banner",
+            "-nostats",
+            "-i",
+            input_url,
+            "-vn",
+            "-af",
+            "loudnorm=print_format=json",
+            "-f",
+            "null",
+            "-",
+        ]
+        proc = await asyncio.create_subprocess_exec(
+            *cmd,
+            stdin=asyncio.subprocess.PIPE if piped else asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.PIPE,
+        )
+        feeder = None
+        if piped:
+            feeder = asyncio.create_task(feed_track(self._subsonic, proc, song["id"]))
+        try:
+            stderr = await proc.stderr.read()
+            await proc.wait()
+            if feeder is not None:
+                await feeder
+        except TranscodeError as e:
+            raise AnalysisError(str(e)) from e
+        except BaseException:
+            if proc.returncode is None:
+                proc.kill()
+                await proc.wait()
+            raise
+        finally:
+            if feeder is not None:
+                feeder.cancel()
+                await asyncio.gather(feeder, return_exceptions=True)
+
+        text = stderr.decode(errors="replace")
+        if proc.returncode != 0:
+            raise AnalysisError(f"ffmpeg failed (exit {proc.returncode}): {text[-500:]}")
+        return parse_loudnorm(text)
+
+    async def run(self, songs: list[dict]) -> int:
+        """Measure every song that has no stored measurement yet, up to loudness_workers
+        at a time, skipping songs that failed within loudness_retry_seconds. Returns how
+        many measurements were stored."""
+        measured = self._store.measured_song_ids()
+        measured |= self._store.loudness_failed_song_ids(time.time() - self._retry_seconds)
+        pending = list({song["id"]: song for song in songs if song["id"] not in measured}.values())
+        if not pending:
+            return 0
+        logger.info(f"Measuring loudness of {len(pending)} songs ({self._workers} at a time)")
+        semaphore = asyncio.Semaphore(self._workers)
+        stored = 0
+
+        async def measure_one(song: dict):
+            nonlocal stored
+            loudness = None
+            if self._use_replaygain:
+                loudness = from_replaygain(song.get("replay_gain"), song.get("replay_peak"))
+            if loudness is None:
+                async with semaphore:
+                    try:
+                        loudness = await self.measure(song)
+                    except AnalysisError as e:
+                        metrics.LOUDNESS_MEASUREMENTS.labels("analysis", "error").inc()
+                        logger.warning(f"Loudness analysis of {song['id']} failed: {e}")
+                        self._store.put_loudness_failure(song["id"], str(e))
+                        return
+            self._store.put_loudness(
+                song["id"], loudness.integrated, loudness.lra, loudness.true_peak, loudness.source
+            )
+            metrics.LOUDNESS_MEASUREMENTS.labels(loudness.source, "ok").inc()
+            stored += 1
+
+        await asyncio.gather(*(measure_one(song) for song in pending))
+        logger.info(f"Loudness measured for {stored} of {len(pending)} songs")
+        return stored
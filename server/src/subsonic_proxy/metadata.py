@@ -1,15 +1,21 @@
 import json
 import logging
-from datetime import datetime, timedelta
+import time
+from collections.abc import Callable
 from pathlib import Path
 
 from pydantic import BaseModel
 
+from subsonic_proxy import metrics
 from subsonic_proxy.config import Settings
+from subsonic_proxy.store import MetadataStore, album_sync_key
 from subsonic_proxy.subsonic import SubsonicClient
 
 logger = logging.getLogger(__name__)
 
+# Sync cursor: when the whole album list was last walked to find deleted albums
+ALBUMS_SWEPT_AT = "albums_swept_at"
+
 
 class TrackInfo(BaseModel):
     id: str
@@ -36,88 +42,110 @@ class MetadataResponse(BaseModel):
 
 
 class MetadataBuilder:
+    """Builds slot metadata from Subsonic, persisted in a SQLite MetadataStore.
+
+    Refreshes only re-fetch albums whose getAlbumList2 entry changed since the last
+    crawl; everything else is read back from the store.
+    """
+
     def __init__(self, settings: Settings, subsonic: SubsonicClient):
         self._settings = settings
         self._subsonic = subsonic
-        self._cache_path = Path(settings.cache_dir) / "metadata.json"
-        self._cache_ttl = timedelta(seconds=settings.cache_ttl_seconds)
+        self._cache_ttl = settings.cache_ttl_seconds
+        self._store = MetadataStore(Path(settings.cache_dir) / "metadata.db")
+        self._legacy_path = Path(settings.cache_dir) / "metadata.json"
 
-    def _load_from_cache(self) -> MetadataResponse | None:
-        """Load metadata from cache if it exists and is fresh."""
-        if not self._cache_path.exists():
-            logger.info("No cached metadata found")
-            return None
+    @property
+    def store(self) -> MetadataStore:
+        return self._store
 
-        # Check if cache is expired
-        mtime = datetime.fromtimestamp(self._cache_path.stat().st_mtime)
-        if datetime.now() - mtime > self._cache_ttl:
-            logger.info("Cached metadata expired (age: %s)", datetime.now() - mtime)
-            return None
+    def close(self):
+        self._store.close()
 
+    def _migrate_legacy_json(self):
+        """Import a metadata.json written by older versions into the store, once."""
+        if not self._legacy_path.exists() or self._store.built_at is not None:
+            return
         try:
-            logger.info("Loading metadata from cache (%s old)", datetime.now() - mtime)
-            data = json.loads(self._cache_path.read_text())
-            return MetadataResponse(**data)
+            legacy = MetadataResponse(**json.loads(self._legacy_path.read_text()))
         except Exception as e:
-            logger.warning(f"Failed to load cached metadata: {e}")
-            return None
+            logger.warning(f"Failed to migrate legacy metadata.json: {e}")
+            return
 
-    def _save_to_cache(self, metadata: MetadataResponse):
-        """Save metadata to cache."""
-        try:
-            self._cache_path.parent.mkdir(parents=True, exist_ok=True)
-            self._cache_path.write_text(metadata.model_dump_json(indent=2))
-            logger.info(f"Saved metadata to cache: {len(metadata.tracks)} tracks")
-        except Exception as e:
-            logger.warning(f"Failed to save metadata to cache: {e}")
+        album_songs: dict[str, list[dict]] = {}
+        for track in legacy.tracks.values():
+            album_songs.setdefault(track.album_id, []).append(
+                {
+                    "id": track.id,
+                    "title": track.title,
+                    "artist": track.artist,
+                    "album": track.album,
+                    "duration": track.duration,
+                    "coverArt": track.cover_art,
+                }
+            )
+        for album_id, songs in album_songs.items():
+            album = legacy.albums.get(album_id)
+            self._store.put_album(
+                {
+                    "id": album_id,
+                    "name": album.name if album else songs[0]["album"],
+                    "artist": album.artist if album else songs[0]["artist"],
+                },
+                songs,
+                sync_key="",  # Unknown, so the next refresh refetches it
+            )
+        self._store.set_slots(
+            [legacy.tracks[slot_id].id for slot_id in sorted(legacy.tracks)],
+            built_at=self._legacy_path.stat().st_mtime,
+        )
+        self._legacy_path.rename(self._legacy_path.with_suffix(".json.migrated"))
+        logger.info(f"Migrated {len(legacy.tracks)} tracks from metadata.json")
 
-    async def build(self, force_refresh: bool = False) -> MetadataResponse:
-        """Build metadata from Subsonic server or load from cache.
+    def load_cached(self) -> tuple[MetadataResponse | None, bool]:
+        """Load stored metadata regardless of age.
 
-        Args:
-            force_refresh: If True, ignore cache and rebuild from server
+        Returns the metadata (None if nothing has been built yet) and whether it is
+        still within cache_ttl_seconds.
         """
-        # Try to load from cache first (unless force refresh)
-        if not force_refresh:
-            cached = self._load_from_cache()
-            if cached is not None:
-                # Update base_url in case it changed
-                cached.base_url = self._settings.base_url
-                return cached
+        self._migrate_legacy_json()
+        built_at = self._store.built_at
+        if built_at is None:
+            logger.info("No cached metadata found")
+            return None, False
 
-        logger.info("Building metadata from Subsonic server (this may take a moment)...")
-        all_tracks = await self._subsonic.get_all_tracks(
-            strategy=self._settings.selection_strategy,
-            max_count=self._settings.slot_count,
-        )
+        age = time.time() - built_at
+        logger.info("Loading metadata from store (%.0fs old)", age)
+        return self._assemble(self._store.slot_songs()), age <= self._cache_ttl
 
+    def _load_from_cache(self) -> MetadataResponse | None:
+        """Load metadata from the store if it exists and is fresh."""
+        cached, fresh = self.load_cached()
+        if cached is not None and not fresh:
+            logger.info("Cached metadata expired")
+            return None
+        return cached
+
+    def empty(self) -> MetadataResponse:
+        """Metadata with no tracks, served until the first build completes."""
+        return self._assemble([])
+
+    def _assemble(self, slot_songs: list[tuple[str, dict]]) -> MetadataResponse:
         tracks: dict[str, TrackInfo] = {}
         albums: dict[str, AlbumInfo] = {}
 
-        for i, song in enumerate(all_tracks):
-            slot_id = f"{i + 1:04d}"
-            album_id = song.get("albumId", "")
-
-            tracks[slot_id] = TrackInfo(
-                id=song["id"],
-                title=song.get("title", ""),
-                artist=song.get("artist", ""),
-                album=song.get("album", ""),
-                album_id=album_id,
-                duration=song.get("duration", 0),
-                cover_art=song.get("coverArt"),
-            )
-
-            if album_id and album_id not in albums:
-                albums[album_id] = AlbumInfo(
-                    name=song.get("album", ""),
-                    artist=song.get("artist", ""),
-                    track_slots=[],
+        for slot_id, song in slot_songs:
+            track = _track_info(song)
+            tracks[slot_id] = track
+            if not track.album_id:
+                continue
+            if track.album_id not in albums:
+                albums[track.album_id] = AlbumInfo(
+                    name=track.album, artist=track.artist, track_slots=[]
                 )
-            if album_id:
-                albums[album_id].track_slots.append(slot_id)
+            albums[track.album_id].track_slots.append(slot_id)
 
-        metadata = MetadataResponse(
+        return MetadataResponse(
             version=1,
             base_url=self._settings.base_url,
             slot_count=self._settings.slot_count,
@@ -125,7 +153,105 @@ class MetadataBuilder:
             albums=albums,
         )
 
-        # Save to cache for next time
-        self._save_to_cache(metadata)
+    async def _crawl(
+        self, progress: Callable[[int, int], None] | None, refetch: bool = False
+    ) -> list[dict]:
+        """Walk the album list newest first, fetching only albums that changed (or all
+        of them, with refetch), until slot_count songs are collected."""
+        max_count = self._settings.slot_count
+        # Retags and moved files don't change the sync key on most servers
+        known = {} if refetch else self._store.album_sync_keys()
+        songs: list[dict] = []
+        seen: set[str] = set()
+        offset = 0
+        page_size = 500
+        albums_done = 0
+        fetched = 0
+        reached_end = False
+
+        while len(songs) < max_count:
+            page = await self._subsonic.get_album_list(
+                type_="newest", size=page_size, offset=offset
+            )
+            if not page:
+                reached_end = True
+                break
+
+            seen.update(album["id"] for album in page)
+            for album in page:
+                if len(songs) >= max_count:
+                    break
+                if known.get(album["id"]) != album_sync_key(album):
+                    full = await self._subsonic.get_album(album["id"])
+                    self._store.put_album(album, full.get("song", []))
+                    fetched += 1
+                songs.extend(self._store.album_songs(album["id"])[: max_count - len(songs)])
+                albums_done += 1
+                if progress is not None:
+                    progress(albums_done, len(songs))
+
+            offset += page_size
+
+        # Only prune once the whole library has been seen; a capped crawl says nothing
+        # about the albums it didn't reach, so the rest of the list is walked for ids
+        # alone on refetch and every metadata_sweep_interval_seconds
+        if not reached_end and (refetch or self._sweep_due()):
+            while page := await self._subsonic.get_album_list(
+                type_="newest", size=page_size, offset=offset
+            ):
+                seen.update(album["id"] for album in page)
+                offset += page_size
+            reached_end = True
+        if reached_end:
+            self._store.prune_albums(seen)
+            self._store.set_cursor(ALBUMS_SWEPT_AT, repr(time.time()))
+        logger.info(f"Crawled {albums_done} albums ({fetched} fetched, rest unchanged)")
+        return songs
+
+    def _sweep_due(self) -> bool:
+        swept_at = self._store.get_cursor(ALBUMS_SWEPT_AT)
+        return (
+            swept_at is None
+            or time.time() - float(swept_at) >= self._settings.metadata_sweep_interval_seconds
+        )
+
+    async def build(
+        self,
+        force_refresh: bool = False,
+        progress: Callable[[int, int], None] | None = None,
+        refetch: bool = False,
+    ) -> MetadataResponse:
+        """Build metadata from Subsonic server or load from cache.
 
+        Args:
+            force_refresh: If True, ignore cache and rebuild from server
+            progress: Called with (albums fetched, tracks found) during a rebuild
+            refetch: If True, fetch every album again even if its sync key is
+                unchanged, and walk the whole album list to prune deleted albums
+        """
+        # Try to load from cache first (unless force refresh)
+        if not force_refresh:
+            cached = self._load_from_cache()
+            if cached is not None:
+                metrics.CACHE_REQUESTS.labels("metadata", "hit").inc()
+                return cached
+            metrics.CACHE_REQUESTS.labels("metadata", "miss").inc()
+
+        logger.info("Building metadata from Subsonic server (this may take a moment)...")
+        songs = await self._crawl(progress, refetch=refetch)
+        self._store.set_slots([song["id"] for song in songs])
+        metadata = self._assemble(self._store.slot_songs())
+        logger.info(f"Saved metadata to store: {len(metadata.tracks)} tracks")
         return metadata
+
+
+def _track_info(song: dict) -> TrackInfo:
+    return TrackInfo(
+        id=song["id"],
+        title=song["title"],
+        artist=song["artist"],
+        album=song["album"],
+        album_id=song["album_id"],
+        duration=song["duration"],
+        cover_art=song["cover_art"],
+    )
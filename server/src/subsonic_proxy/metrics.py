@@ -0,0 +1,355 @@
+"""Minimal Prometheus-style metrics.
+
+Instruments are module-level singletons so any component can record into them without
+threading a registry through constructors. Recording is a dict lookup plus an add,
+cheap enough for the segment hot path. `render()` produces the Prometheus text
+exposition format served at `/metrics`.
+"""
+
+import abc
+import bisect
+import math
+import time
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SLOW_BUCKETS = (0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0, 300.0, 600.0)
+
+
+def _format_labels(names: tuple[str, ...], values: tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if value == int(value):
+        return str(int(value))
+    return repr(value)
+
+
+class _Metric(abc.ABC):
+    type_name = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._children: dict[tuple[str, ...], object] = {}
+        REGISTRY.append(self)
+
+    def labels(self, *values: str):
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}")
+            child = self._children[values] = self._new_child()
+        return child
+
+    @abc.abstractmethod
+    def _new_child(self): ...
+
+    def _default(self):
+        return self.labels()
+
+    def render(self) -> list[str]:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type_name}",
+        ]
+        for values, child in sorted(self._children.items()):
+            lines.extend(self._render_child(values, child))
+        return lines
+
+    def _render_child(self, values, child) -> list[str]:
+        labels = _format_labels(self.labelnames, values)
+        return [f"{self.name}{labels} {_format_value(child.value)}"]
+
+
+class _Value:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+
+class _CounterChild(_Value):
+    __slots__ = ()
+
+    def inc(self, amount: float = 1.0):
+        self.value += amount
+
+
+class _GaugeChild(_Value):
+    __slots__ = ()
+
+    def inc(self, amount: float = 1.0):
+        self.value += amount
+
+    def dec(self, amount: float = 1.0):
+        self.value -= amount
+
+    def set(self, value: float):
+        self.value = value
+
+
+class Counter(_Metric):
+    type_name = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount: float = 1.0):
+        self._default().inc(amount)
+
+
+class Gauge(_Metric):
+    type_name = "gauge"
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def inc(self, amount: float = 1.0):
+        self._default().inc(amount)
+
+    def dec(self, amount: float = 1.0):
+        self._default().dec(amount)
+
+    def set(self, value: float):
+        self._default().set(value)
+
+
+class _HistogramChild:
+    __slots__ = ("buckets", "count", "counts", "sum")
+
+    def __init__(self, buckets: tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    @contextmanager
+    def time(self):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+
+class Histogram(_Metric):
+    type_name = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float):
+        self._default().observe(value)
+
+    def time(self):
+        return self._default().time()
+
+    def _render_child(self, values, child) -> list[str]:
+        lines = []
+        cumulative = 0
+        for bound, count in zip((*self.buckets, math.inf), child.counts):
+            cumulative += count
+            le = f'le="{_format_value(bound)}"'
+            labels = _format_labels(self.labelnames, values, le)
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+        labels = _format_labels(self.labelnames, values)
+        lines.append(f"{self.name}_sum{labels} {_format_value(child.sum)}")
+        lines.append(f"{self.name}_count{labels} {child.count}")
+        return lines
+
+
+REGISTRY: list[_Metric] = []
+
+
+def render() -> str:
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# Request path
+HTTP_REQUEST_SECONDS = Histogram(
+    "subsonic_proxy_http_request_seconds",
+    "HTTP request latency by route",
+    ("route", "method", "status"),
+)
+PLAYLIST_SECONDS = Histogram(
+    "subsonic_proxy_playlist_seconds",
+    "Playlist request latency, split by whether a transcode was needed",
+    ("cache",),
+    buckets=DEFAULT_BUCKETS + SLOW_BUCKETS[-6:],
+)
+BYTES_SERVED = Counter(
+    "subsonic_proxy_bytes_served_total",
+    "Response body bytes served by route",
+    ("route",),
+)
+CACHE_REQUESTS = Counter(
+    "subsonic_proxy_cache_requests_total",
+    "Cache lookups by category and result",
+    ("category", "result"),
+)
+CACHE_TIER_MOVES = Counter(
+    "subsonic_proxy_cache_tier_moves_total",
+    "Cache entries moved between the hot (RAM) and disk tiers",
+    ("direction",),
+)
+EVENT_LOOP_STALLS = Counter(
+    "subsonic_proxy_event_loop_stalls_total",
+    "Times the event loop was blocked longer than loop_block_threshold_ms",
+)
+EVENT_LOOP_STALLS.inc(0)
+
+# Transcoding
+TRANSCODE_QUEUE_WAIT_SECONDS = Histogram(
+    "subsonic_proxy_transcode_queue_wait_seconds",
+    "Time a transcode waited for the slot lock and the concurrency semaphore",
+    ("stage",),
+    buckets=DEFAULT_BUCKETS + SLOW_BUCKETS[-6:],
+)
+TRANSCODES_IN_FLIGHT = Gauge(
+    "subsonic_proxy_transcodes_in_flight",
+    "Transcodes currently holding the concurrency semaphore",
+)
+TRANSCODES_IN_FLIGHT.set(0)
+FFMPEG_WALL_SECONDS = Histogram(
+    "subsonic_proxy_ffmpeg_wall_seconds",
+    "FFmpeg wall-clock time per transcode",
+    ("result",),
+    buckets=SLOW_BUCKETS,
+)
+FFMPEG_CPU_SECONDS = Histogram(
+    "subsonic_proxy_ffmpeg_cpu_seconds",
+    "FFmpeg user+system CPU time per transcode",
+    buckets=SLOW_BUCKETS,
+)
+COVER_FETCH_SECONDS = Histogram(
+    "subsonic_proxy_cover_fetch_seconds",
+    "Time to fetch cover art from Subsonic",
+    ("result",),
+)
+
+# Loudness
+LOUDNESS_MEASUREMENTS = Counter(
+    "subsonic_proxy_loudness_measurements_total",
+    "Songs whose loudness was stored, by source (analysis or replaygain)",
+    ("source", "result"),
+)
+
+# Radio
+RADIO_TRACKS = Counter(
+    "subsonic_proxy_radio_tracks_total",
+    "Queued tracks the radio channel scheduled, or skipped because preparing them failed "
+    "or took too long",
+    ("result",),
+)
+RADIO_GAP_SECONDS = Histogram(
+    "subsonic_proxy_radio_gap_seconds",
+    "Dead air before a radio track started because it was still being prepared",
+    buckets=(0.0,) + DEFAULT_BUCKETS + SLOW_BUCKETS[-6:],
+)
+
+# Cluster
+CLUSTER_PLAYLIST_REQUESTS = Counter(
+    "subsonic_proxy_cluster_playlist_requests_total",
+    "Playlist requests for slots owned by another node, by how they were served",
+    ("result",),
+)
+
+# Upstream
+SUBSONIC_REQUEST_SECONDS = Histogram(
+    "subsonic_proxy_subsonic_request_seconds",
+    "Subsonic API call latency by endpoint",
+    ("endpoint", "result"),
+    buckets=DEFAULT_BUCKETS + SLOW_BUCKETS[-6:],
+)
+SOURCE_READS = Counter(
+    "subsonic_proxy_source_reads_total",
+    "Source audio reads for transcodes and /{slot}.mp3, by where the audio came from",
+    ("kind", "source"),
+)
+SUBSONIC_STREAM_BYTES = Counter(
+    "subsonic_proxy_subsonic_stream_bytes_total",
+    "Source audio bytes streamed from Subsonic into ffmpeg",
+)
+SUBSONIC_RETRIES = Counter(
+    "subsonic_proxy_subsonic_retries_total",
+    "Subsonic API calls retried after a transient failure",
+    ("endpoint",),
+)
+SUBSONIC_CIRCUIT_OPEN = Gauge(
+    "subsonic_proxy_subsonic_circuit_open",
+    "1 while the Subsonic circuit breaker is rejecting calls",
+)
+SUBSONIC_CIRCUIT_OPEN.set(0)
+SUBSONIC_CIRCUIT_REJECTED = Counter(
+    "subsonic_proxy_subsonic_circuit_rejected_total",
+    "Subsonic API calls rejected by the open circuit breaker",
+    ("endpoint",),
+)
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording latency and body bytes per route template.
+
+    Labels use the matched route's path template (e.g. `/{slot_id}.m3u8`) rather than
+    the raw URL so label cardinality stays bounded.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        status = 500
+        body_bytes = 0
+
+        async def send_wrapper(message):
+            nonlocal status, body_bytes
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                body_bytes += len(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            path = getattr(route, "path", "unmatched")
+            HTTP_REQUEST_SECONDS.labels(path, scope["method"], str(status)).observe(
+                time.perf_counter() - start
+            )
+            BYTES_SERVED.labels(path).inc(body_bytes)
@@ -0,0 +1,175 @@
+"""Opt-in profiling for finding where Python time goes in production.
+
+`ProfilingMiddleware` samples the event loop thread's stack while a single request
+runs and stores the samples as folded stacks (one `frame;frame;frame count` line per
+unique stack), which flamegraph.pl, speedscope and inferno read directly. Samples come
+from the loop thread, so anything else the loop runs concurrently shows up too;
+profile on a quiet instance for a clean picture.
+
+`LoopMonitor` watches for the event loop being blocked by synchronous work and records
+the blocking stack.
+"""
+
+import asyncio
+import logging
+import os
+import re
+import sys
+import threading
+import time
+import traceback
+import uuid
+from collections import Counter, deque
+from pathlib import Path
+
+from subsonic_proxy import metrics
+
+logger = logging.getLogger(__name__)
+
+PROFILE_ID_RE = re.compile(r"^[\w-]+$")
+
+
+def _folded_stack(frame) -> str:
+    parts = []
+    while frame is not None:
+        code = frame.f_code
+        parts.append(f"{code.co_qualname} ({os.path.basename(code.co_filename)})")
+        frame = frame.f_back
+    return ";".join(reversed(parts))
+
+
+class StackSampler:
+    """Samples one thread's Python stack from a background thread."""
+
+    def __init__(self, thread_id: int, interval: float):
+        self._thread_id = thread_id
+        self._interval = interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+        self.samples: Counter[str] = Counter()
+
+    def _run(self):
+        while not self._stop.wait(self._interval):
+            frame = sys._current_frames().get(self._thread_id)
+            if frame is not None:
+                self.samples[_folded_stack(frame)] += 1
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def to_folded(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self.samples.most_common())
+
+
+def profile_dir(settings) -> Path:
+    return Path(settings.cache_dir) / "profiles"
+
+
+class ProfilingMiddleware:
+    """ASGI middleware profiling requests that ask for it with `X-Profile: 1`.
+
+    Only active when `profiling_enabled` is set, and requires the admin token when one
+    is configured. The response carries an `X-Profile-Id` header naming the stored
+    profile, fetchable from `/admin/profiles/{id}`.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    def _should_profile(self, scope) -> bool:
+        state = getattr(scope["app"].state, "svc", None)
+        if state is None or not state.settings.profiling_enabled:
+            return False
+        headers = dict(scope["headers"])
+        if headers.get(b"x-profile") != b"1":
+            return False
+        token = state.settings.admin_token
+        return not token or headers.get(b"x-admin-token", b"").decode() == token
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self._should_profile(scope):
+            await self.app(scope, receive, send)
+            return
+
+        settings = scope["app"].state.svc.settings
+        profile_id = f"{time.strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:8]}"
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                headers = list(message.get("headers", []))
+                headers.append((b"x-profile-id", profile_id.encode()))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        sampler = StackSampler(threading.get_ident(), settings.profiling_sample_interval_ms / 1000)
+        sampler.start()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            sampler.stop()
+            path = profile_dir(settings) / f"{profile_id}.folded"
+            await asyncio.to_thread(_write_profile, path, sampler.to_folded())
+            logger.info(
+                f"Profiled {scope['method']} {scope['path']}: "
+                f"{sum(sampler.samples.values())} samples -> {path}"
+            )
+
+
+def _write_profile(path: Path, content: str):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(content)
+
+
+class LoopMonitor:
+    """Detects event loop stalls and records the stack that caused them.
+
+    A task on the loop bumps a heartbeat; a watchdog thread reports once per stall
+    whenever the heartbeat falls more than `threshold` seconds behind, capturing the
+    loop thread's stack at that moment (i.e. the synchronous call holding it up).
+    """
+
+    def __init__(self, threshold: float, history: int = 50):
+        self.threshold = threshold
+        self.reports: deque[dict] = deque(maxlen=history)
+        self._heartbeat = time.monotonic()
+        self._loop_thread_id: int | None = None
+        self._task: asyncio.Task | None = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._watch, name="loop-monitor", daemon=True)
+
+    async def _beat(self):
+        while True:
+            self._heartbeat = time.monotonic()
+            await asyncio.sleep(self.threshold / 4)
+
+    def _watch(self):
+        reported = None
+        while not self._stop.wait(self.threshold / 4):
+            heartbeat = self._heartbeat
+            behind = time.monotonic() - heartbeat
+            if behind < self.threshold or reported == heartbeat:
+                continue
+            reported = heartbeat
+            frame = sys._current_frames().get(self._loop_thread_id)
+            stack = "".join(traceback.format_stack(frame)) if frame is not None else ""
+            self.reports.append(
+                {"at": time.time(), "blocked_seconds": round(behind, 3), "stack": stack}
+            )
+            metrics.EVENT_LOOP_STALLS.inc()
+            logger.warning(f"Event loop blocked for {behind * 1000:.0f} ms at:\n{stack}")
+
+    def start(self):
+        self._loop_thread_id = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._task = asyncio.create_task(self._beat())
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._task is not None:
+            self._task.cancel()
+        self._thread.join()
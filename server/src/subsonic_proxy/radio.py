@@ -0,0 +1,276 @@
+"""Live HLS radio channel stitched from cached transcodes.
+
+The channel plays a server-side queue of slots back to back behind one fixed URL, so
+VRChat worlds can bake it into a VRCUrl and never reload the player between tracks.
+Each track's finished VOD segments are scheduled on a wall-clock timeline and revealed
+as a sliding live window, with EXT-X-DISCONTINUITY between tracks. Upcoming tracks are
+transcoded while the current one plays, so the next track's segments are ready before
+the timeline reaches them.
+"""
+
+import asyncio
+import logging
+import math
+import time
+from collections import deque
+from collections.abc import Awaitable, Callable
+from dataclasses import dataclass, field
+from pathlib import Path
+
+from subsonic_proxy import metrics
+from subsonic_proxy.cache import encode_version
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class RadioSegment:
+    """One segment of a cached transcode, placed on the channel's timeline."""
+
+    slot_id: str
+    play: int  # Counts tracks scheduled on the channel, telling repeats of a slot apart
+    uri: str  # Relative to /segments, e.g. 0001/18c3f2a1b0c4d000/seg000.ts
+    duration: float
+    start: float  # Channel clock time the segment starts airing
+    tags: list[str] = field(default_factory=list)  # Per-segment tags, e.g. EXT-X-BYTERANGE
+    map_uri: str | None = None  # fMP4 init segment, relative to /segments
+    discontinuity: bool = False
+
+
+def _media_playlist(m3u8_path: Path) -> Path:
+    """The media playlist behind a slot's index.m3u8: the file itself, or the first
+    variant of a bitrate ladder's master playlist."""
+    content = m3u8_path.read_text()
+    if "#EXT-X-STREAM-INF" not in content:
+        return m3u8_path
+    variant = next(line for line in content.splitlines() if line and line[0] != "#")
+    return m3u8_path.with_name(variant)
+
+
+def parse_media_playlist(
+    content: str,
+) -> tuple[int, list[tuple[float, str, list[str], str | None]]]:
+    """Split a VOD media playlist into (version, [(duration, uri, tags, map uri)])."""
+    version = 3
+    segments = []
+    duration, tags, map_uri = None, [], None
+    for line in content.splitlines():
+        if line.startswith("#EXT-X-VERSION:"):
+            version = int(line.partition(":")[2])
+        elif line.startswith("#EXTINF:"):
+            duration = float(line.partition(":")[2].split(",")[0])
+        elif line.startswith("#EXT-X-BYTERANGE:"):
+            tags.append(line)
+        elif line.startswith("#EXT-X-MAP:"):
+            map_uri = line.partition('URI="')[2].partition('"')[0]
+        elif line and not line.startswith("#") and duration is not None:
+            segments.append((duration, line, tags, map_uri))
+            duration, tags = None, []
+    return version, segments
+
+
+class RadioChannel:
+    """A queue of slots played back to back as one live HLS stream.
+
+    prepare(slot_id) transcodes a slot (or finds it cached) and returns its
+    index.m3u8. The next prepare_ahead queued slots are prepared as soon as they are
+    queued, and the head of the queue is scheduled one segment before the current
+    track ends, so queue changes apply until the last moment without leaving a gap. A
+    head track still not prepared prepare_timeout seconds after that is skipped, so a
+    slow or hung transcode can't hold up the rest of the queue.
+    """
+
+    def __init__(
+        self,
+        prepare: Callable[[str], Awaitable[Path]],
+        segment_duration: int,
+        window_segments: int = 6,
+        prepare_ahead: int = 2,
+        max_queue: int = 100,
+        prepare_timeout: float = 60.0,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self._prepare = prepare
+        self._lead = segment_duration
+        self._window = window_segments
+        self._prepare_ahead = max(prepare_ahead, 1)
+        self._max_queue = max_queue
+        self._prepare_timeout = prepare_timeout
+        self._clock = clock
+
+        self.queue: deque[str] = deque()
+        self._segments: deque[RadioSegment] = deque()
+        self._media_sequence = 0
+        self._discontinuity_sequence = 0
+        self._target_duration = segment_duration
+        self._version = 3
+        self._plays = 0
+        self._ends_at = -math.inf  # Channel clock time the scheduled segments run out
+        self._preparing: dict[str, asyncio.Task] = {}
+        self._wakeup = asyncio.Event()
+
+    def enqueue(self, slot_id: str, play_next: bool = False) -> bool:
+        """Add a slot to the end of the queue, or to the front with play_next. Returns
+        False if the queue is full."""
+        if len(self.queue) >= self._max_queue:
+            return False
+        if play_next:
+            self.queue.appendleft(slot_id)
+        else:
+            self.queue.append(slot_id)
+        self._wakeup.set()
+        return True
+
+    def clear(self):
+        """Empty the queue; the current track plays out."""
+        self.queue.clear()
+        self._wakeup.set()
+
+    def skip(self):
+        """Cut the current track short after the segment now airing.
+
+        A next track that was already scheduled goes back to the front of the queue
+        and starts right at the cut.
+        """
+        now = self._clock()
+        current = self._current(now)
+        requeue: dict[int, str] = {}
+        while self._segments and self._segments[-1].start > now:
+            segment = self._segments.pop()
+            if current is None or segment.play != current.play:
+                requeue[segment.play] = segment.slot_id
+        for play in sorted(requeue, reverse=True):
+            self.queue.appendleft(requeue[play])
+        self._ends_at = current.start + current.duration if current is not None else now
+        self._wakeup.set()
+
+    def _current(self, now: float) -> RadioSegment | None:
+        airing = None
+        for segment in self._segments:
+            if segment.start > now:
+                break
+            airing = segment
+        if airing is None or airing.start + airing.duration <= now:
+            return None
+        return airing
+
+    def now_playing(self) -> str | None:
+        current = self._current(self._clock())
+        return current.slot_id if current is not None else None
+
+    def to_dict(self) -> dict:
+        return {"now_playing": self.now_playing(), "queue": list(self.queue)}
+
+    def _schedule(self, slot_id: str, m3u8_path: Path):
+        """Append a prepared track's segments to the timeline, back to back with the
+        previous track."""
+        version, parsed = parse_media_playlist(_media_playlist(m3u8_path).read_text())
+        if not parsed:
+            raise ValueError(f"No segments in the playlist for slot {slot_id}")
+        prefix = f"{slot_id}/{encode_version(m3u8_path)}"
+        now = self._clock()
+        self._prune(now)
+        start = max(self._ends_at, now)
+        self._plays += 1
+        self._version = max(self._version, version)
+        for i, (duration, uri, tags, map_uri) in enumerate(parsed):
+            self._segments.append(
+                RadioSegment(
+                    slot_id=slot_id,
+                    play=self._plays,
+                    uri=f"{prefix}/{uri}",
+                    duration=duration,
+                    start=start,
+                    tags=tags,
+                    map_uri=f"{prefix}/{map_uri}" if map_uri else None,
+                    discontinuity=i == 0 and self._plays > 1,
+                )
+            )
+            self._target_duration = max(self._target_duration, math.ceil(duration))
+            start += duration
+        self._ends_at = start
+        logger.info(f"Radio: slot {slot_id} scheduled, {len(parsed)} segments")
+
+    def _prune(self, now: float) -> int:
+        """Drop aired segments that slid out of the live window, keeping the sequence
+        numbers in step. Returns how many segments have aired."""
+        aired = sum(1 for segment in self._segments if segment.start <= now)
+        while aired > self._window:
+            segment = self._segments.popleft()
+            aired -= 1
+            self._media_sequence += 1
+            if segment.discontinuity:
+                self._discontinuity_sequence += 1
+        return aired
+
+    def playlist(self) -> str:
+        """The live media playlist as of now, with URIs relative to /segments."""
+        aired = self._prune(self._clock())
+        lines = [
+            "#EXTM3U",
+            f"#EXT-X-VERSION:{self._version}",
+            f"#EXT-X-TARGETDURATION:{self._target_duration}",
+            f"#EXT-X-MEDIA-SEQUENCE:{self._media_sequence}",
+            f"#EXT-X-DISCONTINUITY-SEQUENCE:{self._discontinuity_sequence}",
+        ]
+        map_uri = None
+        for segment in list(self._segments)[:aired]:
+            if segment.discontinuity:
+                lines.append("#EXT-X-DISCONTINUITY")
+            if segment.map_uri is not None and segment.map_uri != map_uri:
+                lines.append(f'#EXT-X-MAP:URI="{segment.map_uri}"')
+                map_uri = segment.map_uri
+            lines.append(f"#EXTINF:{segment.duration:.3f},")
+            lines += segment.tags
+            lines.append(segment.uri)
+        return "\n".join(lines) + "\n"
+
+    def _prepare_upcoming(self):
+        """Start transcoding the next queued slots, and forget ones no longer queued."""
+        upcoming = list(self.queue)[: self._prepare_ahead]
+        for slot_id in list(self._preparing):
+            if slot_id not in upcoming:
+                del self._preparing[slot_id]
+        for slot_id in upcoming:
+            if slot_id not in self._preparing:
+                task = asyncio.ensure_future(self._prepare(slot_id))
+                # Mark the exception retrieved in case the slot is dequeued unplayed
+                task.add_done_callback(lambda t: t.cancelled() or t.exception())
+                self._preparing[slot_id] = task
+
+    async def run(self):
+        """Prepare and schedule queued tracks until cancelled."""
+        while True:
+            self._wakeup.clear()
+            self._prepare_upcoming()
+            now = self._clock()
+            if self.queue and self._ends_at - now <= self._lead:
+                slot_id = self.queue[0]
+                due = max(self._ends_at, now)
+                try:
+                    m3u8_path = await asyncio.wait_for(
+                        self._preparing[slot_id], due - now + self._prepare_timeout
+                    )
+                    if self.queue and self.queue[0] == slot_id:
+                        metrics.RADIO_GAP_SECONDS.observe(max(self._clock() - due, 0.0))
+                        self._schedule(slot_id, m3u8_path)
+                        metrics.RADIO_TRACKS.labels("ok").inc()
+                except TimeoutError:
+                    metrics.RADIO_TRACKS.labels("timeout").inc()
+                    logger.warning(
+                        f"Radio: skipping slot {slot_id}, "
+                        f"not ready {self._prepare_timeout:.0f}s after its turn"
+                    )
+                except Exception:
+                    # Whatever went wrong with one track, the channel plays on
+                    metrics.RADIO_TRACKS.labels("error").inc()
+                    logger.exception(f"Radio: skipping slot {slot_id}")
+                if self.queue and self.queue[0] == slot_id:
+                    self.queue.popleft()
+                self._preparing.pop(slot_id, None)
+                continue
+            timeout = self._ends_at - self._lead - now if self.queue else None
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except TimeoutError:
+                pass
@@ -0,0 +1,145 @@
+import asyncio
+import functools
+import logging
+import time
+import uuid
+from collections import OrderedDict
+from collections.abc import Callable
+from dataclasses import dataclass, field
+
+from subsonic_proxy.metadata import MetadataBuilder, MetadataResponse
+
+logger = logging.getLogger(__name__)
+
+
+def new_job_id() -> str:
+    return uuid.uuid4().hex[:12]
+
+
+@dataclass
+class RefreshJob:
+    """A metadata rebuild running in the background, with crawl progress."""
+
+    id: str
+    trigger: str  # "manual", "startup" or "scheduled"
+    state: str = "running"  # "running", "done" or "failed"
+    started_at: float = field(default_factory=time.time)
+    finished_at: float | None = None
+    albums_fetched: int = 0
+    tracks_found: int = 0
+    track_count: int | None = None
+    error: str | None = None
+    # Ids handed out for requests that joined this job rather than starting their own
+    joined_ids: list[str] = field(default_factory=list)
+    task: asyncio.Task | None = field(default=None, repr=False)
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "trigger": self.trigger,
+            "state": self.state,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "albums_fetched": self.albums_fetched,
+            "tracks_found": self.tracks_found,
+            "track_count": self.track_count,
+            "error": self.error,
+            "joined_ids": self.joined_ids,
+        }
+
+    def update_progress(self, albums_fetched: int, tracks_found: int):
+        self.albums_fetched = albums_fetched
+        self.tracks_found = tracks_found
+
+
+class RefreshManager:
+    """Runs metadata rebuilds as background jobs, at most one at a time.
+
+    Starting a refresh while one is running joins the running job, so overlapping
+    requests never crawl Subsonic twice. on_complete receives the new metadata when a
+    job succeeds; a failed job leaves the current metadata in place. on_update, if
+    given, is called whenever a job starts, makes progress or finishes.
+    """
+
+    def __init__(
+        self,
+        metadata_builder: MetadataBuilder,
+        on_complete: Callable[[MetadataResponse], None],
+        history_size: int = 20,
+        on_update: Callable[[RefreshJob], None] | None = None,
+    ):
+        self._builder = metadata_builder
+        self._on_complete = on_complete
+        self._on_update = on_update
+        self._history_size = history_size
+        self.jobs: OrderedDict[str, RefreshJob] = OrderedDict()
+        self.current: RefreshJob | None = None
+
+    def start(self, trigger: str = "manual", job_id: str | None = None) -> tuple[RefreshJob, bool]:
+        """Start a refresh, or join the one in flight. Returns (job, started).
+
+        job_id, if given, is an id already handed out for this request (see new_job_id):
+        the new job takes it, or a joined job answers to it as well.
+        """
+        if self.current is not None and self.current.state == "running":
+            if job_id is not None and job_id != self.current.id:
+                self.current.joined_ids.append(job_id)
+                self._updated(self.current)
+            return self.current, False
+
+        job = RefreshJob(id=job_id or new_job_id(), trigger=trigger)
+        job.task = asyncio.create_task(self._run(job))
+        self.current = job
+        self.jobs[job.id] = job
+        while len(self.jobs) > self._history_size:
+            self.jobs.popitem(last=False)
+        return job, True
+
+    def get(self, job_id: str) -> RefreshJob | None:
+        job = self.jobs.get(job_id)
+        if job is None:
+            job = next((j for j in self.jobs.values() if job_id in j.joined_ids), None)
+        return job
+
+    def _updated(self, job: RefreshJob):
+        if self._on_update is not None:
+            self._on_update(job)
+
+    def _progress(self, job: RefreshJob, albums_fetched: int, tracks_found: int):
+        job.update_progress(albums_fetched, tracks_found)
+        self._updated(job)
+
+    async def _run(self, job: RefreshJob):
+        logger.info(f"Metadata refresh {job.id} started ({job.trigger})")
+        self._updated(job)
+        try:
+            metadata = await self._builder.build(
+                force_refresh=True,
+                progress=functools.partial(self._progress, job),
+                # Someone asked for this one, maybe to pick up retags the sync keys miss
+                refetch=job.trigger == "manual",
+            )
+        except Exception as e:
+            job.finished_at = time.time()
+            job.state = "failed"
+            job.error = str(e)
+            logger.exception(f"Metadata refresh {job.id} failed")
+            self._updated(job)
+            return
+
+        job.finished_at = time.time()
+        job.track_count = len(metadata.tracks)
+        job.state = "done"
+        logger.info(
+            f"Metadata refresh {job.id} done: {job.track_count} tracks "
+            f"in {job.finished_at - job.started_at:.1f}s"
+        )
+        self._on_complete(metadata)
+        self._updated(job)
+
+    async def run_periodic(self, interval_seconds: float):
+        """Start a scheduled refresh every interval_seconds, forever."""
+        while True:
+            await asyncio.sleep(interval_seconds)
+            job, _ = self.start("scheduled")
+            await asyncio.wait([job.task])
@@ -0,0 +1,365 @@
+"""Portable cache snapshots, for bootstrapping a new node without a cold cache.
+
+A snapshot is a tar stream (optionally gzipped) holding a consistent copy of the
+metadata database, every complete and unexpired HLS transcode, and cached covers and
+audio. manifest.json comes last and lists each file's size, SHA-256 and mtime, so the
+archive can be written and read in one pass, e.g. piped between machines:
+
+    python -m subsonic_proxy.snapshot export - | ssh new-node \\
+        python -m subsonic_proxy.snapshot import -
+
+Imports stage and verify everything before installing anything, and install each slot
+directory with a rename while holding that slot's transcode lock, so a running server
+never sees a half-installed slot. Cache files keep their original mtimes, so TTLs carry
+over. A running server imports through POST /admin/snapshot, which also refreshes its
+in-memory state from the manifest.
+"""
+
+import argparse
+import hashlib
+import io
+import json
+import logging
+import os
+import shutil
+import sys
+import tarfile
+import tempfile
+import time
+from collections.abc import Callable
+from dataclasses import asdict, dataclass, field
+from pathlib import Path, PurePosixPath
+from typing import BinaryIO
+
+from filelock import FileLock, Timeout
+
+from subsonic_proxy.cache import CacheManager
+from subsonic_proxy.store import MetadataStore
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_VERSION = 1
+MANIFEST_NAME = "manifest.json"
+METADATA_NAME = "metadata.db"
+CACHE_DIRS = ("segments", "covers", "audio")
+
+
+class SnapshotError(Exception):
+    pass
+
+
+@dataclass
+class SnapshotFile:
+    path: str
+    size: int
+    sha256: str
+    mtime: float
+
+
+@dataclass
+class Manifest:
+    created_at: float
+    files: list[SnapshotFile] = field(default_factory=list)
+    version: int = SNAPSHOT_VERSION
+
+    def to_json(self) -> bytes:
+        return json.dumps(asdict(self), indent=1).encode()
+
+    @classmethod
+    def from_json(cls, data: bytes) -> "Manifest":
+        try:
+            raw = json.loads(data)
+            if raw["version"] != SNAPSHOT_VERSION:
+                raise SnapshotError(f"Unsupported snapshot version {raw['version']}")
+            return cls(
+                created_at=raw["created_at"],
+                files=[SnapshotFile(**f) for f in raw["files"]],
+            )
+        except (KeyError, TypeError, ValueError) as e:
+            raise SnapshotError(f"Malformed manifest: {e}") from e
+
+    def slot_files(self) -> dict[str, list[str]]:
+        """File names in each slot directory, by slot id."""
+        slots: dict[str, list[str]] = {}
+        for f in self.files:
+            parts = PurePosixPath(f.path).parts
+            if parts[0] == "segments":
+                slots.setdefault(parts[1], []).append(parts[2])
+        return slots
+
+
+def _is_complete_slot(slot_dir: Path, ttl_seconds: int, now: float) -> bool:
+    m3u8 = slot_dir / "index.m3u8"
+    try:
+        if now - m3u8.stat().st_mtime > ttl_seconds:
+            return False
+        content = m3u8.read_text()
+        if "#EXT-X-STREAM-INF" in content:
+            # A bitrate ladder's master playlist: every variant must be finished
+            variants = [line for line in content.splitlines() if line and line[0] != "#"]
+            return all("#EXT-X-ENDLIST" in (slot_dir / v).read_text() for v in variants)
+        return "#EXT-X-ENDLIST" in content
+    except OSError:
+        return False
+
+
+def _cache_files(roots: list[Path], ttl_seconds: int) -> dict[str, Path]:
+    """Files to export by archive name: complete, unexpired transcodes plus unexpired
+    covers and audio. Earlier roots (cache tiers) win when several hold an entry."""
+    now = time.time()
+    files: dict[str, Path] = {}
+    for root in roots:
+        segments_dir = root / "segments"
+        if segments_dir.exists():
+            for slot_dir in sorted(segments_dir.iterdir()):
+                # Dot directories are transcodes still being swapped in
+                if slot_dir.name.startswith(".") or not slot_dir.is_dir():
+                    continue
+                if f"segments/{slot_dir.name}/index.m3u8" in files:
+                    continue
+                if _is_complete_slot(slot_dir, ttl_seconds, now):
+                    for p in sorted(slot_dir.iterdir()):
+                        if p.is_file():
+                            files[p.relative_to(root).as_posix()] = p
+        for name in ("covers", "audio"):
+            directory = root / name
+            if directory.exists():
+                for p in sorted(directory.iterdir()):
+                    # Dot files are covers still being written
+                    if (
+                        p.is_file()
+                        and not p.name.startswith(".")
+                        and now - p.stat().st_mtime <= ttl_seconds
+                    ):
+                        files.setdefault(p.relative_to(root).as_posix(), p)
+    return files
+
+
+class _HashingReader:
+    """Wraps a file so tarfile's reads also feed a SHA-256 digest."""
+
+    def __init__(self, f: BinaryIO):
+        self._f = f
+        self.digest = hashlib.sha256()
+
+    def read(self, n: int = -1) -> bytes:
+        chunk = self._f.read(n)
+        self.digest.update(chunk)
+        return chunk
+
+
+def _add_file(tar: tarfile.TarFile, path: Path, arcname: str) -> SnapshotFile:
+    with path.open("rb") as f:
+        stat = os.fstat(f.fileno())
+        info = tarfile.TarInfo(arcname)
+        info.size = stat.st_size
+        info.mtime = stat.st_mtime
+        reader = _HashingReader(f)
+        tar.addfile(info, reader)
+    return SnapshotFile(arcname, info.size, reader.digest.hexdigest(), stat.st_mtime)
+
+
+def write_snapshot(
+    out: BinaryIO,
+    cache_dir: Path,
+    metadata_db: Path,
+    ttl_seconds: int,
+    compress: bool = False,
+    hot_dir: Path | None = None,
+) -> Manifest:
+    """Write a snapshot of cache_dir (and the hot tier, if any) to out as a tar stream.
+
+    metadata_db is a consistent copy of the metadata database (MetadataStore.backup_to).
+    Transcoded segments are already compressed, so gzip is off by default.
+    """
+    manifest = Manifest(created_at=time.time())
+    roots = [hot_dir, cache_dir] if hot_dir is not None else [cache_dir]
+    with tarfile.open(fileobj=out, mode="w|gz" if compress else "w|") as tar:
+        manifest.files.append(_add_file(tar, metadata_db, METADATA_NAME))
+        for arcname, path in _cache_files(roots, ttl_seconds).items():
+            manifest.files.append(_add_file(tar, path, arcname))
+        data = manifest.to_json()
+        info = tarfile.TarInfo(MANIFEST_NAME)
+        info.size = len(data)
+        info.mtime = manifest.created_at
+        tar.addfile(info, io.BytesIO(data))
+    return manifest
+
+
+def _check_member_path(name: str) -> str:
+    path = PurePosixPath(name)
+    if path.is_absolute() or ".." in path.parts:
+        raise SnapshotError(f"Unsafe path in snapshot: {name}")
+    if name in (MANIFEST_NAME, METADATA_NAME):
+        return name
+    expected_depth = 3 if path.parts[0] == "segments" else 2
+    if path.parts[0] not in CACHE_DIRS or len(path.parts) != expected_depth:
+        raise SnapshotError(f"Unexpected path in snapshot: {name}")
+    return path.as_posix()
+
+
+def read_snapshot(src: BinaryIO, staging_dir: Path) -> Manifest:
+    """Extract a snapshot stream into staging_dir and verify it against its manifest.
+
+    Raises SnapshotError if the archive is malformed, contains unexpected paths or a
+    slot without its playlist, or any file is missing, extra, or doesn't match its size
+    and checksum.
+    """
+    received: dict[str, tuple[int, str]] = {}
+    manifest = None
+    try:
+        with tarfile.open(fileobj=src, mode="r|*") as tar:
+            for member in tar:
+                if not member.isfile():
+                    raise SnapshotError(f"Unexpected non-file entry in snapshot: {member.name}")
+                name = _check_member_path(member.name)
+                reader = tar.extractfile(member)
+                if name == MANIFEST_NAME:
+                    manifest = Manifest.from_json(reader.read())
+                    continue
+                target = staging_dir / name
+                target.parent.mkdir(parents=True, exist_ok=True)
+                digest = hashlib.sha256()
+                size = 0
+                with target.open("wb") as f:
+                    while chunk := reader.read(1024 * 1024):
+                        digest.update(chunk)
+                        size += len(chunk)
+                        f.write(chunk)
+                os.utime(target, (member.mtime, member.mtime))
+                received[name] = (size, digest.hexdigest())
+    except (tarfile.TarError, EOFError, OSError) as e:
+        raise SnapshotError(f"Unreadable snapshot: {e}") from e
+
+    if manifest is None:
+        raise SnapshotError("Snapshot has no manifest")
+    expected = {f.path: (f.size, f.sha256) for f in manifest.files}
+    if METADATA_NAME not in expected:
+        raise SnapshotError("Snapshot has no metadata database")
+    for path in expected.keys() - received.keys():
+        raise SnapshotError(f"File missing from snapshot: {path}")
+    for path in received.keys() - expected.keys():
+        raise SnapshotError(f"File not in snapshot manifest: {path}")
+    for path, checks in expected.items():
+        if received[path] != checks:
+            raise SnapshotError(f"Checksum mismatch for {path}")
+    for slot_id, names in manifest.slot_files().items():
+        if "index.m3u8" not in names:
+            raise SnapshotError(f"Slot {slot_id} in snapshot has no index.m3u8")
+    return manifest
+
+
+def install_snapshot(
+    staging_dir: Path,
+    cache_dir: Path,
+    manifest: Manifest,
+    hot_dir: Path | None = None,
+    retire: Callable[[Path], None] | None = None,
+) -> list[str]:
+    """Move verified cache files from staging_dir into cache_dir.
+
+    Each slot directory is swapped in whole while holding that slot's transcode lock;
+    slots being transcoded right now are skipped and keep the new transcode. The encodes
+    the snapshot supersedes, in either tier, are passed to retire (e.g.
+    CacheManager.retire_slot, so clients partway through them can finish), or removed.
+    Returns the ids of the slots installed. The metadata database is left in staging_dir
+    for the caller to restore with MetadataStore.restore_from.
+    """
+    if retire is None:
+
+        def retire(slot_dir: Path):
+            shutil.rmtree(slot_dir, ignore_errors=True)
+
+    installed = []
+    locks_dir = cache_dir / "locks"
+    locks_dir.mkdir(parents=True, exist_ok=True)
+    segments_dir = cache_dir / "segments"
+    segments_dir.mkdir(parents=True, exist_ok=True)
+    for slot_id in sorted(manifest.slot_files()):
+        lock = FileLock(locks_dir / f"{slot_id}.lock", thread_local=False)
+        try:
+            lock.acquire(timeout=0)
+        except Timeout:
+            logger.info(f"Skipping snapshot slot {slot_id}: transcode in progress")
+            continue
+        try:
+            target = segments_dir / slot_id
+            old_dirs = [target] + ([hot_dir / "segments" / slot_id] if hot_dir else [])
+            for old in old_dirs:
+                if old.exists():
+                    retire(old)
+            (staging_dir / "segments" / slot_id).rename(target)
+        finally:
+            lock.release()
+        installed.append(slot_id)
+
+    for f in manifest.files:
+        if PurePosixPath(f.path).parts[0] in ("covers", "audio"):
+            target = cache_dir / f.path
+            target.parent.mkdir(parents=True, exist_ok=True)
+            os.replace(staging_dir / f.path, target)
+            if hot_dir is not None:
+                (hot_dir / f.path).unlink(missing_ok=True)
+    return installed
+
+
+def main(argv: list[str] | None = None):
+    """Export or import a snapshot of the configured cache_dir from the command line.
+
+    Reads settings from the environment like the server does. Importing this way
+    doesn't update a server that is already running; use POST /admin/snapshot for that.
+    """
+    from subsonic_proxy.config import Settings
+
+    parser = argparse.ArgumentParser(prog="python -m subsonic_proxy.snapshot")
+    commands = parser.add_subparsers(dest="command", required=True)
+    export = commands.add_parser("export", help="Write a snapshot")
+    export.add_argument("path", help="Output file, or - for stdout")
+    export.add_argument("--gzip", action="store_true", help="Compress the archive")
+    restore = commands.add_parser("import", help="Install a snapshot")
+    restore.add_argument("path", help="Snapshot file, or - for stdin")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, stream=sys.stderr)
+    settings = Settings()
+    cache_dir = Path(settings.cache_dir)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    hot_dir = Path(settings.hot_cache_dir) if settings.hot_cache_dir else None
+    store = MetadataStore(cache_dir / "metadata.db")
+    try:
+        with tempfile.TemporaryDirectory(dir=cache_dir, prefix=".snapshot-") as tmp:
+            if args.command == "export":
+                db_copy = Path(tmp) / METADATA_NAME
+                store.backup_to(db_copy)
+                with open(args.path, "wb") if args.path != "-" else sys.stdout.buffer as out:
+                    manifest = write_snapshot(
+                        out,
+                        cache_dir,
+                        db_copy,
+                        settings.cache_ttl_seconds,
+                        compress=args.gzip,
+                        hot_dir=hot_dir,
+                    )
+                logger.info(f"Exported {len(manifest.files)} files")
+            else:
+                with open(args.path, "rb") if args.path != "-" else sys.stdin.buffer as src:
+                    manifest = read_snapshot(src, Path(tmp))
+                cache = CacheManager(
+                    cache_dir,
+                    settings.cache_ttl_seconds,
+                    hot_dir=hot_dir,
+                    retired_seconds=settings.cache_retired_seconds,
+                )
+                slots = install_snapshot(
+                    Path(tmp), cache_dir, manifest, hot_dir, retire=cache.retire_slot
+                )
+                store.restore_from(Path(tmp) / METADATA_NAME)
+                logger.info(f"Imported {len(manifest.files)} files, {len(slots)} slots")
+    except SnapshotError as e:
+        sys.exit(f"Snapshot failed: {e}")
+    finally:
+        store.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,304 @@
+import sqlite3
+import time
+from pathlib import Path
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS albums (
+    id TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    artist TEXT NOT NULL,
+    sync_key TEXT
+);
+CREATE TABLE IF NOT EXISTS songs (
+    id TEXT PRIMARY KEY,
+    album_id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    title TEXT NOT NULL,
+    artist TEXT NOT NULL,
+    album TEXT NOT NULL,
+    duration INTEGER NOT NULL,
+    cover_art TEXT,
+    path TEXT,
+    replay_gain REAL,
+    replay_peak REAL
+);
+CREATE INDEX IF NOT EXISTS songs_by_album ON songs (album_id, position);
+CREATE TABLE IF NOT EXISTS slots (
+    slot_id TEXT PRIMARY KEY,
+    song_id TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS slots_by_song ON slots (song_id);
+CREATE TABLE IF NOT EXISTS loudness (
+    song_id TEXT PRIMARY KEY,
+    integrated REAL NOT NULL,
+    lra REAL,
+    true_peak REAL NOT NULL,
+    source TEXT NOT NULL,
+    measured_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS loudness_failures (
+    song_id TEXT PRIMARY KEY,
+    error TEXT NOT NULL,
+    failed_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS sync_cursors (
+    name TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+SONG_COLUMNS = (
+    "id",
+    "album_id",
+    "title",
+    "artist",
+    "album",
+    "duration",
+    "cover_art",
+    "path",
+    "replay_gain",
+    "replay_peak",
+)
+# Song columns added after the first release, with their types
+ADDED_SONG_COLUMNS = {"path": "TEXT", "replay_gain": "REAL", "replay_peak": "REAL"}
+
+
+def album_sync_key(album: dict) -> str:
+    """Fingerprint of an getAlbumList2 entry; when it is unchanged the album's songs
+    don't need to be fetched again."""
+    return "|".join(
+        str(album.get(k, ""))
+        for k in ("changed", "created", "songCount", "duration", "coverArt", "name")
+    )
+
+
+class MetadataStore:
+    """SQLite persistence for library metadata.
+
+    Holds albums and their songs as last fetched from Subsonic (with a sync key per
+    album so unchanged albums are skipped on refresh), the current slot → song
+    assignment, loudness measurements (and failed measurements) per song, and named sync
+    cursors such as the last completed refresh time.
+    """
+
+    def __init__(self, path: Path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.path = path
+        self._db = sqlite3.connect(path)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(SCHEMA)
+        self._migrate()
+
+    def _migrate(self):
+        columns = {row["name"] for row in self._db.execute("PRAGMA table_info(songs)")}
+        missing = {name: kind for name, kind in ADDED_SONG_COLUMNS.items() if name not in columns}
+        if missing:
+            # Refetch every album on the next refresh to fill the new columns in
+            with self._db:
+                for name, kind in missing.items():
+                    self._db.execute(f"ALTER TABLE songs ADD COLUMN {name} {kind}")
+                self._db.execute("UPDATE albums SET sync_key = ''")
+
+    def close(self):
+        self._db.close()
+
+    # Sync cursors
+
+    def get_cursor(self, name: str) -> str | None:
+        row = self._db.execute("SELECT value FROM sync_cursors WHERE name = ?", (name,)).fetchone()
+        return row["value"] if row else None
+
+    def set_cursor(self, name: str, value: str):
+        with self._db:
+            self._db.execute(
+                "INSERT INTO sync_cursors (name, value) VALUES (?, ?) "
+                "ON CONFLICT (name) DO UPDATE SET value = excluded.value",
+                (name, value),
+            )
+
+    @property
+    def built_at(self) -> float | None:
+        """When slot assignments were last written, as a Unix timestamp."""
+        value = self.get_cursor("built_at")
+        return float(value) if value is not None else None
+
+    # Albums and songs
+
+    def album_sync_keys(self) -> dict[str, str | None]:
+        return {
+            row["id"]: row["sync_key"]
+            for row in self._db.execute("SELECT id, sync_key FROM albums")
+        }
+
+    def album_songs(self, album_id: str) -> list[dict]:
+        rows = self._db.execute(
+            f"SELECT {', '.join(SONG_COLUMNS)} FROM songs WHERE album_id = ? ORDER BY position",
+            (album_id,),
+        )
+        return [dict(row) for row in rows]
+
+    def put_album(self, album: dict, songs: list[dict], sync_key: str | None = None):
+        """Replace an album and its songs with freshly fetched Subsonic data.
+
+        sync_key defaults to album_sync_key(album); pass an empty string to force a
+        refetch on the next refresh.
+        """
+        with self._db:
+            self._db.execute(
+                "INSERT INTO albums (id, name, artist, sync_key) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (id) DO UPDATE SET name = excluded.name, "
+                "artist = excluded.artist, sync_key = excluded.sync_key",
+                (
+                    album["id"],
+                    album.get("name", ""),
+                    album.get("artist", ""),
+                    album_sync_key(album) if sync_key is None else sync_key,
+                ),
+            )
+            self._db.execute("DELETE FROM songs WHERE album_id = ?", (album["id"],))
+            self._db.executemany(
+                "INSERT OR REPLACE INTO songs "
+                "(id, album_id, position, title, artist, album, duration, cover_art, path, "
+                "replay_gain, replay_peak) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (
+                        song["id"],
+                        album["id"],
+                        position,
+                        song.get("title", ""),
+                        song.get("artist", ""),
+                        song.get("album", ""),
+                        song.get("duration", 0),
+                        song.get("coverArt"),
+                        song.get("path"),
+                        (song.get("replayGain") or {}).get("trackGain"),
+                        (song.get("replayGain") or {}).get("trackPeak"),
+                    )
+                    for position, song in enumerate(songs)
+                ],
+            )
+
+    def prune_albums(self, keep: set[str]):
+        """Drop albums (and their songs) that are no longer in the library."""
+        stale = [(album_id,) for album_id in self.album_sync_keys() if album_id not in keep]
+        with self._db:
+            self._db.executemany("DELETE FROM songs WHERE album_id = ?", stale)
+            self._db.executemany("DELETE FROM albums WHERE id = ?", stale)
+
+    # Slots
+
+    def set_slots(self, song_ids: list[str], built_at: float | None = None):
+        """Assign songs to slots 0001..NNNN in order, replacing the previous assignment."""
+        built_at = time.time() if built_at is None else built_at
+        with self._db:
+            self._db.execute("DELETE FROM slots")
+            self._db.executemany(
+                "INSERT INTO slots (slot_id, song_id) VALUES (?, ?)",
+                [(f"{i + 1:04d}", song_id) for i, song_id in enumerate(song_ids)],
+            )
+            self._db.execute(
+                "INSERT INTO sync_cursors (name, value) VALUES ('built_at', ?) "
+                "ON CONFLICT (name) DO UPDATE SET value = excluded.value",
+                (repr(built_at),),
+            )
+
+    def slot_count(self) -> int:
+        return self._db.execute("SELECT COUNT(*) FROM slots").fetchone()[0]
+
+    def slot_songs(self) -> list[tuple[str, dict]]:
+        """All assigned slots in order, with their songs."""
+        rows = self._db.execute(
+            f"SELECT slots.slot_id, {', '.join('songs.' + c for c in SONG_COLUMNS)} "
+            "FROM slots JOIN songs ON songs.id = slots.song_id ORDER BY slots.slot_id"
+        )
+        return [(row["slot_id"], dict(row)) for row in rows]
+
+    def slot_song(self, slot_id: str) -> dict | None:
+        """The song currently assigned to one slot, without loading the rest."""
+        row = self._db.execute(
+            f"SELECT {', '.join('songs.' + c for c in SONG_COLUMNS)} "
+            "FROM slots JOIN songs ON songs.id = slots.song_id WHERE slots.slot_id = ?",
+            (slot_id,),
+        ).fetchone()
+        return dict(row) if row else None
+
+    # Loudness
+
+    def loudness(self, song_id: str) -> dict | None:
+        row = self._db.execute(
+            "SELECT integrated, lra, true_peak, source FROM loudness WHERE song_id = ?",
+            (song_id,),
+        ).fetchone()
+        return dict(row) if row else None
+
+    def measured_song_ids(self) -> set[str]:
+        return {row[0] for row in self._db.execute("SELECT song_id FROM loudness")}
+
+    def put_loudness(
+        self, song_id: str, integrated: float, lra: float | None, true_peak: float, source: str
+    ):
+        with self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO loudness "
+                "(song_id, integrated, lra, true_peak, source, measured_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (song_id, integrated, lra, true_peak, source, time.time()),
+            )
+            self._db.execute("DELETE FROM loudness_failures WHERE song_id = ?", (song_id,))
+
+    def put_loudness_failure(self, song_id: str, error: str):
+        with self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO loudness_failures (song_id, error, failed_at) "
+                "VALUES (?, ?, ?)",
+                (song_id, error, time.time()),
+            )
+
+    def loudness_failed_song_ids(self, since: float) -> set[str]:
+        """Songs whose measurement last failed at or after since."""
+        rows = self._db.execute(
+            "SELECT song_id FROM loudness_failures WHERE failed_at >= ?", (since,)
+        )
+        return {row[0] for row in rows}
+
+    # Snapshots
+
+    # Both open their own connections, so they can run in a worker thread
+
+    def backup_to(self, path: Path):
+        """Write a consistent copy of the whole database to path."""
+        source = sqlite3.connect(self.path)
+        dest = sqlite3.connect(path)
+        try:
+            source.backup(dest)
+        finally:
+            dest.close()
+            source.close()
+
+    def restore_from(self, path: Path):
+        """Replace the whole database with a copy written by backup_to, in place, so
+        other connections to it see the new contents.
+
+        The copy's crawl state belongs to the node it came from: album sync keys are
+        cleared so the next refresh fetches every album from this node's server, and
+        this node keeps its own sync cursors apart from built_at and albums_swept_at.
+        """
+        source = sqlite3.connect(path)
+        dest = sqlite3.connect(self.path)
+        try:
+            own_cursors = dest.execute(
+                "SELECT name, value FROM sync_cursors "
+                "WHERE name NOT IN ('built_at', 'albums_swept_at')"
+            ).fetchall()
+            source.backup(dest)
+            with dest:
+                dest.execute("UPDATE albums SET sync_key = ''")
+                dest.execute("DELETE FROM sync_cursors WHERE name != 'built_at'")
+                dest.executemany(
+                    "INSERT INTO sync_cursors (name, value) VALUES (?, ?)", own_cursors
+                )
+        finally:
+            dest.close()
+            source.close()
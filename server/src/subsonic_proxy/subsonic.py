@@ -1,11 +1,20 @@
+import asyncio
 import hashlib
+import logging
+import random
 import secrets
+import time
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager, contextmanager
 from urllib.parse import urlencode
 
 import httpx
 
+from subsonic_proxy import metrics
 from subsonic_proxy.config import Settings
 
+logger = logging.getLogger(__name__)
+
 
 class SubsonicError(Exception):
     def __init__(self, code: int, message: str):
@@ -13,6 +22,95 @@ class SubsonicError(Exception):
         super().__init__(f"Subsonic error {code}: {message}")
 
 
+class SubsonicUnavailable(Exception):
+    """The Subsonic server is failing; calls are rejected until it recovers."""
+
+
+def _is_transient(exc: httpx.HTTPError) -> bool:
+    """Failures worth retrying, which also count against the circuit breaker."""
+    if isinstance(exc, httpx.TransportError):
+        return True
+    if isinstance(exc, httpx.HTTPStatusError):
+        return exc.response.status_code == 429 or exc.response.status_code >= 500
+    return False
+
+
+def _check_json_error(resp: httpx.Response):
+    """Raise the Subsonic error in a JSON body sent in place of binary data."""
+    if resp.headers.get("content-type", "").startswith("application/json"):
+        sr = resp.json()["subsonic-response"]
+        if sr["status"] != "ok":
+            err = sr.get("error", {})
+            raise SubsonicError(err.get("code", 0), err.get("message", "Unknown error"))
+
+
+@contextmanager
+def _timed(endpoint: str):
+    """Record upstream latency for one Subsonic call."""
+    start = time.perf_counter()
+    result = "error"
+    try:
+        yield
+        result = "ok"
+    finally:
+        metrics.SUBSONIC_REQUEST_SECONDS.labels(endpoint, result).observe(
+            time.perf_counter() - start
+        )
+
+
+class CircuitBreaker:
+    """Stops calling an upstream that keeps failing.
+
+    Opens after `threshold` consecutive transient failures. While open, calls are
+    rejected without touching the network; after `reset_seconds` one trial call is let
+    through, which closes the breaker on success or reopens it on failure.
+    """
+
+    def __init__(self, threshold: int, reset_seconds: float):
+        self._threshold = threshold
+        self._reset_seconds = reset_seconds
+        self._failures = 0
+        self._opened_at: float | None = None
+        # When the current trial call started; a trial that never reports back (e.g.
+        # cancelled) stops blocking new trials after another reset period
+        self._trial_at: float | None = None
+
+    @property
+    def is_open(self) -> bool:
+        return self._opened_at is not None
+
+    def allow(self) -> bool:
+        if self._opened_at is None:
+            return True
+        now = time.monotonic()
+        if now - max(self._opened_at, self._trial_at or 0.0) < self._reset_seconds:
+            return False
+        self._trial_at = now
+        return True
+
+    def record_success(self):
+        self._trial_at = None
+        self._failures = 0
+        if self._opened_at is not None:
+            logger.info("Subsonic server recovered, closing circuit breaker")
+            self._opened_at = None
+            metrics.SUBSONIC_CIRCUIT_OPEN.set(0)
+
+    def record_failure(self):
+        self._trial_at = None
+        self._failures += 1
+        if self._threshold <= 0:
+            return
+        if self._opened_at is not None or self._failures >= self._threshold:
+            if self._opened_at is None:
+                logger.warning(
+                    f"Subsonic server failing ({self._failures} errors in a row), "
+                    f"rejecting calls for {self._reset_seconds:g}s"
+                )
+            self._opened_at = time.monotonic()
+            metrics.SUBSONIC_CIRCUIT_OPEN.set(1)
+
+
 class SubsonicClient:
     def __init__(self, settings: Settings):
         self._base_url = settings.subsonic_url.rstrip("/")
@@ -20,7 +118,21 @@ class SubsonicClient:
         self._password = settings.subsonic_password
         self._api_version = settings.subsonic_api_version
         self._client_id = settings.subsonic_client_id
-        self._http = httpx.AsyncClient(timeout=30.0)
+        self._http = httpx.AsyncClient(
+            timeout=settings.subsonic_timeout_seconds,
+            limits=httpx.Limits(
+                max_connections=settings.subsonic_max_connections,
+                max_keepalive_connections=settings.subsonic_max_keepalive_connections,
+                keepalive_expiry=settings.subsonic_keepalive_expiry_seconds,
+            ),
+        )
+        self._retries = settings.subsonic_retries
+        self._retry_backoff = settings.subsonic_retry_backoff_seconds
+        self._endpoint_concurrency = settings.subsonic_endpoint_concurrency
+        self._limiters: dict[str, asyncio.Semaphore] = {}
+        self.breaker = CircuitBreaker(
+            settings.subsonic_breaker_threshold, settings.subsonic_breaker_reset_seconds
+        )
 
     async def __aenter__(self):
         return self
@@ -43,12 +155,68 @@ class SubsonicClient:
             "f": "json",
         }
 
+    @property
+    def available(self) -> bool:
+        """False while the circuit breaker is rejecting calls."""
+        return not self.breaker.is_open
+
+    def _limiter(self, endpoint: str) -> asyncio.Semaphore:
+        limiter = self._limiters.get(endpoint)
+        if limiter is None:
+            limiter = self._limiters[endpoint] = asyncio.Semaphore(self._endpoint_concurrency)
+        return limiter
+
+    async def _request(
+        self,
+        endpoint: str,
+        params: dict,
+        timeout: httpx.Timeout | None = None,
+        stream: bool = False,
+    ) -> httpx.Response:
+        """GET an endpoint, retrying transient failures with exponential backoff.
+
+        Every Subsonic call is a read, so all of them are safe to retry. Raises
+        SubsonicUnavailable without a request while the circuit breaker is open. With
+        stream=True only the response headers are read (and retried); the caller must
+        close the response.
+        """
+        url = f"{self._base_url}/rest/{endpoint}.view"
+        extra = {} if timeout is None else {"timeout": timeout}
+        attempt = 0
+        while True:
+            if not self.breaker.allow():
+                metrics.SUBSONIC_CIRCUIT_REJECTED.labels(endpoint).inc()
+                raise SubsonicUnavailable(f"Subsonic server unavailable, not calling {endpoint}")
+            try:
+                async with self._limiter(endpoint):
+                    with _timed(endpoint):
+                        # Fresh auth params per attempt; Subsonic may reject a reused salt
+                        request = self._http.build_request(
+                            "GET", url, params={**self._auth_params(), **params}, **extra
+                        )
+                        resp = await self._http.send(request, stream=stream)
+                        if resp.is_error:
+                            await resp.aclose()
+                        resp.raise_for_status()
+            except httpx.HTTPError as e:
+                if not _is_transient(e):
+                    self.breaker.record_success()  # The server answered
+                    raise
+                self.breaker.record_failure()
+                if attempt >= self._retries or self.breaker.is_open:
+                    raise
+                delay = self._retry_backoff * 2**attempt * random.uniform(0.5, 1.5)
+                attempt += 1
+                metrics.SUBSONIC_RETRIES.labels(endpoint).inc()
+                logger.info(f"Retrying {endpoint} in {delay:.2f}s after: {e!r}")
+                await asyncio.sleep(delay)
+                continue
+            self.breaker.record_success()
+            return resp
+
     async def _get(self, endpoint: str, **params) -> dict:
-        all_params = {**self._auth_params(), **params}
-        resp = await self._http.get(f"{self._base_url}/rest/{endpoint}.view", params=all_params)
-        resp.raise_for_status()
-        data = resp.json()
-        sr = data["subsonic-response"]
+        resp = await self._request(endpoint, params)
+        sr = resp.json()["subsonic-response"]
         if sr["status"] != "ok":
             err = sr.get("error", {})
             raise SubsonicError(err.get("code", 0), err.get("message", "Unknown error"))
@@ -65,28 +233,26 @@ class SubsonicClient:
         sr = await self._get("getAlbum", id=album_id)
         return sr["album"]
 
-    async def get_all_tracks(self, strategy: str = "recent", max_count: int = 1000) -> list[dict]:
-        tracks: list[dict] = []
-        offset = 0
-        page_size = 500
-
-        while len(tracks) < max_count:
-            albums = await self.get_album_list(type_="newest", size=page_size, offset=offset)
-            if not albums:
-                break
-
-            for album_data in albums:
-                if len(tracks) >= max_count:
-                    break
-                album = await self.get_album(album_data["id"])
-                for song in album.get("song", []):
-                    if len(tracks) >= max_count:
-                        break
-                    tracks.append(song)
+    @asynccontextmanager
+    async def open_stream(self, track_id: str) -> AsyncIterator[httpx.Response]:
+        """Open the original audio of a track as a streamed response.
 
-            offset += page_size
-
-        return tracks
+        Connecting is retried like any other call; the body is read by the caller,
+        through the shared connection pool, without buffering the whole file.
+        """
+        resp = await self._request(
+            "stream",
+            {"id": track_id},
+            timeout=httpx.Timeout(300.0, connect=30.0),
+            stream=True,
+        )
+        try:
+            if resp.headers.get("content-type", "").startswith("application/json"):
+                await resp.aread()
+                _check_json_error(resp)
+            yield resp
+        finally:
+            await resp.aclose()
 
     def get_stream_url(self, track_id: str) -> str:
         params = {**self._auth_params(), "id": track_id}
@@ -94,21 +260,9 @@ class SubsonicClient:
 
     async def get_cover_art(self, cover_art_id: str) -> bytes:
         """Fetch album art from Subsonic getCoverArt API."""
-        all_params = self._auth_params()
-        resp = await self._http.get(
-            f"{self._base_url}/rest/getCoverArt.view",
-            params={**all_params, "id": cover_art_id},
-        )
-        resp.raise_for_status()
-
+        resp = await self._request("getCoverArt", {"id": cover_art_id})
         # getCoverArt returns raw image data, check for JSON error responses
-        if resp.headers.get("content-type", "").startswith("application/json"):
-            data = resp.json()
-            sr = data["subsonic-response"]
-            if sr["status"] != "ok":
-                err = sr.get("error", {})
-                raise SubsonicError(err.get("code", 0), err.get("message", "Unknown error"))
-
+        _check_json_error(resp)
         return resp.content
 
     async def get_audio_stream(
@@ -124,26 +278,12 @@ class SubsonicClient:
         Returns:
             Audio file bytes
         """
-        params = {
-            **self._auth_params(),
-            "id": track_id,
-            "format": format,
-            "maxBitRate": max_bitrate,
-        }
-
-        resp = await self._http.get(
-            f"{self._base_url}/rest/stream.view",
-            params=params,
+        params = {"id": track_id, "format": format, "maxBitRate": max_bitrate}
+        resp = await self._request(
+            "stream",
+            params,
             timeout=httpx.Timeout(300.0, connect=30.0),  # Long timeout for large files
         )
-        resp.raise_for_status()
-
         # Check if response is JSON error (instead of audio data)
-        if resp.headers.get("content-type", "").startswith("application/json"):
-            data = resp.json()
-            sr = data["subsonic-response"]
-            if sr["status"] != "ok":
-                err = sr.get("error", {})
-                raise SubsonicError(err.get("code", 0), err.get("message", "Unknown error"))
-
+        _check_json_error(resp)
         return resp.content
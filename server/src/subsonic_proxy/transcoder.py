@@ -1,12 +1,23 @@
 import asyncio
+import contextlib
+import functools
+import json
 import logging
+import re
+import shutil
 import time
+from collections import deque
+from dataclasses import asdict, dataclass, field
 from pathlib import Path
 
+import httpx
 from filelock import FileLock, Timeout
 from PIL import Image, ImageDraw, ImageFont
 
-from subsonic_proxy.cache import CacheManager
+from subsonic_proxy import metrics
+from subsonic_proxy.cache import CacheManager, SegmentCache, encode_version
+from subsonic_proxy.coordination import FileSemaphore
+from subsonic_proxy.subsonic import SubsonicError, SubsonicUnavailable
 
 logger = logging.getLogger(__name__)
 
@@ -15,14 +26,166 @@ class TranscodeError(Exception):
     pass
 
 
+_BENCH_RE = re.compile(r"bench: utime=([\d.]+)s stime=([\d.]+)s")
+
+
+def _parse_bitrate(value: str) -> int:
+    """Bits per second for an ffmpeg-style bitrate such as "192k" or "1M"."""
+    multiplier = {"k": 1_000, "m": 1_000_000}.get(value[-1:].lower(), 1)
+    return int(float(value.rstrip("kKmM")) * multiplier)
+
+
+def _parse_benchmark_cpu(stderr: str) -> float | None:
+    """Extract user+system CPU seconds from ffmpeg's -benchmark summary line."""
+    match = _BENCH_RE.search(stderr)
+    if match is None:
+        return None
+    return float(match.group(1)) + float(match.group(2))
+
+
+async def feed_track(subsonic, proc: asyncio.subprocess.Process, track_id: str):
+    """Stream a track from Subsonic into an ffmpeg process's stdin.
+
+    Waiting on drain() between chunks keeps at most a pipe buffer of audio in flight,
+    so a slow ffmpeg slows the download rather than buffering it here.
+    """
+    try:
+        async with subsonic.open_stream(track_id) as resp:
+            async for chunk in resp.aiter_bytes():
+                proc.stdin.write(chunk)
+                await proc.stdin.drain()
+                metrics.SUBSONIC_STREAM_BYTES.inc(len(chunk))
+    except (BrokenPipeError, ConnectionResetError):
+        return  # ffmpeg stopped reading; its exit status tells what happened
+    except (httpx.HTTPError, SubsonicError, SubsonicUnavailable) as e:
+        # Don't let ffmpeg take a truncated input for the end of the track
+        if proc.returncode is None:
+            proc.kill()
+        raise TranscodeError(f"Streaming track {track_id} from Subsonic failed: {e}") from e
+    proc.stdin.close()
+
+
+@dataclass
+class TranscodeTiming:
+    """Per-phase wall-clock breakdown of one transcode."""
+
+    slot_id: str
+    title: str
+    started_at: float
+    phases: dict[str, float] = field(default_factory=dict)
+    total_seconds: float = 0.0
+    output_bytes: int = 0
+    track_duration: float | None = None
+    # Seconds of track transcoded per second of ffmpeg wall time
+    realtime_factor: float | None = None
+    result: str = "ok"
+    trigger: str = "request"  # request, or refresh_ahead for background refreshes
+
+
+@dataclass
+class TranscodeJob:
+    """Live state of an in-progress transcode, updated from ffmpeg's progress output."""
+
+    slot_id: str
+    title: str
+    duration: float | None
+    state: str = "queued"  # queued (waiting for a transcode slot) or running
+    queued_at: float = field(default_factory=time.time)
+    started_at: float | None = None
+    out_time: float = 0.0
+    speed: float | None = None
+    last_progress: float = field(default_factory=time.monotonic)
+    # Touched on progress, so transcodes in other workers waiting for the slot lock see it
+    progress_path: Path | None = field(default=None, repr=False)
+
+    @property
+    def eta_seconds(self) -> float | None:
+        if not self.duration or not self.speed:
+            return None
+        return max(self.duration - self.out_time, 0.0) / self.speed
+
+    def to_dict(self) -> dict:
+        return {
+            "slot_id": self.slot_id,
+            "title": self.title,
+            "state": self.state,
+            "duration": self.duration,
+            "out_time": self.out_time,
+            "speed": self.speed,
+            "eta_seconds": self.eta_seconds,
+            "queued_at": self.queued_at,
+            "started_at": self.started_at,
+        }
+
+    def mark_progress(self):
+        self.last_progress = time.monotonic()
+        if self.progress_path is not None:
+            with contextlib.suppress(OSError):
+                self.progress_path.touch()
+
+    def apply_progress(self, key: str, value: str):
+        """Apply one key=value line from `ffmpeg -progress`."""
+        if key in ("out_time_us", "out_time_ms"):
+            # Both are microseconds; out_time_ms is a long-standing misnomer
+            if value.isdigit():
+                self.out_time = int(value) / 1_000_000
+                self.mark_progress()
+        elif key == "speed":
+            try:
+                self.speed = float(value.rstrip("x"))
+            except ValueError:
+                self.speed = None
+
+
+@contextlib.contextmanager
+def _phase(timing: TranscodeTiming, name: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timing.phases[name] = time.perf_counter() - start
+
+
+async def _read_tail(stream: asyncio.StreamReader, limit: int = 64 * 1024) -> bytes:
+    """Drain a stream to EOF, keeping only the last `limit` bytes."""
+    tail = b""
+    while chunk := await stream.read(65536):
+        tail = (tail + chunk)[-limit:]
+    return tail
+
+
 class HLSTranscoder:
-    def __init__(self, settings, cache_manager: CacheManager, subsonic_client):
+    def __init__(
+        self,
+        settings,
+        cache_manager: CacheManager,
+        subsonic_client,
+        segment_cache: SegmentCache | None = None,
+    ):
         self._cache_dir = Path(settings.cache_dir)
         self._segment_duration = settings.hls_segment_duration
         self._audio_bitrate = settings.audio_bitrate
         self._ffmpeg_path = settings.ffmpeg_path
+        self._ffmpeg_input = settings.ffmpeg_input
+        if self._ffmpeg_input not in ("pipe", "url"):
+            raise ValueError(f"Unsupported ffmpeg_input: {self._ffmpeg_input}")
+        self._single_file = settings.hls_single_file
+        self._segment_type = settings.hls_segment_type
+        if self._segment_type not in ("mpegts", "fmp4"):
+            raise ValueError(f"Unsupported hls_segment_type: {self._segment_type}")
         self._cache_manager = cache_manager
         self._subsonic = subsonic_client
+        self._segment_cache = segment_cache
+        self._segment_prefetch = settings.segment_cache_prefetch
+
+        # Adaptive bitrate ladder as (audio bitrate, has video) per variant; empty for a
+        # single rendition written straight to index.m3u8
+        self._variants = [(bitrate, True) for bitrate in settings.hls_renditions]
+        if settings.hls_audio_only_rendition:
+            bitrates = settings.hls_renditions or [self._audio_bitrate]
+            self._variants.append((min(bitrates, key=_parse_bitrate), False))
+            if not settings.hls_renditions:
+                self._variants.insert(0, (self._audio_bitrate, True))
 
         # Video settings
         self._video_width = settings.video_width
@@ -41,7 +204,28 @@ class HLSTranscoder:
 
         # Concurrency control
         self._max_concurrent = settings.max_concurrent_transcodes
-        self._transcode_semaphore = asyncio.Semaphore(self._max_concurrent)
+        if settings.multi_worker:
+            # Shared by every worker process, so the cap is global
+            self._transcode_semaphore = FileSemaphore(
+                self._cache_dir / "locks", "transcode", self._max_concurrent
+            )
+        else:
+            self._transcode_semaphore = asyncio.Semaphore(self._max_concurrent)
+        self._active = 0
+
+        # Lock waits are extended while the holder keeps making progress, and ffmpeg is
+        # killed if it stops reporting progress
+        self._lock_timeout = settings.transcode_lock_timeout_seconds
+        self._stall_timeout = settings.transcode_stall_timeout_seconds
+
+        # In-flight transcodes by slot, and recent timing records, for the admin endpoints
+        self.jobs: dict[str, TranscodeJob] = {}
+        self.timings: deque[TranscodeTiming] = deque(maxlen=settings.transcode_history_size)
+
+        # Shared transcode task per slot, so a burst of requests for one track doesn't
+        # park a thread-pool worker per request on the file lock
+        self._pending: dict[str, asyncio.Task] = {}
+        self._promoting: set[str] = set()
 
     def _validate_font(self):
         """Check if font file exists, log warning with suggestions if not."""
@@ -66,7 +250,7 @@ class HLSTranscoder:
                 )
 
     def _slot_dir(self, slot_id: str) -> Path:
-        return self._cache_dir / "segments" / slot_id
+        return self._cache_manager.slot_dir(slot_id)
 
     def _get_lock_path(self, slot_id: str) -> Path:
         """Get the lock file path for a slot."""
@@ -74,66 +258,305 @@ class HLSTranscoder:
         locks_dir.mkdir(parents=True, exist_ok=True)
         return locks_dir / f"{slot_id}.lock"
 
+    def _get_progress_path(self, slot_id: str) -> Path:
+        """Get the file the slot lock's holder touches as its transcode progresses."""
+        return self._get_lock_path(slot_id).with_suffix(".progress")
+
+    def is_cached(self, slot_id: str) -> bool:
+        """True if the slot has an unexpired transcode in either cache tier."""
+        m3u8_path = self._slot_dir(slot_id) / "index.m3u8"
+        return m3u8_path.exists() and not self._cache_manager.is_expired(m3u8_path)
+
     async def ensure_transcoded(self, slot_id: str, stream_url: str, track_info: dict) -> Path:
         """Ensure track is transcoded with video.
 
-        track_info should contain: title, artist, album, coverArt (optional)
+        track_info should contain: title, artist, album, coverArt (optional). With id,
+        the source is piped through the Subsonic client; with local_path, ffmpeg reads
+        that file instead of streaming from Subsonic at all. gain_db, if present, is
+        applied for loudness normalization.
 
-        Uses file-based locking to prevent multiple concurrent transcodes of the same slot,
-        and a semaphore to limit total concurrent transcodes.
+        Concurrent requests for the same slot in this process share one transcode. Across
+        processes, file-based locking prevents multiple concurrent transcodes of the same
+        slot, and a semaphore limits total concurrent transcodes.
         """
-        slot_dir = self._slot_dir(slot_id)
-        m3u8_path = slot_dir / "index.m3u8"
-
+        m3u8_path = self._slot_dir(slot_id) / "index.m3u8"
+        self._cache_manager.record_access(m3u8_path)
         # Quick check without lock - cache hit path is fast
-        if m3u8_path.exists() and not self._cache_manager.is_expired(m3u8_path):
+        if self.is_cached(slot_id):
             logger.info(f"Using cached HLS for slot {slot_id}")
+            metrics.CACHE_REQUESTS.labels("hls", "hit").inc()
+            self._cache_manager.touch(f"segments/{slot_id}")
+            if self._cache_manager.should_refresh_ahead(m3u8_path):
+                self._refresh_ahead(slot_id, stream_url, track_info)
+            elif self._cache_manager.should_promote(f"segments/{slot_id}"):
+                self._promote(slot_id)
             return m3u8_path
+        if not self._subsonic.available and not track_info.get("local_path"):
+            # An expired transcode beats no transcode while the upstream is down
+            if m3u8_path.exists():
+                logger.warning(f"Subsonic unavailable, serving expired HLS for slot {slot_id}")
+                metrics.CACHE_REQUESTS.labels("hls", "stale").inc()
+                return m3u8_path
+            raise SubsonicUnavailable(f"Subsonic server unavailable, can't transcode {slot_id}")
+        metrics.CACHE_REQUESTS.labels("hls", "miss").inc()
+
+        task = self._pending.get(slot_id)
+        if task is None:
+            task = asyncio.ensure_future(self._transcode(slot_id, stream_url, track_info))
+            self._pending[slot_id] = task
+            task.add_done_callback(functools.partial(self._transcode_done, slot_id))
+        else:
+            logger.info(f"Joining in-flight transcode for slot {slot_id}")
+        # Shielded so one client disconnecting doesn't cancel the transcode for the rest
+        return await asyncio.shield(task)
+
+    def _refresh_ahead(self, slot_id: str, stream_url: str, track_info: dict):
+        """Re-transcode a popular slot in the background before it expires.
+
+        The old transcode keeps being served until the new one is swapped in, so the
+        slot never goes cold, and stays servable to the clients playing it afterwards.
+        Requests arriving meanwhile are cache hits and don't wait.
+        """
+        if slot_id in self._pending:
+            return
+        logger.info(f"Refreshing popular slot {slot_id} ahead of expiry")
+        task = asyncio.ensure_future(self._transcode(slot_id, stream_url, track_info, True))
+        self._pending[slot_id] = task
+        task.add_done_callback(functools.partial(self._transcode_done, slot_id))
+
+    def _promote(self, slot_id: str):
+        """Copy a popular slot from the disk tier to the hot tier in the background."""
+        if slot_id in self._promoting or slot_id in self._pending:
+            return
+        self._promoting.add(slot_id)
+        task = asyncio.ensure_future(
+            asyncio.to_thread(self._cache_manager.promote, f"segments/{slot_id}")
+        )
+        task.add_done_callback(functools.partial(self._promote_done, slot_id))
+
+    def _promote_done(self, slot_id: str, task: asyncio.Task):
+        self._promoting.discard(slot_id)
+        if not task.cancelled() and task.exception() is not None:
+            logger.warning(f"Promoting slot {slot_id} to the hot tier failed: {task.exception()}")
+
+    def _transcode_done(self, slot_id: str, task: asyncio.Task):
+        if self._pending.get(slot_id) is task:
+            del self._pending[slot_id]
+        # Mark the exception retrieved in case every waiter has gone away
+        if not task.cancelled():
+            task.exception()
+
+    async def _transcode(
+        self, slot_id: str, stream_url: str, track_info: dict, refresh: bool = False
+    ) -> Path:
+        # New transcodes go to the hot tier, if there is one
+        slot_dir = self._cache_manager.new_slot_dir(slot_id)
+        m3u8_path = slot_dir / "index.m3u8"
+        # Refreshes encode beside the live transcode, which keeps serving until the swap
+        output_dir = slot_dir.with_name(f".{slot_id}.refresh") if refresh else slot_dir
+
+        timing = TranscodeTiming(
+            slot_id=slot_id,
+            title=track_info.get("title", "Unknown"),
+            started_at=time.time(),
+            track_duration=track_info.get("duration"),
+            trigger="refresh_ahead" if refresh else "request",
+        )
+        total_start = time.perf_counter()
 
         # Acquire per-slot file lock to prevent concurrent transcoding of same track
         lock_path = self._get_lock_path(slot_id)
-        lock = FileLock(lock_path, timeout=300)  # 5 minute timeout
+        # Not thread-local: acquire and release run on arbitrary to_thread workers
+        lock = FileLock(lock_path, thread_local=False)
 
         try:
-            # Run lock acquisition in thread pool to avoid blocking event loop
-            await asyncio.to_thread(lock.acquire)
+            with (
+                _phase(timing, "lock_wait"),
+                metrics.TRANSCODE_QUEUE_WAIT_SECONDS.labels("lock").time(),
+            ):
+                await self._acquire_lock(lock, slot_id)
             try:
                 # Double-check after acquiring lock (another request might have finished)
-                if m3u8_path.exists() and not self._cache_manager.is_expired(m3u8_path):
+                if not refresh and self.is_cached(slot_id):
                     logger.info(f"Using cached HLS for slot {slot_id} (completed while waiting)")
-                    return m3u8_path
+                    return self._slot_dir(slot_id) / "index.m3u8"
+
+                job = TranscodeJob(
+                    slot_id=slot_id,
+                    title=track_info.get("title", "Unknown"),
+                    duration=track_info.get("duration"),
+                    progress_path=self._get_progress_path(slot_id),
+                )
+                job.mark_progress()
+                self.jobs[slot_id] = job
 
                 # Acquire global semaphore to limit concurrent transcodes
-                async with self._transcode_semaphore:
+                semaphore_wait_start = time.perf_counter()
+                async with self._transcode_semaphore, self._in_flight():
+                    semaphore_wait = time.perf_counter() - semaphore_wait_start
+                    timing.phases["semaphore_wait"] = semaphore_wait
+                    metrics.TRANSCODE_QUEUE_WAIT_SECONDS.labels("semaphore").observe(semaphore_wait)
                     logger.info(
                         f"Starting transcode for slot {slot_id}: "
                         f"{track_info.get('title', 'Unknown')} "
-                        f"(active transcodes: {self._max_concurrent - self._transcode_semaphore._value})"
+                        f"(active transcodes: {self._active})"
                     )
-                    slot_dir.mkdir(parents=True, exist_ok=True)
+                    if refresh:
+                        shutil.rmtree(output_dir, ignore_errors=True)
+                    else:
+                        # An expired encode may still be mid-playback somewhere
+                        await asyncio.to_thread(
+                            self._retire_encodes, slot_dir, track_info.get("duration") or 0
+                        )
+                    output_dir.mkdir(parents=True, exist_ok=True)
 
                     # Prepare cover art
-                    cover_art_path = slot_dir / "cover.jpg"
+                    cover_art_path = output_dir / "cover.jpg"
                     cover_art_id = track_info.get("coverArt")
-                    cover_art_path = await self._prepare_cover_art(cover_art_id, cover_art_path)
+                    with _phase(timing, "cover_art"):
+                        cover_art_path = await self._prepare_cover_art(cover_art_id, cover_art_path)
 
                     # Pre-render text overlay onto cover art (much faster than FFmpeg drawtext)
-                    rendered_path = slot_dir / "rendered.jpg"
-                    await asyncio.to_thread(
-                        self._render_overlay, cover_art_path, track_info, rendered_path
-                    )
-
-                    await self._run_ffmpeg(stream_url, slot_dir, rendered_path)
+                    rendered_path = output_dir / "rendered.jpg"
+                    with _phase(timing, "overlay"):
+                        await asyncio.to_thread(
+                            self._render_overlay, cover_art_path, track_info, rendered_path
+                        )
+
+                    if self._segment_cache is not None and not refresh:
+                        self._segment_cache.invalidate_slot(slot_id)
+                    local_path = track_info.get("local_path")
+                    metrics.SOURCE_READS.labels("hls", "local" if local_path else "subsonic").inc()
+                    with _phase(timing, "ffmpeg"):
+                        await self._run_ffmpeg(
+                            local_path or stream_url,
+                            output_dir,
+                            rendered_path,
+                            job=job,
+                            # A local file is opened by ffmpeg directly
+                            track_id=None if local_path else track_info.get("id"),
+                            gain_db=track_info.get("gain_db"),
+                        )
+                    if refresh:
+                        await asyncio.to_thread(
+                            self._swap_in, output_dir, slot_dir, track_info.get("duration") or 0
+                        )
+                        if self._segment_cache is not None:
+                            self._segment_cache.invalidate_slot(slot_id)
+                    with _phase(timing, "prefetch"):
+                        await asyncio.to_thread(self._prefetch_segments, slot_id, slot_dir)
+                    timing.output_bytes = self._output_size(slot_dir)
+                    await asyncio.to_thread(self._cache_manager.admit, f"segments/{slot_id}")
 
                     logger.info(f"Transcode complete for slot {slot_id}")
                     return m3u8_path
             finally:
+                self.jobs.pop(slot_id, None)
+                self._get_progress_path(slot_id).unlink(missing_ok=True)
                 await asyncio.to_thread(lock.release)
         except Timeout:
+            timing.result = "lock_timeout"
             logger.error(f"Timeout waiting for transcode lock for slot {slot_id}")
             raise TranscodeError(
                 f"Transcode lock timeout for slot {slot_id} - another transcode may be stuck"
             )
+        except Exception:
+            timing.result = "error"
+            if refresh:
+                shutil.rmtree(output_dir, ignore_errors=True)
+            raise
+        finally:
+            # Only record attempts that actually transcoded (or failed trying)
+            if timing.result != "ok" or "ffmpeg" in timing.phases:
+                self._record_timing(timing, time.perf_counter() - total_start)
+
+    def _retire_encodes(self, slot_dir: Path, keep_seconds: float):
+        """Retire a slot's existing encodes in either tier, so clients partway through
+        one can still fetch its segments for at least keep_seconds."""
+        for old_dir in {self._slot_dir(slot_dir.name), slot_dir}:
+            if old_dir.exists():
+                self._cache_manager.retire_slot(old_dir, keep_seconds)
+
+    def _swap_in(self, new_dir: Path, slot_dir: Path, keep_seconds: float):
+        """Replace a slot directory with a freshly encoded one, retiring the old one."""
+        self._retire_encodes(slot_dir, keep_seconds)
+        new_dir.rename(slot_dir)
+
+    async def _acquire_lock(self, lock: FileLock, slot_id: str):
+        """Acquire the slot lock without blocking the event loop.
+
+        Gives up after transcode_lock_timeout_seconds, unless the transcode holding the
+        lock, in this worker or another, is still reporting ffmpeg progress (or is queued
+        for a transcode slot in this worker), in which case long tracks are waited out
+        instead of failing at a fixed deadline.
+        """
+        deadline = time.monotonic() + self._lock_timeout
+        while True:
+            try:
+                await asyncio.to_thread(lock.acquire, timeout=1.0)
+                return
+            except Timeout:
+                now = time.monotonic()
+                holder = self.jobs.get(slot_id)
+                queued = holder is not None and holder.state == "queued"
+                if queued or self._holder_progressing(slot_id):
+                    deadline = max(deadline, now + 1.0)
+                if now >= deadline:
+                    raise
+
+    def _holder_progressing(self, slot_id: str) -> bool:
+        """Whether the slot lock's holder reported progress within the stall timeout."""
+        try:
+            touched = self._get_progress_path(slot_id).stat().st_mtime
+        except FileNotFoundError:
+            return False
+        return time.time() - touched < self._stall_timeout
+
+    def _record_timing(self, timing: TranscodeTiming, total_seconds: float):
+        timing.total_seconds = total_seconds
+        ffmpeg_seconds = timing.phases.get("ffmpeg")
+        if timing.track_duration and ffmpeg_seconds:
+            timing.realtime_factor = timing.track_duration / ffmpeg_seconds
+        self.timings.append(timing)
+        logger.info("transcode_timing %s", json.dumps(asdict(timing)))
+
+    def recent_timings(self, limit: int = 20) -> list[TranscodeTiming]:
+        """Most recent transcodes, newest first."""
+        return list(self.timings)[::-1][:limit]
+
+    def slowest_timings(self, limit: int = 10) -> list[TranscodeTiming]:
+        """Slowest transcodes still in the history buffer, slowest first."""
+        return sorted(self.timings, key=lambda t: t.total_seconds, reverse=True)[:limit]
+
+    @staticmethod
+    def _output_size(output_dir: Path) -> int:
+        return sum(
+            f.stat().st_size for f in output_dir.iterdir() if f.suffix in (".ts", ".m4s", ".mp4")
+        )
+
+    def _prefetch_segments(self, slot_id: str, slot_dir: Path):
+        """Load the first segments of a fresh transcode into the RAM cache, since every
+        client that starts the track will ask for them right away."""
+        if self._segment_cache is None or self._segment_prefetch <= 0:
+            return
+        # With a ladder these are the first variant's, which is where players start
+        prefetch = sorted(slot_dir.glob("seg*"))[: self._segment_prefetch]
+        prefetch += sorted(slot_dir.glob("init*.mp4"))[:1]
+        version = encode_version(slot_dir / "index.m3u8")
+        for segment_path in prefetch:
+            self._segment_cache.put(
+                slot_id, f"{version}/{segment_path.name}", segment_path.read_bytes()
+            )
+
+    @contextlib.asynccontextmanager
+    async def _in_flight(self):
+        self._active += 1
+        metrics.TRANSCODES_IN_FLIGHT.inc()
+        try:
+            yield
+        finally:
+            self._active -= 1
+            metrics.TRANSCODES_IN_FLIGHT.dec()
 
     async def _prepare_cover_art(self, cover_art_id: str | None, output_path: Path) -> Path:
         """Fetch or retrieve cached album art, or generate fallback."""
@@ -144,14 +567,20 @@ class HLSTranscoder:
 
         # Try to fetch from Subsonic
         if cover_art_id:
+            fetch_start = time.perf_counter()
             try:
                 logger.info(f"Fetching cover art from Subsonic: {cover_art_id}")
                 art_data = await self._subsonic.get_cover_art(cover_art_id)
-                cached_path = self._cache_manager.get_cover_art_path(cover_art_id)
-                cached_path.write_bytes(art_data)
+                metrics.COVER_FETCH_SECONDS.labels("ok").observe(time.perf_counter() - fetch_start)
+                cached_path = await asyncio.to_thread(
+                    self._cache_manager.write_cover_art, cover_art_id, art_data
+                )
                 logger.info(f"Saved cover art to cache: {cached_path}")
                 return cached_path
             except Exception as e:
+                metrics.COVER_FETCH_SECONDS.labels("error").observe(
+                    time.perf_counter() - fetch_start
+                )
                 logger.warning(f"Failed to fetch cover art {cover_art_id}: {e}. Using fallback.")
 
         # Generate fallback using FFmpeg color filter
@@ -249,13 +678,129 @@ class HLSTranscoder:
 
             shutil.copy(cover_art_path, output_path)
 
-    async def _run_ffmpeg(self, input_url: str, output_dir: Path, rendered_cover_path: Path):
-        """Run FFmpeg to transcode with pre-rendered video overlay."""
+    async def _follow_progress(self, proc: asyncio.subprocess.Process, job: TranscodeJob | None):
+        while True:
+            try:
+                line = await asyncio.wait_for(proc.stdout.readline(), self._stall_timeout)
+            except TimeoutError:
+                raise TranscodeError(
+                    f"ffmpeg made no progress for {self._stall_timeout}s, killed"
+                ) from None
+            if not line:
+                return
+            key, _, value = line.decode(errors="replace").strip().partition("=")
+            if job is not None:
+                job.apply_progress(key, value)
+
+    def _segment_args(self, output_dir: Path) -> list[str]:
+        """FFmpeg HLS muxer arguments controlling how segments are written.
+
+        With a bitrate ladder every variant's files sit side by side in the slot
+        directory, told apart by ffmpeg's %v (variant index) in their names.
+        """
+        variant = "_%v" if self._variants else ""
+        args = []
+        suffix = "ts"
+        if self._segment_type == "fmp4":
+            # CMAF: a shared init segment (EXT-X-MAP) plus moof/mdat fragments, which
+            # avoids the 188-byte TS packet and PES overhead on our tiny streams
+            args += [
+                "-hls_segment_type",
+                "fmp4",
+                "-hls_fmp4_init_filename",
+                f"init{variant}.mp4",
+            ]
+            suffix = "m4s"
+        if self._single_file:
+            # One packed media file per track, addressed with EXT-X-BYTERANGE
+            return [
+                *args,
+                "-hls_flags",
+                "single_file",
+                "-hls_segment_filename",
+                str(output_dir / f"media{variant}.{suffix}"),
+            ]
+        segment_name = f"seg_%v_%03d.{suffix}" if self._variants else f"seg%03d.{suffix}"
+        return [*args, "-hls_segment_filename", str(output_dir / segment_name)]
+
+    def _stream_args(self) -> list[str]:
+        """FFmpeg arguments mapping input streams to output renditions.
+
+        A ladder is encoded in the same ffmpeg run: the source is decoded once and each
+        variant gets its own audio encode, plus a copy of the (cheap, still image) video
+        unless it is audio-only.
+        """
+        if not self._variants:
+            return ["-map", "0:v", "-map", "1:a", "-b:a", self._audio_bitrate]
+        maps, bitrates, stream_map = [], [], []
+        video_index = 0
+        for audio_index, (bitrate, has_video) in enumerate(self._variants):
+            streams = []
+            if has_video:
+                maps += ["-map", "0:v"]
+                streams.append(f"v:{video_index}")
+                video_index += 1
+            maps += ["-map", "1:a"]
+            streams.append(f"a:{audio_index}")
+            bitrates += [f"-b:a:{audio_index}", bitrate]
+            stream_map.append(",".join(streams))
+        return [*maps, *bitrates, "-var_stream_map", " ".join(stream_map)]
+
+    def _master_playlist(self) -> str:
+        """HLS master playlist listing the ladder's variant playlists, first variant first.
+
+        BANDWIDTH is the peak rate: audio plus the video's maxrate, with headroom for
+        container overhead.
+        """
+        video_bps = _parse_bitrate(self._video_maxrate)
+        version = 7 if self._segment_type == "fmp4" else 3
+        lines = ["#EXTM3U", f"#EXT-X-VERSION:{version}"]
+        for index, (bitrate, has_video) in enumerate(self._variants):
+            bandwidth = int((_parse_bitrate(bitrate) + (video_bps if has_video else 0)) * 1.1)
+            if has_video:
+                attributes = f"RESOLUTION={self._video_width}x{self._video_height}"
+            else:
+                attributes = 'CODECS="mp4a.40.2"'
+            lines += [
+                f"#EXT-X-STREAM-INF:BANDWIDTH={bandwidth},{attributes}",
+                f"index_{index}.m3u8",
+            ]
+        return "\n".join(lines) + "\n"
+
+    async def _run_ffmpeg(
+        self,
+        input_url: str,
+        output_dir: Path,
+        rendered_cover_path: Path,
+        job: TranscodeJob | None = None,
+        track_id: str | None = None,
+        gain_db: float | None = None,
+    ):
+        """Run FFmpeg to transcode with pre-rendered video overlay.
+
+        Progress is read incrementally from `-progress pipe:1` into job, and ffmpeg is
+        killed if it reports no progress for transcode_stall_timeout_seconds.
+
+        With ffmpeg_input="pipe" and a track_id, the source is streamed through the
+        Subsonic client into ffmpeg's stdin; otherwise ffmpeg opens input_url itself.
+        gain_db, if given, is applied to the audio for loudness normalization.
+        """
+        piped = self._ffmpeg_input == "pipe" and track_id is not None
         start_time = time.time()
+        if job is not None:
+            job.state = "running"
+            job.started_at = start_time
+            job.mark_progress()
 
         cmd = [
             self._ffmpeg_path,
             "-y",
+            # Print user/system CPU time on exit for metrics
+            "-benchmark",
+            # Machine-readable progress on stdout instead of the stats line on stderr
+            "-nostats",
+            "-progress",
+            "pipe:1",
             # Input 0: pre-rendered cover art (already has text overlay and correct size)
             "-loop",
             "1",
@@ -265,12 +810,10 @@ class HLSTranscoder:
             str(rendered_cover_path),
             # Input 1: audio stream
             "-i",
-            input_url,
-            # Map streams directly (no filter needed - image already prepared)
-            "-map",
-            "0:v",  # Video from input 0
-            "-map",
-            "1:a",  # Audio from input 1
+            "pipe:0" if piped else input_url,
+            # Map video from input 0 and audio from input 1 directly (no filter needed -
+            # image already prepared), once per rendition
+            *self._stream_args(),
             # Video encoding - simple settings work fine for VRChat
             "-c:v",
             "libx264",
@@ -287,11 +830,11 @@ class HLSTranscoder:
             self._video_maxrate,
             "-bufsize",
             self._video_bufsize,
+            # Loudness normalization, from a stored measurement
+            *(["-af", f"volume={gain_db:.2f}dB"] if gain_db is not None else []),
             # Audio encoding
             "-c:a",
             "aac",
-            "-b:a",
-            self._audio_bitrate,
             # Use shortest stream (audio) as duration
             "-shortest",
             # HLS output
@@ -301,29 +844,58 @@ class HLSTranscoder:
             str(self._segment_duration),
             "-hls_playlist_type",
             "vod",
-            "-hls_segment_filename",
-            str(output_dir / "seg%03d.ts"),
-            str(output_dir / "index.m3u8"),
+            *self._segment_args(output_dir),
+            str(output_dir / ("index_%v.m3u8" if self._variants else "index.m3u8")),
         ]
 
         logger.debug(f"FFmpeg command: {' '.join(cmd)}")
 
-        # Execute and capture output
+        # Execute, following progress on stdout while draining stderr
         proc = await asyncio.create_subprocess_exec(
             *cmd,
+            stdin=asyncio.subprocess.PIPE if piped else asyncio.subprocess.DEVNULL,
             stdout=asyncio.subprocess.PIPE,
             stderr=asyncio.subprocess.PIPE,
         )
-        stdout, stderr = await proc.communicate()
+        stderr_task = asyncio.create_task(_read_tail(proc.stderr))
+        feeder = asyncio.create_task(feed_track(self._subsonic, proc, track_id)) if piped else None
+        try:
+            await self._follow_progress(proc, job)
+            await proc.wait()
+            if feeder is not None:
+                await feeder
+        except BaseException:
+            if proc.returncode is None:
+                proc.kill()
+                await proc.wait()
+            raise
+        finally:
+            if feeder is not None:
+                feeder.cancel()
+                await asyncio.gather(feeder, return_exceptions=True)
+            stderr = await stderr_task
 
         elapsed = time.time() - start_time
+        metrics.FFMPEG_WALL_SECONDS.labels("ok" if proc.returncode == 0 else "error").observe(
+            elapsed
+        )
+        cpu_seconds = _parse_benchmark_cpu(stderr.decode(errors="replace"))
+        if cpu_seconds is not None:
+            metrics.FFMPEG_CPU_SECONDS.observe(cpu_seconds)
 
         if proc.returncode != 0:
             logger.error(f"FFmpeg failed (exit {proc.returncode}) after {elapsed:.2f}s")
             logger.error(f"FFmpeg stderr: {stderr.decode()}")
             raise TranscodeError(f"ffmpeg failed (exit {proc.returncode}): {stderr.decode()}")
 
+        if self._variants:
+            # Written last, so the slot only looks cached once every variant is finished
+            master_path = output_dir / "index.m3u8"
+            tmp_path = master_path.with_name(".index.m3u8.tmp")
+            tmp_path.write_text(self._master_playlist())
+            tmp_path.replace(master_path)
+
         # Log success with size info
-        total_size = sum(f.stat().st_size for f in output_dir.glob("*.ts"))
+        total_size = self._output_size(output_dir)
         total_mb = total_size / (1024 * 1024)
         logger.info(f"FFmpeg completed in {elapsed:.2f}s, output size: {total_mb:.2f} MB")
@@ -1,3 +1,6 @@
+import sys
+from pathlib import Path
+
 import pytest
 import respx
 from httpx import Response
@@ -87,6 +90,7 @@ def make_album_response(album_id: str) -> dict:
                     "song": [
                         {
                             "id": "song001",
+                            "path": "Pendulum/Immersion/01 - Watercolour.mp3",
                             "title": "Watercolour",
                             "album": "Immersion",
                             "artist": "Pendulum",
@@ -103,6 +107,7 @@ def make_album_response(album_id: str) -> dict:
                         },
                         {
                             "id": "song002",
+                            "path": "Pendulum/Immersion/02 - Immunize.flac",
                             "title": "Immunize",
                             "album": "Immersion",
                             "artist": "Pendulum",
@@ -254,6 +259,16 @@ ERROR_RESPONSE = {
 # Total songs across all mock albums: 7
 
 
+@pytest.fixture
+def fake_ffmpeg(tmp_path) -> str:
+    """Path to an executable wrapper around tests/fake_ffmpeg.py."""
+    script = Path(__file__).parent / "fake_ffmpeg.py"
+    wrapper = tmp_path / "ffmpeg"
+    wrapper.write_text(f'#!/bin/sh\nexec "{sys.executable}" "{script}" "$@"\n')
+    wrapper.chmod(0o755)
+    return str(wrapper)
+
+
 @pytest.fixture
 def settings(tmp_path):
     return Settings(
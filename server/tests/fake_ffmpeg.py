@@ -0,0 +1,88 @@
+"""Stand-in for the ffmpeg binary, for tests that exercise HLSTranscoder._run_ffmpeg.
+
+Understands just enough of the command line the transcoder builds to write plausible
+HLS output, reports `-progress pipe:1` lines while it "works", and prints the
+`-benchmark` summary on exit. Behaviour is controlled through environment variables:
+
+    FAKE_FFMPEG_SECONDS     total wall time to spend (default 0.2)
+    FAKE_FFMPEG_DURATION    track duration in seconds to report progress against (default 30)
+    FAKE_FFMPEG_HANG        if set, sleep this long without reporting any progress
+    FAKE_FFMPEG_EXIT        exit code (default 0)
+    FAKE_FFMPEG_LAUNCH_LOG  append one line per launch to this file
+    FAKE_FFMPEG_INPUT_LOG   write the audio input (argument, then bytes read from stdin
+                            for `-i pipe:0`) to this file
+    FAKE_FFMPEG_LOUDNESS    integrated loudness reported by a loudnorm measuring pass
+                            (`-f null -`; default -20.0)
+"""
+
+import json
+import os
+import sys
+import time
+from pathlib import Path
+
+
+def main(argv: list[str]):
+    seconds = float(os.environ.get("FAKE_FFMPEG_SECONDS", "0.2"))
+    duration = float(os.environ.get("FAKE_FFMPEG_DURATION", "30"))
+    exit_code = int(os.environ.get("FAKE_FFMPEG_EXIT", "0"))
+
+    launch_log = os.environ.get("FAKE_FFMPEG_LAUNCH_LOG")
+    if launch_log:
+        with open(launch_log, "a") as f:
+            f.write(f"{os.getpid()} {argv[-1]}\n")
+
+    inputs = [argv[i + 1] for i, arg in enumerate(argv) if arg == "-i"]
+    audio_input = inputs[-1]
+    stdin_bytes = sys.stdin.buffer.read() if audio_input == "pipe:0" else b""
+    input_log = os.environ.get("FAKE_FFMPEG_INPUT_LOG")
+    if input_log:
+        Path(input_log).write_bytes(audio_input.encode() + b"\n" + stdin_bytes)
+
+    if argv[-2:] == ["null", "-"]:
+        if exit_code:
+            sys.stderr.write("Error opening input: fake failure\n")
+            sys.exit(exit_code)
+        loudness = os.environ.get("FAKE_FFMPEG_LOUDNESS", "-20.0")
+        summary = {"input_i": loudness, "input_tp": "-3.00", "input_lra": "7.00"}
+        sys.stderr.write("[Parsed_loudnorm_0 @ 0x0]\n" + json.dumps(summary, indent=4) + "\n")
+        return
+
+    hang = os.environ.get("FAKE_FFMPEG_HANG")
+    if hang:
+        time.sleep(float(hang))
+
+    steps = 5
+    for i in range(1, steps + 1):
+        time.sleep(seconds / steps)
+        out_time_us = int(duration * 1_000_000 * i / steps)
+        sys.stdout.write(f"out_time_us={out_time_us}\nspeed={duration / seconds:.2f}x\n")
+        sys.stdout.write("progress=continue\n" if i < steps else "progress=end\n")
+        sys.stdout.flush()
+
+    if exit_code:
+        sys.stderr.write("Error opening input: fake failure\n")
+        sys.exit(exit_code)
+
+    # One output playlist per -var_stream_map variant, with %v as the variant index
+    variants = 1
+    if "-var_stream_map" in argv:
+        variants = len(argv[argv.index("-var_stream_map") + 1].split())
+    segment_count = max(int(duration // 10) + 1, 1)
+    for v in range(variants):
+        playlist_path = Path(argv[-1].replace("%v", str(v)))
+        segment_pattern = argv[argv.index("-hls_segment_filename") + 1].replace("%v", str(v))
+        lines = ["#EXTM3U", "#EXT-X-VERSION:3", "#EXT-X-TARGETDURATION:10"]
+        lines.append("#EXT-X-PLAYLIST-TYPE:VOD")
+        for i in range(segment_count):
+            segment_path = Path(segment_pattern.replace("%03d", f"{i:03d}"))
+            segment_path.write_bytes(b"\x47" * 188 * 16)
+            lines += [f"#EXTINF:{min(10.0, duration - 10 * i):.1f},", segment_path.name]
+        lines.append("#EXT-X-ENDLIST")
+        playlist_path.write_text("\n".join(lines) + "\n")
+
+    sys.stderr.write(f"bench: utime={seconds / 2:.3f}s stime=0.010s rtime={seconds:.3f}s\n")
+
+
+if __name__ == "__main__":
+    main(sys.argv)
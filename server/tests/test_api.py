@@ -1,17 +1,32 @@
+import os
+import time
+
+from unittest.mock import AsyncMock, patch
+
 import pytest
 from httpx import ASGITransport, AsyncClient
 
-from subsonic_proxy.app import AppState, create_app
-from subsonic_proxy.cache import CacheManager
+from subsonic_proxy.app import AppState, apply_metadata, create_app
+from subsonic_proxy.atlas import AtlasBuilder
+from subsonic_proxy.cache import CacheManager, PlaylistCache, SegmentCache, encode_version
 from subsonic_proxy.config import Settings
+from subsonic_proxy.library import LocalLibrary
+from subsonic_proxy.loudness import LoudnessAnalyzer
 from subsonic_proxy.metadata import MetadataBuilder
+from subsonic_proxy.refresh import RefreshManager
 from subsonic_proxy.subsonic import SubsonicClient
 from subsonic_proxy.transcoder import HLSTranscoder
 from tests.conftest import MOCK_SUBSONIC_URL
+from tests.test_transcoder import _create_fake_hls, _create_fake_ladder
 
 from pathlib import Path
 
 
+def _segments(slot_dir: Path) -> str:
+    """The segment URL prefix of a slot's current encode."""
+    return f"/segments/{slot_dir.name}/{encode_version(slot_dir / 'index.m3u8')}"
+
+
 @pytest.fixture
 def test_settings(tmp_path):
     return Settings(
@@ -37,18 +52,35 @@ async def client(test_settings, mock_subsonic):
         cache_dir=Path(test_settings.cache_dir),
         ttl_seconds=test_settings.cache_ttl_seconds,
     )
+    state.playlist_cache = PlaylistCache(max_entries=test_settings.slot_count)
+    state.segment_cache = SegmentCache(max_bytes=test_settings.segment_cache_bytes)
     state.transcoder = HLSTranscoder(
-        settings=test_settings, cache_manager=state.cache, subsonic_client=state.subsonic
+        settings=test_settings,
+        cache_manager=state.cache,
+        subsonic_client=state.subsonic,
+        segment_cache=state.segment_cache,
     )
     state.metadata_builder = MetadataBuilder(settings=test_settings, subsonic=state.subsonic)
     state.metadata = await state.metadata_builder.build()
+    state.refresher = RefreshManager(
+        state.metadata_builder, on_complete=lambda metadata: apply_metadata(state, metadata)
+    )
+    state.atlas = AtlasBuilder(
+        settings=test_settings, cache_manager=state.cache, subsonic_client=state.subsonic
+    )
     test_app.state.svc = state
 
     transport = ASGITransport(app=test_app)
     async with AsyncClient(transport=transport, base_url="http://test") as ac:
         yield ac
 
+    if state.atlas_task is not None:
+        state.atlas_task.cancel()
+    state.atlas.close()
+    if state.refresher.current is not None:
+        state.refresher.current.task.cancel()
     await state.subsonic.close()
+    state.metadata_builder.close()
 
 
 class TestMetadataEndpoint:
@@ -115,11 +147,268 @@ class TestHLSEndpoint:
         resp = await client.get("/notaslot.m3u8")
         assert resp.status_code == 404
 
+    @pytest.mark.anyio
+    async def test_cached_playlist_rewritten_with_validators(self, client, test_settings):
+        slot_dir = Path(test_settings.cache_dir) / "segments" / "0001"
+        _create_fake_hls(slot_dir)
+
+        resp = await client.get("/0001.m3u8")
+        assert resp.status_code == 200
+        assert f"http://localhost:8000{_segments(slot_dir)}/seg000.ts" in resp.text
+        assert resp.headers["etag"]
+        assert resp.headers["last-modified"]
+        assert resp.headers["cache-control"].startswith("public, max-age=")
+
+    @pytest.mark.anyio
+    async def test_master_playlist_and_variants(self, client, test_settings):
+        slot_dir = Path(test_settings.cache_dir) / "segments" / "0001"
+        _create_fake_ladder(slot_dir)
+        prefix = _segments(slot_dir)
+
+        resp = await client.get("/0001.m3u8")
+        assert resp.status_code == 200
+        assert f"http://localhost:8000{prefix}/index_1.m3u8" in resp.text
+        assert resp.headers["cache-control"].startswith("public, max-age=")
+
+        resp = await client.get(f"{prefix}/index_1.m3u8")
+        assert resp.status_code == 200
+        assert resp.headers["content-type"] == "application/vnd.apple.mpegurl"
+        assert f"http://localhost:8000{prefix}/seg_1_000.ts" in resp.text
+        assert (await client.get(f"{prefix}/seg_1_002.ts")).status_code == 200
+        assert (await client.get(f"{prefix}/index_7.m3u8")).status_code == 404
+        assert (await client.get("/segments/0001/0/index_1.m3u8")).status_code == 404
+
+    @pytest.mark.anyio
+    async def test_expired_transcode_served_while_subsonic_down(self, client, test_settings):
+        slot_dir = Path(test_settings.cache_dir) / "segments" / "0001"
+        _create_fake_hls(slot_dir)
+        old = time.time() - 2 * test_settings.cache_ttl_seconds
+        os.utime(slot_dir / "index.m3u8", (old, old))
+        state = client._transport.app.state.svc
+        for _ in range(test_settings.subsonic_breaker_threshold):
+            state.subsonic.breaker.record_failure()
+
+        resp = await client.get("/0001.m3u8")
+        assert resp.status_code == 200
+        assert "seg000.ts" in resp.text
+
+        resp = await client.get("/0002.m3u8")
+        assert resp.status_code == 503
+
+    @pytest.mark.anyio
+    async def test_conditional_request_304(self, client, test_settings):
+        _create_fake_hls(Path(test_settings.cache_dir) / "segments" / "0001")
+
+        first = await client.get("/0001.m3u8")
+        resp = await client.get("/0001.m3u8", headers={"If-None-Match": first.headers["etag"]})
+        assert resp.status_code == 304
+        assert resp.content == b""
+
+        resp = await client.get(
+            "/0001.m3u8", headers={"If-Modified-Since": first.headers["last-modified"]}
+        )
+        assert resp.status_code == 304
+
+    @pytest.mark.anyio
+    async def test_retranscode_changes_etag(self, client, test_settings):
+        slot_dir = Path(test_settings.cache_dir) / "segments" / "0001"
+        _create_fake_hls(slot_dir)
+        first = await client.get("/0001.m3u8")
+
+        m3u8 = slot_dir / "index.m3u8"
+        m3u8.write_text(m3u8.read_text().replace("#EXTINF:4.5,", "#EXTINF:5.0,"))
+        resp = await client.get("/0001.m3u8", headers={"If-None-Match": first.headers["etag"]})
+        assert resp.status_code == 200
+        assert resp.headers["etag"] != first.headers["etag"]
+        assert "#EXTINF:5.0," in resp.text
+
+    @pytest.mark.anyio
+    async def test_packed_playlist_keeps_byteranges(self, client, test_settings):
+        slot_dir = Path(test_settings.cache_dir) / "segments" / "0001"
+        _create_fake_packed_hls(slot_dir)
+
+        resp = await client.get("/0001.m3u8")
+        assert resp.status_code == 200
+        lines = resp.text.splitlines()
+        assert "#EXT-X-BYTERANGE:1024@0" in lines
+        assert lines.count(f"http://localhost:8000{_segments(slot_dir)}/media.ts") == 3
+
+    @pytest.mark.anyio
+    async def test_fmp4_playlist_rewrites_init_segment(self, client, test_settings):
+        slot_dir = Path(test_settings.cache_dir) / "segments" / "0001"
+        _create_fake_fmp4_hls(slot_dir)
+
+        resp = await client.get("/0001.m3u8")
+        assert resp.status_code == 200
+        prefix = f"http://localhost:8000{_segments(slot_dir)}"
+        assert f'#EXT-X-MAP:URI="{prefix}/init.mp4"' in resp.text
+        assert f"{prefix}/seg000.m4s" in resp.text
+
+
+def _create_fake_fmp4_hls(slot_dir: Path):
+    """Fake ffmpeg output for hls_segment_type=fmp4."""
+    slot_dir.mkdir(parents=True, exist_ok=True)
+    (slot_dir / "index.m3u8").write_text(
+        "#EXTM3U\n"
+        "#EXT-X-VERSION:7\n"
+        "#EXT-X-TARGETDURATION:10\n"
+        "#EXT-X-MEDIA-SEQUENCE:0\n"
+        "#EXT-X-PLAYLIST-TYPE:VOD\n"
+        '#EXT-X-MAP:URI="init.mp4"\n'
+        "#EXTINF:10.0,\n"
+        "seg000.m4s\n"
+        "#EXTINF:4.5,\n"
+        "seg001.m4s\n"
+        "#EXT-X-ENDLIST\n"
+    )
+    (slot_dir / "init.mp4").write_bytes(b"\x00" * 128)
+    (slot_dir / "seg000.m4s").write_bytes(b"\x00" * 1024)
+    (slot_dir / "seg001.m4s").write_bytes(b"\x00" * 512)
+
+
+def _create_fake_packed_hls(slot_dir: Path):
+    """Fake ffmpeg output for hls_single_file mode: one media file plus byte ranges."""
+    slot_dir.mkdir(parents=True, exist_ok=True)
+    (slot_dir / "index.m3u8").write_text(
+        "#EXTM3U\n"
+        "#EXT-X-VERSION:4\n"
+        "#EXT-X-TARGETDURATION:10\n"
+        "#EXT-X-MEDIA-SEQUENCE:0\n"
+        "#EXT-X-PLAYLIST-TYPE:VOD\n"
+        "#EXTINF:10.0,\n"
+        "#EXT-X-BYTERANGE:1024@0\n"
+        "media.ts\n"
+        "#EXTINF:10.0,\n"
+        "#EXT-X-BYTERANGE:1024@1024\n"
+        "media.ts\n"
+        "#EXTINF:4.5,\n"
+        "#EXT-X-BYTERANGE:512@2048\n"
+        "media.ts\n"
+        "#EXT-X-ENDLIST\n"
+    )
+    (slot_dir / "media.ts").write_bytes(bytes(range(256)) * 10)
+
 
 class TestSegmentEndpoint:
     @pytest.mark.anyio
     async def test_missing_segment_404(self, client):
-        resp = await client.get("/segments/0001/seg000.ts")
+        resp = await client.get("/segments/0001/0/seg000.ts")
+        assert resp.status_code == 404
+
+    @pytest.mark.anyio
+    async def test_segment_served_with_immutable_caching(self, client, test_settings):
+        slot_dir = Path(test_settings.cache_dir) / "segments" / "0001"
+        _create_fake_hls(slot_dir)
+
+        resp = await client.get(f"{_segments(slot_dir)}/seg000.ts")
+        assert resp.status_code == 200
+        assert resp.headers["content-type"] == "video/mp2t"
+        assert "immutable" in resp.headers["cache-control"]
+        assert len(resp.content) == 1024
+
+    @pytest.mark.anyio
+    async def test_repeated_segment_served_from_ram(self, client, test_settings):
+        slot_dir = Path(test_settings.cache_dir) / "segments" / "0001"
+        _create_fake_hls(slot_dir)
+
+        prefix = _segments(slot_dir)
+
+        await client.get(f"{prefix}/seg001.ts")
+        await client.get(f"{prefix}/seg001.ts")
+        (slot_dir / "seg001.ts").unlink()
+
+        resp = await client.get(f"{prefix}/seg001.ts")
+        assert resp.status_code == 200
+        assert len(resp.content) == 1024
+
+    @pytest.mark.anyio
+    async def test_reencoded_slot_changes_segment_urls(self, client, test_settings):
+        slot_dir = Path(test_settings.cache_dir) / "segments" / "0001"
+        _create_fake_hls(slot_dir)
+        old = _segments(slot_dir)
+        await client.get(f"{old}/seg000.ts")
+        await client.get(f"{old}/seg000.ts")
+
+        # A re-encode in place replaces the playlist, giving it a new mtime
+        m3u8_path = slot_dir / "index.m3u8"
+        mtime = m3u8_path.stat().st_mtime_ns
+        os.utime(m3u8_path, ns=(mtime + 10**9, mtime + 10**9))
+        new = _segments(slot_dir)
+        assert new != old
+
+        resp = await client.get("/0001.m3u8")
+        assert f"http://localhost:8000{new}/seg000.ts" in resp.text
+        assert (await client.get(f"{new}/seg000.ts")).status_code == 200
+        # The old URL stays valid only for the bytes already held in RAM for it
+        assert (await client.get(f"{old}/seg001.ts")).status_code == 404
+
+    @pytest.mark.anyio
+    async def test_replaced_encode_served_until_retired(self, client, test_settings):
+        slot_dir = Path(test_settings.cache_dir) / "segments" / "0001"
+        _create_fake_hls(slot_dir)
+        old = _segments(slot_dir)
+        state = client._transport.app.state.svc
+        state.cache.retired_seconds = 600
+
+        # A refresh-ahead swap retires the encode clients are partway through
+        state.cache.retire_slot(slot_dir)
+        _create_fake_hls(slot_dir)
+        mtime = (slot_dir / "index.m3u8").stat().st_mtime_ns
+        os.utime(slot_dir / "index.m3u8", ns=(mtime + 10**9, mtime + 10**9))
+        assert _segments(slot_dir) != old
+
+        assert (await client.get(f"{old}/seg002.ts")).status_code == 200
+        assert (await client.get(f"{_segments(slot_dir)}/seg002.ts")).status_code == 200
+        assert (await client.get("/segments/0001/..%2F0001/seg002.ts")).status_code == 404
+
+    @pytest.mark.anyio
+    async def test_packed_media_range_requests(self, client, test_settings):
+        slot_dir = Path(test_settings.cache_dir) / "segments" / "0001"
+        _create_fake_packed_hls(slot_dir)
+        url = f"{_segments(slot_dir)}/media.ts"
+        expected = (bytes(range(256)) * 10)[1024:2048]
+
+        # Every read is a ranged read from disk; the whole packed file never enters RAM
+        for _ in range(3):
+            resp = await client.get(url, headers={"Range": "bytes=1024-2047"})
+            assert resp.status_code == 206
+            assert resp.headers["content-range"] == "bytes 1024-2047/2560"
+            assert resp.content == expected
+        assert client._transport.app.state.svc.segment_cache.size == 0
+
+    @pytest.mark.anyio
+    async def test_oversized_segment_never_read_into_ram(self, client, test_settings):
+        slot_dir = Path(test_settings.cache_dir) / "segments" / "0001"
+        _create_fake_hls(slot_dir)
+        state: AppState = client._transport.app.state.svc
+        state.segment_cache = SegmentCache(max_bytes=1024 * 1024, max_segment_bytes=512)
+        url = f"{_segments(slot_dir)}/seg000.ts"
+
+        with patch.object(Path, "read_bytes", side_effect=AssertionError("read into RAM")):
+            for _ in range(3):
+                resp = await client.get(url)
+                assert resp.status_code == 200
+                assert len(resp.content) == 1024
+        assert state.segment_cache.size == 0
+
+    @pytest.mark.anyio
+    async def test_fmp4_segment_media_types(self, client, test_settings):
+        slot_dir = Path(test_settings.cache_dir) / "segments" / "0001"
+        _create_fake_fmp4_hls(slot_dir)
+        prefix = _segments(slot_dir)
+
+        resp = await client.get(f"{prefix}/init.mp4")
+        assert resp.status_code == 200
+        assert resp.headers["content-type"] == "video/mp4"
+        resp = await client.get(f"{prefix}/seg000.m4s")
+        assert resp.status_code == 200
+        assert resp.headers["content-type"] == "video/iso.segment"
+
+    @pytest.mark.anyio
+    async def test_non_media_file_404(self, client, test_settings):
+        slot_dir = Path(test_settings.cache_dir) / "segments" / "0001"
+        _create_fake_fmp4_hls(slot_dir)
+        resp = await client.get(f"{_segments(slot_dir)}/index.m3u8")
         assert resp.status_code == 404
 
 
@@ -134,15 +423,286 @@ class TestAudioEndpoint:
         resp = await client.get("/notaslot.mp3")
         assert resp.status_code == 404
 
+    @pytest.mark.anyio
+    async def test_expired_copy_served_while_subsonic_down(self, client, test_settings):
+        cached = Path(test_settings.cache_dir) / "audio" / "0001.mp3"
+        cached.parent.mkdir(parents=True)
+        cached.write_bytes(b"old mp3")
+        old = time.time() - 2 * test_settings.cache_ttl_seconds
+        os.utime(cached, (old, old))
+        state = client._transport.app.state.svc
+        for _ in range(test_settings.subsonic_breaker_threshold):
+            state.subsonic.breaker.record_failure()
+
+        resp = await client.get("/0001.mp3")
+        assert resp.status_code == 200
+        assert resp.content == b"old mp3"
+
+        resp = await client.get("/0002.mp3")
+        assert resp.status_code == 503
+        assert resp.headers["retry-after"] == "30"
+
+
+class TestLocalLibrary:
+    @pytest.fixture
+    def music_root(self, client, tmp_path):
+        root = tmp_path / "music"
+        song = root / "Pendulum" / "Immersion" / "01 - Watercolour.mp3"
+        song.parent.mkdir(parents=True)
+        song.write_bytes(b"local mp3")
+        (root / "Pendulum" / "Immersion" / "02 - Immunize.flac").write_bytes(b"flac")
+        client._transport.app.state.svc.library = LocalLibrary(root)
+        return root
+
+    @pytest.mark.anyio
+    async def test_audio_sent_from_library(self, client, music_root, mock_subsonic):
+        resp = await client.get("/0001.mp3")
+        assert resp.status_code == 200
+        assert resp.content == b"local mp3"
+        assert not any(c.request.url.path.endswith("/stream.view") for c in mock_subsonic.calls)
+
+        # A different format still goes through Subsonic
+        resp = await client.get("/0002.mp3")
+        assert resp.content == b"FAKE_MP3_DATA_song002"
+
+    @pytest.mark.anyio
+    async def test_transcode_reads_library_file(self, client, music_root, test_settings):
+        state = client._transport.app.state.svc
+        inputs = []
+
+        async def fake_ffmpeg(input_url, output_dir, *args, track_id=None, **kwargs):
+            inputs.append((input_url, track_id))
+            _create_fake_hls(output_dir)
+
+        with patch.object(state.transcoder, "_run_ffmpeg", new=AsyncMock(side_effect=fake_ffmpeg)):
+            assert (await client.get("/0001.m3u8")).status_code == 200
+            (music_root / "Pendulum" / "Immersion" / "02 - Immunize.flac").unlink()
+            assert (await client.get("/0002.m3u8")).status_code == 200
+
+        song = music_root / "Pendulum" / "Immersion" / "01 - Watercolour.mp3"
+        assert inputs[0] == (str(song.resolve()), None)
+        assert inputs[1][0].startswith(MOCK_SUBSONIC_URL)
+        assert inputs[1][1] == "song002"
+
+
+class TestLoudness:
+    @pytest.mark.anyio
+    async def test_transcode_applies_stored_gain(self, client, test_settings):
+        state = client._transport.app.state.svc
+        store = state.metadata_builder.store
+        state.loudness = LoudnessAnalyzer(test_settings, store, state.subsonic)
+        store.put_loudness("song001", -20.0, 5.0, -10.0, "analysis")
+        gains = []
+
+        async def fake_ffmpeg(input_url, output_dir, *args, gain_db=None, **kwargs):
+            gains.append(gain_db)
+            _create_fake_hls(output_dir)
+
+        with patch.object(state.transcoder, "_run_ffmpeg", new=AsyncMock(side_effect=fake_ffmpeg)):
+            assert (await client.get("/0001.m3u8")).status_code == 200
+            assert (await client.get("/0002.m3u8")).status_code == 200
+
+        assert gains == [pytest.approx(4.0), None]
+
+
+class TestAtlasEndpoint:
+    @pytest.mark.anyio
+    async def test_atlas_404_before_build(self, client):
+        resp = await client.get("/atlas.json")
+        assert resp.status_code == 404
+        resp = await client.get("/atlas/00.jpg")
+        assert resp.status_code == 404
+
 
 class TestRefreshEndpoint:
     @pytest.mark.anyio
-    async def test_refresh_returns_ok(self, client):
+    async def test_refresh_returns_job(self, client):
         resp = await client.post("/refresh")
+        assert resp.status_code == 202
+        data = resp.json()
+        assert data["state"] == "running"
+        assert data["trigger"] == "manual"
+        assert data["joined"] is False
+        assert resp.headers["location"] == f"/refresh/{data['id']}"
+
+    @pytest.mark.anyio
+    async def test_concurrent_refreshes_join(self, client):
+        first = (await client.post("/refresh")).json()
+        second = (await client.post("/refresh")).json()
+        assert second["id"] == first["id"]
+        assert second["joined"] is True
+
+    @pytest.mark.anyio
+    async def test_refresh_progress_queryable(self, client):
+        state = client._transport.app.state.svc
+        job_id = (await client.post("/refresh")).json()["id"]
+        await state.refresher.get(job_id).task
+
+        resp = await client.get(f"/refresh/{job_id}")
         assert resp.status_code == 200
         data = resp.json()
-        assert data["status"] == "ok"
-        assert "track_count" in data
+        assert data["state"] == "done"
+        assert data["albums_fetched"] == 3
+        assert data["tracks_found"] == 7
+        assert data["track_count"] == 7
+
+    @pytest.mark.anyio
+    async def test_unknown_job_404(self, client):
+        resp = await client.get("/refresh/nope")
+        assert resp.status_code == 404
+
+
+class TestMetricsEndpoint:
+    @pytest.mark.anyio
+    async def test_metrics_records_routes(self, client, test_settings):
+        slot_dir = Path(test_settings.cache_dir) / "segments" / "0001"
+        _create_fake_hls(slot_dir)
+        await client.get("/0001.m3u8")
+        await client.get(f"{_segments(slot_dir)}/seg000.ts")
+
+        resp = await client.get("/metrics")
+        assert resp.status_code == 200
+        assert resp.headers["content-type"].startswith("text/plain; version=0.0.4")
+        text = resp.text
+        assert 'route="/{slot_id}.m3u8"' in text
+        assert 'subsonic_proxy_playlist_seconds_count{cache="hit"}' in text
+        assert (
+            'subsonic_proxy_bytes_served_total{route="/segments/{slot_id}/{version}/{segment_name}"}'
+            in text
+        )
+        assert (
+            'subsonic_proxy_subsonic_request_seconds_count{endpoint="getAlbum",result="ok"}' in text
+        )
+
+
+class TestAdminEndpoints:
+    @pytest.mark.anyio
+    async def test_transcode_timings_listed(self, client):
+        resp = await client.get("/admin/transcodes")
+        assert resp.status_code == 200
+        assert resp.json() == {"recent": [], "slowest": []}
+
+    @pytest.mark.anyio
+    async def test_jobs_listed(self, client):
+        resp = await client.get("/jobs")
+        assert resp.status_code == 200
+        assert resp.json() == {"jobs": []}
+
+    @pytest.mark.anyio
+    async def test_admin_token_enforced(self, client):
+        state = client._transport.app.state.svc
+        state.settings = state.settings.model_copy(update={"admin_token": "secret"})
+
+        resp = await client.get("/admin/transcodes")
+        assert resp.status_code == 403
+        resp = await client.get("/admin/transcodes", headers={"X-Admin-Token": "secret"})
+        assert resp.status_code == 200
+
+
+class TestProfiling:
+    @pytest.mark.anyio
+    async def test_not_profiled_when_disabled(self, client):
+        resp = await client.get("/metadata.json", headers={"X-Profile": "1"})
+        assert resp.status_code == 200
+        assert "x-profile-id" not in resp.headers
+
+    @pytest.mark.anyio
+    async def test_profiled_request_stores_folded_stacks(self, client):
+        state = client._transport.app.state.svc
+        state.settings = state.settings.model_copy(update={"profiling_enabled": True})
+
+        resp = await client.get("/metadata.json")
+        assert "x-profile-id" not in resp.headers
+
+        resp = await client.get("/metadata.json", headers={"X-Profile": "1"})
+        assert resp.status_code == 200
+        profile_id = resp.headers["x-profile-id"]
+
+        resp = await client.get("/admin/profiles")
+        assert resp.json() == {"profiles": [profile_id]}
+        resp = await client.get(f"/admin/profiles/{profile_id}")
+        assert resp.status_code == 200
+        for line in resp.text.splitlines():
+            _stack, count = line.rsplit(" ", 1)
+            assert int(count) > 0
+
+    @pytest.mark.anyio
+    async def test_profiling_requires_admin_token(self, client):
+        state = client._transport.app.state.svc
+        state.settings = state.settings.model_copy(
+            update={"profiling_enabled": True, "admin_token": "secret"}
+        )
+
+        resp = await client.get("/metadata.json", headers={"X-Profile": "1"})
+        assert "x-profile-id" not in resp.headers
+        resp = await client.get(
+            "/metadata.json", headers={"X-Profile": "1", "X-Admin-Token": "secret"}
+        )
+        assert "x-profile-id" in resp.headers
+
+    @pytest.mark.anyio
+    async def test_unknown_profile_404(self, client):
+        resp = await client.get("/admin/profiles/nope")
+        assert resp.status_code == 404
+
+    @pytest.mark.anyio
+    async def test_loop_stalls_disabled_by_default(self, client):
+        resp = await client.get("/admin/loop-stalls")
+        assert resp.json() == {"enabled": False, "stalls": []}
+
+
+class TestStartup:
+    @pytest.mark.anyio
+    async def test_cold_start_serves_empty_metadata_then_swaps(self, test_settings, mock_subsonic):
+        app = create_app(settings=test_settings)
+        async with app.router.lifespan_context(app):
+            state: AppState = app.state.svc
+            assert state.metadata.tracks == {}
+            assert state.refresher.current.trigger == "startup"
+
+            await state.refresher.current.task
+            assert len(state.metadata.tracks) == 7
+
+    @pytest.mark.anyio
+    async def test_stale_metadata_served_while_refreshing(self, test_settings, mock_subsonic):
+        async with SubsonicClient(test_settings) as subsonic:
+            builder = MetadataBuilder(settings=test_settings, subsonic=subsonic)
+            await builder.build()
+        song = builder.store.slot_song("0001")
+        album_songs = [
+            {**other, "title": "Stale Title"} if other["id"] == song["id"] else other
+            for other in builder.store.album_songs(song["album_id"])
+        ]
+        builder.store.put_album(
+            {"id": song["album_id"], "name": song["album"], "artist": song["artist"]},
+            album_songs,
+            sync_key="",
+        )
+        builder.store.set_cursor(
+            "built_at", repr(time.time() - test_settings.cache_ttl_seconds - 60)
+        )
+        builder.close()
+
+        app = create_app(settings=test_settings)
+        async with app.router.lifespan_context(app):
+            state: AppState = app.state.svc
+            assert state.metadata.tracks["0001"].title == "Stale Title"
+
+            await state.refresher.current.task
+            assert state.metadata.tracks["0001"].title != "Stale Title"
+
+    @pytest.mark.anyio
+    async def test_fresh_metadata_not_refreshed(self, test_settings, mock_subsonic):
+        async with SubsonicClient(test_settings) as subsonic:
+            builder = MetadataBuilder(settings=test_settings, subsonic=subsonic)
+            await builder.build()
+            builder.close()
+
+        app = create_app(settings=test_settings)
+        async with app.router.lifespan_context(app):
+            state: AppState = app.state.svc
+            assert len(state.metadata.tracks) == 7
+            assert state.refresher.current is None
 
 
 class TestCORS:
@@ -0,0 +1,149 @@
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+from PIL import Image
+
+from subsonic_proxy import metrics
+from subsonic_proxy.atlas import AtlasBuilder
+from subsonic_proxy.cache import CacheManager
+from subsonic_proxy.metadata import AlbumInfo, MetadataResponse, TrackInfo
+from subsonic_proxy.subsonic import SubsonicError
+
+
+def _make_metadata(album_count: int) -> MetadataResponse:
+    tracks = {}
+    albums = {}
+    for i in range(album_count):
+        slot_id = f"{i + 1:04d}"
+        album_id = f"album{i:03d}"
+        tracks[slot_id] = TrackInfo(
+            id=f"song{i:03d}",
+            title=f"Song {i}",
+            artist="Artist",
+            album=f"Album {i}",
+            album_id=album_id,
+            duration=100,
+            cover_art=f"al-{album_id}",
+        )
+        albums[album_id] = AlbumInfo(name=f"Album {i}", artist="Artist", track_slots=[slot_id])
+    return MetadataResponse(
+        version=1, base_url="http://localhost:8000", slot_count=1000, tracks=tracks, albums=albums
+    )
+
+
+def _jpeg_bytes(tmp_path, color) -> bytes:
+    path = tmp_path / f"{color[0]}-{color[1]}-{color[2]}.jpg"
+    Image.new("RGB", (300, 300), color).save(path, "JPEG")
+    return path.read_bytes()
+
+
+@pytest.fixture
+def atlas_settings(settings):
+    return settings.model_copy(
+        update={"atlas_thumb_size": 64, "atlas_size": 128, "atlas_workers": 1}
+    )
+
+
+@pytest.fixture
+def cache_manager(atlas_settings):
+    return CacheManager(cache_dir=atlas_settings.cache_dir, ttl_seconds=3600)
+
+
+@pytest.fixture
+def subsonic_client(tmp_path):
+    mock = MagicMock()
+    red = _jpeg_bytes(tmp_path, (255, 0, 0))
+    mock.get_cover_art = AsyncMock(return_value=red)
+    return mock
+
+
+@pytest.fixture
+def builder(atlas_settings, cache_manager, subsonic_client):
+    builder = AtlasBuilder(atlas_settings, cache_manager, subsonic_client)
+    yield builder
+    builder.close()
+
+
+class TestAtlasBuilder:
+    @pytest.mark.anyio
+    async def test_builds_pages_and_map(self, builder):
+        # 2x2 cells per page, so 5 albums need 2 pages
+        atlas_map = await builder.build(_make_metadata(5))
+
+        assert atlas_map["page_count"] == 2
+        assert builder.get_page_path(0).exists()
+        assert builder.get_page_path(1).exists()
+        assert atlas_map["albums"]["album004"]["atlas"] == 1
+        # First cell is the top-left quarter, with v measured from the bottom
+        assert atlas_map["albums"]["album000"]["uv"] == [0.0, 0.5, 0.5, 0.5]
+        assert builder.load_map() == atlas_map
+
+        with Image.open(builder.get_page_path(0)) as page:
+            assert page.size == (128, 128)
+            r, g, b = page.getpixel((32, 32))
+            assert r > 200 and g < 50 and b < 50
+
+    @pytest.mark.anyio
+    async def test_reuses_cover_cache(self, builder, subsonic_client):
+        await builder.build(_make_metadata(3))
+        assert subsonic_client.get_cover_art.call_count == 3
+
+        await builder.build(_make_metadata(3))
+        assert subsonic_client.get_cover_art.call_count == 3
+
+    @pytest.mark.anyio
+    async def test_rebuild_not_counted_as_cover_requests(self, builder, cache_manager):
+        await builder.build(_make_metadata(3))
+        hits = metrics.CACHE_REQUESTS.labels("cover", "hit").value
+        await builder.build(_make_metadata(3))
+
+        assert metrics.CACHE_REQUESTS.labels("cover", "hit").value == hits
+        cover_path = cache_manager.get_cover_art_path("al-album000")
+        assert cache_manager.access.count(cache_manager._key(cover_path)) == 0
+        # Written through a temporary file, none of which are left behind
+        assert sorted(p.name for p in cover_path.parent.iterdir()) == [
+            "al-album000.jpg",
+            "al-album001.jpg",
+            "al-album002.jpg",
+        ]
+
+    @pytest.mark.anyio
+    async def test_unchanged_pages_not_rerendered(self, builder):
+        await builder.build(_make_metadata(5))
+        first_page_mtime = builder.get_page_path(0).stat().st_mtime_ns
+        second_page_mtime = builder.get_page_path(1).stat().st_mtime_ns
+
+        # Adding an album only touches the last page
+        await builder.build(_make_metadata(6))
+        assert builder.get_page_path(0).stat().st_mtime_ns == first_page_mtime
+        assert builder.get_page_path(1).stat().st_mtime_ns != second_page_mtime
+
+    @pytest.mark.anyio
+    async def test_failed_cover_fetch_uses_fallback(self, builder, subsonic_client):
+        subsonic_client.get_cover_art.side_effect = SubsonicError(70, "Cover art not found")
+
+        atlas_map = await builder.build(_make_metadata(1))
+        assert atlas_map["page_count"] == 1
+        assert builder.get_page_path(0).exists()
+
+    @pytest.mark.anyio
+    async def test_changed_cover_rerendered(self, builder, cache_manager, tmp_path):
+        await builder.build(_make_metadata(5))
+        first_page_mtime = builder.get_page_path(0).stat().st_mtime_ns
+        second_page_mtime = builder.get_page_path(1).stat().st_mtime_ns
+
+        # The cover cache holds a new version of one album's art
+        cover_path = cache_manager.get_cover_art_path("al-album000")
+        cover_path.write_bytes(_jpeg_bytes(tmp_path, (0, 0, 255)))
+        await builder.build(_make_metadata(5))
+        assert builder.get_page_path(0).stat().st_mtime_ns != first_page_mtime
+        assert builder.get_page_path(1).stat().st_mtime_ns == second_page_mtime
+        with Image.open(builder.get_page_path(0)) as page:
+            r, _, b = page.getpixel((32, 32))
+            assert b > 200 and r < 50
+
+    @pytest.mark.anyio
+    async def test_shrinking_library_removes_pages(self, builder):
+        await builder.build(_make_metadata(5))
+        await builder.build(_make_metadata(2))
+        assert not builder.get_page_path(1).exists()
@@ -0,0 +1,142 @@
+from contextlib import asynccontextmanager
+from pathlib import Path
+
+import httpx
+import pytest
+from httpx import ASGITransport, AsyncClient
+
+from subsonic_proxy.app import AppState, create_app
+from subsonic_proxy.cache import encode_version
+from subsonic_proxy.cluster import Cluster, HashRing
+from tests.test_transcoder import _create_fake_hls
+
+NODE_A = "http://node-a:8000"
+NODE_B = "http://node-b:8000"
+
+
+class TestHashRing:
+    def test_owner_is_stable(self):
+        ring = HashRing([NODE_A, NODE_B])
+        keys = [f"song{i:03d}" for i in range(200)]
+        assert [ring.owner(k) for k in keys] == [HashRing([NODE_B, NODE_A]).owner(k) for k in keys]
+        assert {ring.owner(k) for k in keys} == {NODE_A, NODE_B}
+
+    def test_adding_node_moves_only_its_share(self):
+        keys = [f"song{i:04d}" for i in range(2000)]
+        before = HashRing([NODE_A, NODE_B, "http://node-c:8000"])
+        after = HashRing([NODE_A, NODE_B, "http://node-c:8000", "http://node-d:8000"])
+
+        moved = [k for k in keys if before.owner(k) != after.owner(k)]
+        assert all(after.owner(k) == "http://node-d:8000" for k in moved)
+        assert 0.1 < len(moved) / len(keys) < 0.4
+
+
+class TestCluster:
+    def test_base_url_must_be_a_node(self, settings):
+        with pytest.raises(ValueError):
+            Cluster(settings.model_copy(update={"cluster_nodes": [NODE_A, NODE_B]}))
+
+
+def _node_settings(settings, tmp_path, base_url: str, **overrides):
+    return settings.model_copy(
+        update={
+            "base_url": base_url,
+            "cache_dir": str(tmp_path / base_url.removeprefix("http://").replace(":", "_")),
+            "cluster_nodes": [NODE_A, NODE_B],
+            **overrides,
+        }
+    )
+
+
+@asynccontextmanager
+async def _running(app):
+    async with app.router.lifespan_context(app):
+        state: AppState = app.state.svc
+        await state.refresher.current.task
+        yield state
+
+
+def _remote_slot(state: AppState) -> str:
+    """A slot on node A whose track node B owns."""
+    return next(
+        slot_id
+        for slot_id, track in state.metadata.tracks.items()
+        if state.cluster.owner(track.id) == NODE_B
+    )
+
+
+class TestClusterApp:
+    @pytest.mark.anyio
+    async def test_playlist_proxied_from_owner(self, settings, tmp_path, mock_subsonic):
+        app_a = create_app(settings=_node_settings(settings, tmp_path, NODE_A))
+        app_b = create_app(settings=_node_settings(settings, tmp_path, NODE_B))
+
+        async with _running(app_a) as state_a, _running(app_b) as state_b:
+            await state_a.cluster.close()
+            state_a.cluster._http = AsyncClient(transport=ASGITransport(app=app_b))
+            slot_id = _remote_slot(state_a)
+            slot_dir = Path(state_b.settings.cache_dir) / "segments" / slot_id
+            _create_fake_hls(slot_dir)
+            version = encode_version(slot_dir / "index.m3u8")
+
+            transport = ASGITransport(app=app_a)
+            async with AsyncClient(transport=transport, base_url=NODE_A) as client:
+                resp = await client.get(f"/{slot_id}.m3u8")
+                assert resp.status_code == 200
+                assert f"{NODE_B}/segments/{slot_id}/{version}/seg000.ts" in resp.text
+                assert not (Path(state_a.settings.cache_dir) / "segments" / slot_id).exists()
+
+                resp = await client.get(
+                    f"/{slot_id}.m3u8", headers={"If-None-Match": resp.headers["etag"]}
+                )
+                assert resp.status_code == 304
+
+    @pytest.mark.anyio
+    async def test_owner_rejects_mismatched_track(self, settings, tmp_path, mock_subsonic):
+        app_b = create_app(settings=_node_settings(settings, tmp_path, NODE_B))
+        async with _running(app_b):
+            transport = ASGITransport(app=app_b)
+            async with AsyncClient(transport=transport, base_url=NODE_B) as client:
+                resp = await client.get("/0001.m3u8", headers={"X-Cluster-Track-Id": "other"})
+            assert resp.status_code == 409
+
+    @pytest.mark.anyio
+    async def test_redirect_mode(self, settings, tmp_path, mock_subsonic):
+        app_a = create_app(
+            settings=_node_settings(settings, tmp_path, NODE_A, cluster_redirect=True)
+        )
+        async with _running(app_a) as state_a:
+            slot_id = _remote_slot(state_a)
+            transport = ASGITransport(app=app_a)
+            async with AsyncClient(transport=transport, base_url=NODE_A) as client:
+                resp = await client.get(f"/{slot_id}.m3u8")
+            assert resp.status_code == 307
+            assert resp.headers["location"] == f"{NODE_B}/{slot_id}.m3u8"
+
+    @pytest.mark.anyio
+    @pytest.mark.parametrize("failure", ["unreachable", "server_error", "not_found"])
+    async def test_failing_owner_falls_back_to_local(
+        self, settings, tmp_path, mock_subsonic, failure
+    ):
+        app_a = create_app(settings=_node_settings(settings, tmp_path, NODE_A))
+
+        def fail(request):
+            if failure == "unreachable":
+                raise httpx.ConnectError("connection refused", request=request)
+            if failure == "not_found":
+                return httpx.Response(404, json={"detail": "Slot not found"})
+            return httpx.Response(503, text="Subsonic server unavailable")
+
+        async with _running(app_a) as state_a:
+            await state_a.cluster.close()
+            state_a.cluster._http = AsyncClient(transport=httpx.MockTransport(fail))
+            slot_id = _remote_slot(state_a)
+            slot_dir = Path(state_a.settings.cache_dir) / "segments" / slot_id
+            _create_fake_hls(slot_dir)
+            version = encode_version(slot_dir / "index.m3u8")
+
+            transport = ASGITransport(app=app_a)
+            async with AsyncClient(transport=transport, base_url=NODE_A) as client:
+                resp = await client.get(f"/{slot_id}.m3u8")
+            assert resp.status_code == 200
+            assert f"{NODE_A}/segments/{slot_id}/{version}/seg000.ts" in resp.text
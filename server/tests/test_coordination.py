@@ -0,0 +1,149 @@
+import asyncio
+import json
+
+import pytest
+from httpx import ASGITransport, AsyncClient
+
+from subsonic_proxy.app import AppState, apply_snapshot, create_app
+from subsonic_proxy.coordination import REFRESH_JOB, FileSemaphore, WorkerCoordinator
+from subsonic_proxy.snapshot import Manifest
+from subsonic_proxy.store import MetadataStore
+
+
+def _album_list_calls(mock_subsonic) -> int:
+    return sum(
+        1 for call in mock_subsonic.calls if call.request.url.path.endswith("/getAlbumList2.view")
+    )
+
+
+class TestFileSemaphore:
+    @pytest.mark.anyio
+    async def test_permits_shared_between_instances(self, tmp_path):
+        # Separate instances open separate lock file descriptors, like separate workers
+        first = FileSemaphore(tmp_path, "transcode", 1, poll_interval=0.01)
+        second = FileSemaphore(tmp_path, "transcode", 1, poll_interval=0.01)
+
+        async with first:
+            with pytest.raises(TimeoutError):
+                async with asyncio.timeout(0.2):
+                    await second.__aenter__()
+        async with asyncio.timeout(1):
+            async with second:
+                pass
+
+    @pytest.mark.anyio
+    async def test_concurrent_holders_within_limit(self, tmp_path):
+        semaphore = FileSemaphore(tmp_path, "transcode", 2, poll_interval=0.01)
+        active = 0
+        peak = 0
+
+        async def work():
+            nonlocal active, peak
+            async with semaphore:
+                active += 1
+                peak = max(peak, active)
+                await asyncio.sleep(0.05)
+                active -= 1
+
+        await asyncio.gather(*(work() for _ in range(6)))
+        assert peak == 2
+
+
+class TestWorkerCoordinator:
+    def test_single_leader(self, settings, tmp_path):
+        store = MetadataStore(tmp_path / "metadata.db")
+        first = WorkerCoordinator(settings, store)
+        second = WorkerCoordinator(settings, store)
+
+        assert first.try_become_leader()
+        assert not second.try_become_leader()
+        first.release()
+        assert second.try_become_leader()
+        second.release()
+        store.close()
+
+    def test_new_leader_fails_orphaned_job(self, settings, tmp_path):
+        store = MetadataStore(tmp_path / "metadata.db")
+        store.set_cursor(REFRESH_JOB, json.dumps({"id": "abc", "state": "running"}))
+        coordinator = WorkerCoordinator(settings, store)
+
+        assert coordinator.try_become_leader()
+        published = coordinator.published_job()
+        assert published["state"] == "failed"
+        assert published["error"] == "Leader worker exited"
+        coordinator.release()
+        store.close()
+
+
+class TestMultiWorkerApp:
+    @pytest.mark.anyio
+    async def test_leader_builds_and_follower_reloads(self, settings, tmp_path, mock_subsonic):
+        settings = settings.model_copy(
+            update={
+                "multi_worker": True,
+                "worker_sync_interval_seconds": 0.05,
+                "hot_cache_dir": str(tmp_path / "hot"),
+            }
+        )
+        leader_app = create_app(settings=settings)
+        follower_app = create_app(settings=settings)
+
+        async with (
+            leader_app.router.lifespan_context(leader_app),
+            follower_app.router.lifespan_context(follower_app),
+        ):
+            leader: AppState = leader_app.state.svc
+            follower: AppState = follower_app.state.svc
+            assert leader.coordinator.is_leader
+            assert not follower.coordinator.is_leader
+            assert leader.cache.hot_dir is None
+            assert follower.refresher.current is None
+
+            await leader.refresher.current.task
+            async with asyncio.timeout(2):
+                while not follower.metadata.tracks:
+                    await asyncio.sleep(0.01)
+            assert follower.metadata == leader.metadata
+            assert _album_list_calls(mock_subsonic) == 2  # One crawl: first page, then end
+
+            # A refresh requested on the follower runs on the leader
+            transport = ASGITransport(app=follower_app)
+            async with AsyncClient(transport=transport, base_url="http://test") as client:
+                resp = await client.post("/refresh")
+            assert resp.status_code == 202
+            assert resp.json()["state"] == "requested"
+            job_id = resp.json()["id"]
+            assert resp.headers["location"] == f"/refresh/{job_id}"
+            first_job = leader.refresher.current
+            async with asyncio.timeout(2):
+                while leader.refresher.current is first_job:
+                    await asyncio.sleep(0.01)
+            assert leader.refresher.current.id == job_id
+            await leader.refresher.current.task
+            assert follower.refresher.current is None
+
+            transport = ASGITransport(app=follower_app)
+            async with AsyncClient(transport=transport, base_url="http://test") as client:
+                resp = await client.get(f"/refresh/{job_id}")
+            assert resp.json()["state"] == "done"
+
+            # A snapshot imported through the follower leaves atlas work to the leader
+            await apply_snapshot(follower, Manifest(created_at=0), [])
+            assert follower.metadata == leader.metadata
+            assert follower.atlas_task is None
+
+            # The leader picks up metadata imported through a follower, atlas included
+            store = follower.metadata_builder.store
+            store.set_slots([song["id"] for _, song in reversed(store.slot_songs())])
+            await apply_snapshot(follower, Manifest(created_at=0), [])
+            atlas_task = leader.atlas_task
+            async with asyncio.timeout(2):
+                while leader.metadata != follower.metadata:
+                    await asyncio.sleep(0.01)
+            assert leader.atlas_task is not atlas_task
+
+            # Each worker would have its own radio queue
+            assert follower.radio is None
+            async with AsyncClient(transport=transport, base_url="http://test") as client:
+                resp = await client.get("/radio/queue/0001")
+            assert resp.status_code == 404
@@ -0,0 +1,15 @@
+import pytest
+
+from benchmarks.herd import run_herd
+
+
+@pytest.mark.anyio
+async def test_instance_herd_transcodes_each_slot_once(tmp_path):
+    """A whole instance pressing play at once must cost one ffmpeg run per slot."""
+    report = await run_herd(
+        clients=80, slot_ids=("0001", "0002"), ffmpeg_seconds=0.5, work_dir=tmp_path
+    )
+
+    assert report["ffmpeg_launches"] == {"0001": 1, "0002": 1}
+    assert report["playlist_latency"]["count"] == 80
+    assert report["segment_latency"]["count"] == 80 * 3
@@ -74,16 +74,6 @@ class TestRealSubsonicClient:
         assert "stream.view" in url
         assert f"id={song_id}" in url
 
-    @pytest.mark.anyio
-    async def test_get_all_tracks(self, real_settings):
-        async with SubsonicClient(real_settings) as client:
-            tracks = await client.get_all_tracks(max_count=10)
-        assert len(tracks) > 0
-        assert len(tracks) <= 10
-        for track in tracks:
-            assert "id" in track
-            assert "title" in track
-
 
 class TestRealMetadataBuilder:
     @pytest.mark.anyio
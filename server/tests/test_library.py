@@ -0,0 +1,39 @@
+import pytest
+
+from subsonic_proxy.library import LocalLibrary
+
+
+@pytest.fixture
+def library(tmp_path):
+    song = tmp_path / "music" / "Pendulum" / "Immersion" / "01 - Watercolour.mp3"
+    song.parent.mkdir(parents=True)
+    song.write_bytes(b"mp3")
+    (tmp_path / "secret.txt").write_text("secret")
+    return LocalLibrary(tmp_path / "music")
+
+
+class TestLocalLibrary:
+    def test_relative_path_mapped_onto_root(self, library):
+        path = library.resolve("Pendulum/Immersion/01 - Watercolour.mp3")
+        assert path == library.root / "Pendulum" / "Immersion" / "01 - Watercolour.mp3"
+
+    def test_absolute_path_inside_root(self, library):
+        absolute = str(library.root / "Pendulum" / "Immersion" / "01 - Watercolour.mp3")
+        assert library.resolve(absolute) is not None
+
+    def test_absolute_server_path_mapped_onto_root(self, library):
+        library = LocalLibrary(library.root, server_root="/music")
+        path = library.resolve("/music/Pendulum/Immersion/01 - Watercolour.mp3")
+        assert path == library.root / "Pendulum" / "Immersion" / "01 - Watercolour.mp3"
+        assert library.resolve("/music/../etc/passwd") is None
+
+    def test_unreadable_or_missing_file_falls_back(self, library):
+        assert library.resolve(None) is None
+        assert library.resolve("Pendulum/Immersion/02 - Immunize.mp3") is None
+        assert library.resolve("Pendulum/Immersion") is None
+
+    def test_paths_outside_root_refused(self, library, tmp_path):
+        assert library.resolve("../secret.txt") is None
+        assert library.resolve(str(tmp_path / "secret.txt")) is None
+        (library.root / "escape").symlink_to(tmp_path / "secret.txt")
+        assert library.resolve("escape") is None
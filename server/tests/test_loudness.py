@@ -0,0 +1,155 @@
+import pytest
+
+from subsonic_proxy.app import AppState, create_app
+from subsonic_proxy.loudness import (
+    AnalysisError,
+    LoudnessAnalyzer,
+    from_replaygain,
+    parse_loudnorm,
+)
+from subsonic_proxy.store import MetadataStore
+from subsonic_proxy.subsonic import SubsonicClient
+
+LOUDNORM_OUTPUT = """\
+size=N/A time=00:04:24.00 bitrate=N/A speed= 412x
+[Parsed_loudnorm_0 @ 0x55d0c8a3c0c0]
+{
+	"input_i" : "-9.87",
+	"input_tp" : "0.42",
+	"input_lra" : "5.10",
+	"input_thresh" : "-19.95",
+	"output_i" : "-16.02",
+	"output_tp" : "-1.50",
+	"output_lra" : "4.60",
+	"output_thresh" : "-26.03",
+	"normalization_type" : "dynamic",
+	"target_offset" : "0.02"
+}
+"""
+
+
+def _song(song_id: str, **fields) -> dict:
+    return {"id": song_id, "path": None, "replay_gain": None, "replay_peak": None, **fields}
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = MetadataStore(tmp_path / "metadata.db")
+    yield store
+    store.close()
+
+
+@pytest.fixture
+async def analyzer(settings, store, fake_ffmpeg, mock_subsonic):
+    settings = settings.model_copy(update={"ffmpeg_path": fake_ffmpeg, "loudness_workers": 2})
+    async with SubsonicClient(settings) as subsonic:
+        yield LoudnessAnalyzer(settings, store, subsonic)
+
+
+class TestParsing:
+    def test_parse_loudnorm_summary(self):
+        loudness = parse_loudnorm(LOUDNORM_OUTPUT)
+        assert loudness.integrated == -9.87
+        assert loudness.true_peak == 0.42
+        assert loudness.lra == 5.1
+        assert loudness.source == "analysis"
+
+    def test_missing_summary_rejected(self):
+        with pytest.raises(AnalysisError):
+            parse_loudnorm("Error opening input\n")
+
+    def test_replaygain(self):
+        loudness = from_replaygain(-6.5, 0.5)
+        assert loudness.integrated == pytest.approx(-11.5)
+        assert loudness.true_peak == pytest.approx(-6.02, abs=0.01)
+        assert from_replaygain(None, 0.9) is None
+
+
+class TestLoudnessAnalyzer:
+    def test_gain_towards_target_capped_by_peak(self, analyzer, store):
+        assert analyzer.gain_db("song001") is None
+
+        store.put_loudness("song001", -22.0, 6.0, -12.0, "analysis")
+        assert analyzer.gain_db("song001") == pytest.approx(6.0)
+
+        # Quiet but peaky: only raised until the peak reaches the ceiling
+        store.put_loudness("song002", -22.0, 6.0, -3.0, "analysis")
+        assert analyzer.gain_db("song002") == pytest.approx(1.5)
+
+        store.put_loudness("song003", -9.0, 6.0, 0.5, "analysis")
+        assert analyzer.gain_db("song003") == pytest.approx(-7.0)
+
+        store.put_loudness("song004", float("-inf"), 0.0, float("-inf"), "analysis")
+        assert analyzer.gain_db("song004") is None
+
+    @pytest.mark.anyio
+    async def test_batch_measures_each_song_once(self, analyzer, store, monkeypatch):
+        monkeypatch.setenv("FAKE_FFMPEG_LOUDNESS", "-21.5")
+        songs = [
+            _song("song001"),
+            _song("song002", replay_gain=-4.0, replay_peak=1.0),
+            _song("song001"),
+        ]
+
+        assert await analyzer.run(songs) == 2
+        assert store.loudness("song001")["integrated"] == -21.5
+        assert store.loudness("song001")["source"] == "analysis"
+        assert store.loudness("song002") == {
+            "integrated": -14.0,
+            "lra": None,
+            "true_peak": 0.0,
+            "source": "replaygain",
+        }
+
+        assert await analyzer.run(songs) == 0
+
+    @pytest.mark.anyio
+    async def test_failed_analysis_retried_after_backoff(self, analyzer, store, monkeypatch):
+        monkeypatch.setenv("FAKE_FFMPEG_EXIT", "1")
+        assert await analyzer.run([_song("song001")]) == 0
+        assert store.loudness("song001") is None
+
+        monkeypatch.delenv("FAKE_FFMPEG_EXIT")
+        assert await analyzer.run([_song("song001")]) == 0
+
+        analyzer._retry_seconds = 0
+        assert await analyzer.run([_song("song001")]) == 1
+        assert store.loudness_failed_song_ids(since=0) == set()
+
+    @pytest.mark.anyio
+    @pytest.mark.parametrize("ffmpeg_input", ["url", "pipe"])
+    async def test_reads_subsonic_like_transcodes(
+        self, analyzer, tmp_path, monkeypatch, ffmpeg_input
+    ):
+        input_log = tmp_path / "input.log"
+        monkeypatch.setenv("FAKE_FFMPEG_INPUT_LOG", str(input_log))
+        analyzer._ffmpeg_input = ffmpeg_input
+
+        await analyzer.measure(_song("song001"))
+        audio_input = input_log.read_bytes().split(b"\n", 1)[0].decode()
+        if ffmpeg_input == "pipe":
+            assert audio_input == "pipe:0"
+        else:
+            assert "/rest/stream.view" in audio_input
+            assert "id=song001" in audio_input
+
+
+class TestLoudnessApp:
+    @pytest.mark.anyio
+    async def test_new_songs_measured_after_build(self, settings, fake_ffmpeg, mock_subsonic):
+        app = create_app(
+            settings=settings.model_copy(
+                update={"ffmpeg_path": fake_ffmpeg, "loudness_normalization": True}
+            )
+        )
+        async with app.router.lifespan_context(app):
+            state: AppState = app.state.svc
+            await state.refresher.current.task
+            await state.loudness_task
+
+            store = state.metadata_builder.store
+            assert store.measured_song_ids() == {
+                track.id for track in state.metadata.tracks.values()
+            }
+            # Fake ffmpeg measures -20 LUFS with peaks at -3 dBTP: capped by the ceiling
+            assert state.loudness.gain_db("song001") == pytest.approx(1.5)
@@ -0,0 +1,175 @@
+import copy
+import json
+import sqlite3
+import time
+from pathlib import Path
+
+import pytest
+from httpx import Response
+
+from subsonic_proxy.metadata import MetadataBuilder
+from subsonic_proxy.store import MetadataStore
+from subsonic_proxy.subsonic import SubsonicClient
+from tests.conftest import ALBUM_LIST_EMPTY_RESPONSE, ALBUM_LIST_RESPONSE
+
+
+def _album_fetches(mock_subsonic) -> list[str]:
+    return [
+        call.request.url.params["id"]
+        for call in mock_subsonic.calls
+        if call.request.url.path.endswith("/getAlbum.view")
+    ]
+
+
+def _serve_album_list(mock_subsonic, albums: list[dict]):
+    response = copy.deepcopy(ALBUM_LIST_RESPONSE)
+    response["subsonic-response"]["albumList2"]["album"] = albums
+
+    def handler(request):
+        if int(request.url.params.get("offset", "0")) > 0:
+            return Response(200, json=ALBUM_LIST_EMPTY_RESPONSE)
+        return Response(200, json=response)
+
+    mock_subsonic.get("/rest/getAlbumList2.view").mock(side_effect=handler)
+
+
+@pytest.fixture
+async def builder(settings, mock_subsonic):
+    async with SubsonicClient(settings) as subsonic:
+        metadata_builder = MetadataBuilder(settings=settings, subsonic=subsonic)
+        yield metadata_builder
+        metadata_builder.close()
+
+
+class TestMetadataStore:
+    @pytest.mark.anyio
+    async def test_build_persists_slots(self, builder, settings):
+        metadata = await builder.build(force_refresh=True)
+
+        assert len(metadata.tracks) == 7
+        assert (Path(settings.cache_dir) / "metadata.db").exists()
+        assert builder.store.slot_song("0001")["id"] == metadata.tracks["0001"].id
+        assert builder.store.slot_song("0999") is None
+
+    @pytest.mark.anyio
+    async def test_song_paths_stored_but_not_published(self, builder):
+        metadata = await builder.build(force_refresh=True)
+
+        song = builder.store.slot_song("0001")
+        assert song["path"] == "Pendulum/Immersion/01 - Watercolour.mp3"
+        assert "path" not in metadata.tracks["0001"].model_dump()
+
+    def test_old_database_gains_path_column(self, tmp_path):
+        db_path = tmp_path / "metadata.db"
+        old = sqlite3.connect(db_path)
+        old.executescript(
+            "CREATE TABLE albums (id TEXT PRIMARY KEY, name TEXT NOT NULL, "
+            "artist TEXT NOT NULL, sync_key TEXT);"
+            "CREATE TABLE songs (id TEXT PRIMARY KEY, album_id TEXT NOT NULL, "
+            "position INTEGER NOT NULL, title TEXT NOT NULL, artist TEXT NOT NULL, "
+            "album TEXT NOT NULL, duration INTEGER NOT NULL, cover_art TEXT);"
+            "INSERT INTO albums VALUES ('album001', 'Immersion', 'Pendulum', 'key');"
+        )
+        old.close()
+
+        store = MetadataStore(db_path)
+        assert store.album_sync_keys() == {"album001": ""}
+        store.put_album({"id": "album001"}, [{"id": "song001", "path": "a/b.mp3"}])
+        assert store.album_songs("album001")[0]["path"] == "a/b.mp3"
+        store.close()
+
+    @pytest.mark.anyio
+    async def test_reload_matches_build(self, builder):
+        built = await builder.build(force_refresh=True)
+        loaded, fresh = builder.load_cached()
+
+        assert fresh
+        assert loaded == built
+
+    @pytest.mark.anyio
+    async def test_refresh_skips_unchanged_albums(self, builder, mock_subsonic):
+        await builder.build(force_refresh=True)
+        assert len(_album_fetches(mock_subsonic)) == 3
+
+        metadata = await builder.build(force_refresh=True)
+        assert len(_album_fetches(mock_subsonic)) == 3
+        assert len(metadata.tracks) == 7
+
+    @pytest.mark.anyio
+    async def test_refresh_refetches_changed_album(self, builder, mock_subsonic):
+        await builder.build(force_refresh=True)
+        albums = copy.deepcopy(ALBUM_LIST_RESPONSE["subsonic-response"]["albumList2"]["album"])
+        albums[1]["songCount"] += 1
+        _serve_album_list(mock_subsonic, albums)
+
+        await builder.build(force_refresh=True)
+        assert _album_fetches(mock_subsonic)[3:] == [albums[1]["id"]]
+
+    @pytest.mark.anyio
+    async def test_removed_album_pruned(self, builder, mock_subsonic):
+        await builder.build(force_refresh=True)
+        albums = ALBUM_LIST_RESPONSE["subsonic-response"]["albumList2"]["album"]
+        _serve_album_list(mock_subsonic, albums[1:])
+
+        metadata = await builder.build(force_refresh=True)
+        assert albums[0]["id"] not in metadata.albums
+        assert albums[0]["id"] not in builder.store.album_sync_keys()
+        assert builder.store.album_songs(albums[0]["id"]) == []
+
+    @pytest.mark.anyio
+    async def test_refetch_ignores_sync_keys(self, builder, mock_subsonic):
+        await builder.build(force_refresh=True)
+        await builder.build(force_refresh=True, refetch=True)
+        assert len(_album_fetches(mock_subsonic)) == 6
+
+    @pytest.mark.anyio
+    async def test_capped_crawl_prunes_only_when_sweeping(self, settings, mock_subsonic):
+        albums = ALBUM_LIST_RESPONSE["subsonic-response"]["albumList2"]["album"]
+        async with SubsonicClient(settings) as subsonic:
+            builder = MetadataBuilder(settings=settings, subsonic=subsonic)
+            await builder.build(force_refresh=True)
+            builder.close()
+
+            # Capped at the first album, which never reaches the end of the list
+            capped = settings.model_copy(update={"slot_count": 1})
+            builder = MetadataBuilder(settings=capped, subsonic=subsonic)
+            _serve_album_list(mock_subsonic, albums[:-1])
+            await builder.build(force_refresh=True)
+            assert albums[-1]["id"] in builder.store.album_sync_keys()
+
+            await builder.build(force_refresh=True, refetch=True)
+            assert albums[-1]["id"] not in builder.store.album_sync_keys()
+            assert albums[0]["id"] in builder.store.album_sync_keys()
+            builder.close()
+
+    @pytest.mark.anyio
+    async def test_expired_store_not_fresh(self, builder, settings):
+        await builder.build(force_refresh=True)
+        builder.store.set_cursor("built_at", repr(time.time() - settings.cache_ttl_seconds - 1))
+
+        cached, fresh = builder.load_cached()
+        assert cached is not None
+        assert not fresh
+
+    @pytest.mark.anyio
+    async def test_migrates_legacy_json(self, builder, settings, mock_subsonic):
+        built = await builder.build(force_refresh=True)
+        builder.close()
+        db_path = Path(settings.cache_dir) / "metadata.db"
+        db_path.unlink()
+        legacy_path = Path(settings.cache_dir) / "metadata.json"
+        legacy_path.write_text(built.model_dump_json(indent=2))
+
+        async with SubsonicClient(settings) as subsonic:
+            migrated = MetadataBuilder(settings=settings, subsonic=subsonic)
+            loaded, fresh = migrated.load_cached()
+            assert fresh
+            assert loaded == built
+            assert not legacy_path.exists()
+            assert json.loads(legacy_path.with_suffix(".json.migrated").read_text())
+
+            # Migrated albums have no sync key, so the next refresh refetches them
+            fetches = len(_album_fetches(mock_subsonic))
+            await migrated.build(force_refresh=True)
+            assert len(_album_fetches(mock_subsonic)) == fetches + 3
+            migrated.close()
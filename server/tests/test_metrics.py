@@ -0,0 +1,54 @@
+from subsonic_proxy.metrics import REGISTRY, Counter, Gauge, Histogram, render
+from subsonic_proxy.transcoder import _parse_benchmark_cpu
+
+
+class TestMetrics:
+    def test_counter_with_labels(self):
+        counter = Counter("test_counter_total", "A test counter", ("kind",))
+        counter.labels("a").inc()
+        counter.labels("a").inc(2)
+        counter.labels("b").inc()
+
+        lines = counter.render()
+        assert "# TYPE test_counter_total counter" in lines
+        assert 'test_counter_total{kind="a"} 3' in lines
+        assert 'test_counter_total{kind="b"} 1' in lines
+        REGISTRY.remove(counter)
+
+    def test_gauge(self):
+        gauge = Gauge("test_gauge", "A test gauge")
+        gauge.inc()
+        gauge.inc()
+        gauge.dec()
+        assert "test_gauge 1" in gauge.render()
+        REGISTRY.remove(gauge)
+
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = Histogram("test_seconds", "A test histogram", buckets=(0.1, 1.0))
+        histogram.observe(0.05)
+        histogram.observe(0.5)
+        histogram.observe(5.0)
+
+        lines = histogram.render()
+        assert 'test_seconds_bucket{le="0.1"} 1' in lines
+        assert 'test_seconds_bucket{le="1"} 2' in lines
+        assert 'test_seconds_bucket{le="+Inf"} 3' in lines
+        assert "test_seconds_sum 5.55" in lines
+        assert "test_seconds_count 3" in lines
+        REGISTRY.remove(histogram)
+
+    def test_label_values_escaped(self):
+        counter = Counter("test_escape_total", "Escaping", ("path",))
+        counter.labels('a"b').inc()
+        assert 'test_escape_total{path="a\\"b"} 1' in counter.render()
+        REGISTRY.remove(counter)
+
+    def test_render_includes_builtin_metrics(self):
+        text = render()
+        assert "# TYPE subsonic_proxy_transcodes_in_flight gauge" in text
+        assert text.endswith("\n")
+
+    def test_parse_ffmpeg_benchmark_line(self):
+        stderr = "frame=  100 fps=0.0\nbench: utime=1.250s stime=0.250s rtime=3.000s\n"
+        assert _parse_benchmark_cpu(stderr) == 1.5
+        assert _parse_benchmark_cpu("no summary") is None
@@ -0,0 +1,56 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from subsonic_proxy.profiling import LoopMonitor, StackSampler
+
+
+def _busy_wait(seconds: float):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+class TestStackSampler:
+    def test_samples_folded_stacks(self):
+        sampler = StackSampler(threading.get_ident(), interval=0.001)
+        sampler.start()
+        _busy_wait(0.2)
+        sampler.stop()
+
+        folded = sampler.to_folded()
+        assert folded
+        line = folded.splitlines()[0]
+        stack, count = line.rsplit(" ", 1)
+        assert int(count) > 0
+        assert "_busy_wait (test_profiling.py)" in stack.split(";")
+
+
+class TestLoopMonitor:
+    @pytest.mark.anyio
+    async def test_reports_blocking_call(self):
+        monitor = LoopMonitor(threshold=0.05)
+        monitor.start()
+        try:
+            await asyncio.sleep(0.1)
+            _busy_wait(0.3)  # Deliberately block the loop
+            await asyncio.sleep(0.05)
+        finally:
+            monitor.stop()
+
+        assert len(monitor.reports) == 1
+        report = monitor.reports[0]
+        assert report["blocked_seconds"] >= 0.05
+        assert "_busy_wait(0.3)" in report["stack"]
+
+    @pytest.mark.anyio
+    async def test_quiet_loop_not_reported(self):
+        monitor = LoopMonitor(threshold=0.1)
+        monitor.start()
+        try:
+            await asyncio.sleep(0.3)
+        finally:
+            monitor.stop()
+        assert not monitor.reports
@@ -0,0 +1,225 @@
+import asyncio
+from pathlib import Path
+from unittest.mock import AsyncMock
+
+import pytest
+from httpx import ASGITransport, AsyncClient
+
+from subsonic_proxy.app import AppState, create_app
+from subsonic_proxy.cache import encode_version
+from subsonic_proxy.radio import RadioChannel, parse_media_playlist
+from subsonic_proxy.transcoder import TranscodeError
+from tests.test_transcoder import _create_fake_hls, _create_fake_ladder
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture
+def slots(tmp_path) -> dict[str, Path]:
+    """Cached transcodes of three 24.5 second tracks."""
+    paths = {}
+    for slot_id in ("0001", "0002", "0003"):
+        _create_fake_hls(tmp_path / slot_id)
+        paths[slot_id] = tmp_path / slot_id / "index.m3u8"
+    return paths
+
+
+def _uri(slot_id: str, m3u8_path: Path, name: str) -> str:
+    return f"{slot_id}/{encode_version(m3u8_path)}/{name}"
+
+
+def _channel(slots, clock, **kwargs) -> tuple[RadioChannel, AsyncMock]:
+    prepare = AsyncMock(side_effect=lambda slot_id: slots[slot_id])
+    return RadioChannel(prepare, segment_duration=10, clock=clock, **kwargs), prepare
+
+
+async def _settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+class TestPlaylist:
+    def test_parse_media_playlist(self, tmp_path):
+        _create_fake_hls(tmp_path)
+        version, segments = parse_media_playlist((tmp_path / "index.m3u8").read_text())
+        assert version == 3
+        assert segments == [
+            (10.0, "seg000.ts", [], None),
+            (10.0, "seg001.ts", [], None),
+            (4.5, "seg002.ts", [], None),
+        ]
+
+    def test_tracks_stitched_with_discontinuity(self, slots, clock):
+        channel, _ = _channel(slots, clock, window_segments=2)
+        channel._schedule("0001", slots["0001"])
+        channel._schedule("0002", slots["0002"])
+
+        assert channel.playlist().splitlines()[-2:] == [
+            "#EXTINF:10.000,",
+            _uri("0001", slots["0001"], "seg000.ts"),
+        ]
+
+        clock.now = 25.0
+        lines = channel.playlist().splitlines()
+        assert "#EXT-X-MEDIA-SEQUENCE:2" in lines
+        assert lines[-5:] == [
+            "#EXTINF:4.500,",
+            _uri("0001", slots["0001"], "seg002.ts"),
+            "#EXT-X-DISCONTINUITY",
+            "#EXTINF:10.000,",
+            _uri("0002", slots["0002"], "seg000.ts"),
+        ]
+        assert channel.now_playing() == "0002"
+
+        # The discontinuity slid out of the window
+        clock.now = 45.0
+        lines = channel.playlist().splitlines()
+        assert "#EXT-X-MEDIA-SEQUENCE:4" in lines
+        assert "#EXT-X-DISCONTINUITY-SEQUENCE:1" in lines
+        assert "#EXT-X-DISCONTINUITY" not in lines
+
+    def test_ladder_uses_first_variant(self, tmp_path, clock):
+        _create_fake_ladder(tmp_path / "0001")
+        channel, _ = _channel({}, clock)
+        channel._schedule("0001", tmp_path / "0001" / "index.m3u8")
+
+        m3u8_path = tmp_path / "0001" / "index.m3u8"
+        assert channel.playlist().splitlines()[-1] == _uri("0001", m3u8_path, "seg_0_000.ts")
+
+
+class TestQueue:
+    @pytest.mark.anyio
+    async def test_next_track_prepared_ahead_and_played_back_to_back(self, slots, clock):
+        channel, prepare = _channel(slots, clock)
+        task = asyncio.create_task(channel.run())
+        try:
+            for slot_id in ("0001", "0002", "0003"):
+                channel.enqueue(slot_id)
+            await _settle()
+
+            assert channel.now_playing() == "0001"
+            assert list(channel.queue) == ["0002", "0003"]
+            # Both upcoming tracks are transcoding while the first one plays
+            assert [call.args[0] for call in prepare.call_args_list] == ["0001", "0002", "0003"]
+
+            # One segment before the end, the next track is lined up without a gap
+            clock.now = 15.0
+            channel._wakeup.set()
+            await _settle()
+            assert list(channel.queue) == ["0003"]
+            assert channel._segments[3].uri == _uri("0002", slots["0002"], "seg000.ts")
+            assert channel._segments[3].start == 24.5
+        finally:
+            task.cancel()
+
+    @pytest.mark.anyio
+    async def test_play_next_and_skip(self, slots, clock):
+        channel, _ = _channel(slots, clock)
+        task = asyncio.create_task(channel.run())
+        try:
+            channel.enqueue("0001")
+            channel.enqueue("0002")
+            await _settle()
+            channel.enqueue("0003", play_next=True)
+            assert list(channel.queue) == ["0003", "0002"]
+
+            clock.now = 5.0
+            channel.skip()
+            await _settle()
+            # Cut after the segment now airing, straight into the next track
+            assert [s.uri for s in channel._segments][:2] == [
+                _uri("0001", slots["0001"], "seg000.ts"),
+                _uri("0003", slots["0003"], "seg000.ts"),
+            ]
+            assert channel._segments[1].start == 10.0
+            assert list(channel.queue) == ["0002"]
+
+            channel.clear()
+            assert channel.to_dict() == {"now_playing": "0001", "queue": []}
+        finally:
+            task.cancel()
+
+    @pytest.mark.anyio
+    async def test_failed_track_skipped(self, slots, clock):
+        async def prepare(slot_id):
+            if slot_id == "0001":
+                raise TranscodeError("ffmpeg failed")
+            return slots[slot_id]
+
+        channel = RadioChannel(prepare, segment_duration=10, clock=clock)
+        task = asyncio.create_task(channel.run())
+        try:
+            channel.enqueue("0001")
+            channel.enqueue("0002")
+            await _settle()
+            assert channel.now_playing() == "0002"
+            assert list(channel.queue) == []
+        finally:
+            task.cancel()
+
+    @pytest.mark.anyio
+    async def test_hung_track_skipped_after_timeout(self, slots, clock):
+        hung = asyncio.Event()
+
+        async def prepare(slot_id):
+            if slot_id == "0001":
+                await hung.wait()
+            return slots[slot_id]
+
+        channel = RadioChannel(prepare, segment_duration=10, prepare_timeout=0.1, clock=clock)
+        task = asyncio.create_task(channel.run())
+        try:
+            channel.enqueue("0001")
+            channel.enqueue("0002")
+            await _settle()
+            assert channel.now_playing() is None
+            async with asyncio.timeout(2):
+                while channel.now_playing() != "0002":
+                    await asyncio.sleep(0.01)
+            assert list(channel.queue) == []
+        finally:
+            task.cancel()
+
+    def test_queue_limit(self, slots, clock):
+        channel, _ = _channel(slots, clock, max_queue=1)
+        assert channel.enqueue("0001")
+        assert not channel.enqueue("0002")
+
+
+class TestRadioEndpoints:
+    @pytest.mark.anyio
+    async def test_queue_and_listen(self, settings, mock_subsonic):
+        app = create_app(settings=settings)
+        async with app.router.lifespan_context(app):
+            state: AppState = app.state.svc
+            await state.refresher.current.task
+            slot_dir = Path(settings.cache_dir) / "segments" / "0001"
+            _create_fake_hls(slot_dir)
+            version = encode_version(slot_dir / "index.m3u8")
+            transport = ASGITransport(app=app)
+            async with AsyncClient(transport=transport, base_url="http://test") as client:
+                resp = await client.get("/radio/queue/0001")
+                assert resp.status_code == 200
+                assert (await client.get("/radio/queue/9999")).status_code == 404
+
+                for _ in range(100):
+                    if (await client.get("/radio.json")).json()["now_playing"] == "0001":
+                        break
+                    await asyncio.sleep(0.01)
+
+                resp = await client.get("/radio.m3u8")
+                assert resp.status_code == 200
+                assert resp.headers["cache-control"] == "no-cache"
+                assert f"{settings.base_url}/segments/0001/{version}/seg000.ts" in resp.text
+                assert "#EXT-X-ENDLIST" not in resp.text
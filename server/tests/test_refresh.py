@@ -0,0 +1,100 @@
+import asyncio
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+
+from subsonic_proxy.refresh import RefreshManager
+
+
+def _builder(side_effect):
+    builder = MagicMock()
+    builder.build = AsyncMock(side_effect=side_effect)
+    return builder
+
+
+class TestRefreshManager:
+    @pytest.mark.anyio
+    async def test_successful_job_applies_metadata(self):
+        metadata = MagicMock(tracks={"0001": None, "0002": None})
+        applied = []
+        manager = RefreshManager(_builder([metadata]), on_complete=applied.append)
+
+        job, started = manager.start()
+        assert started
+        await job.task
+
+        assert job.state == "done"
+        assert job.track_count == 2
+        assert job.finished_at is not None
+        assert applied == [metadata]
+        manager._builder.build.assert_awaited_once()
+        assert manager._builder.build.await_args.kwargs["force_refresh"] is True
+        assert manager._builder.build.await_args.kwargs["refetch"] is True
+
+    @pytest.mark.anyio
+    async def test_failed_job_keeps_current_metadata(self):
+        applied = []
+        manager = RefreshManager(
+            _builder(RuntimeError("Subsonic down")), on_complete=applied.append
+        )
+
+        job, _ = manager.start()
+        await job.task
+
+        assert job.state == "failed"
+        assert job.error == "Subsonic down"
+        assert applied == []
+
+    @pytest.mark.anyio
+    async def test_new_job_after_previous_finished(self):
+        manager = RefreshManager(_builder(lambda **kw: MagicMock(tracks={})), lambda m: None)
+        first, _ = manager.start()
+        await first.task
+        second, started = manager.start()
+        await second.task
+
+        assert started
+        assert second.id != first.id
+        assert list(manager.jobs) == [first.id, second.id]
+
+    @pytest.mark.anyio
+    async def test_requested_job_id_adopted_or_joined(self):
+        release = asyncio.Event()
+
+        async def build(**kw):
+            await release.wait()
+            return MagicMock(tracks={})
+
+        manager = RefreshManager(_builder(build), lambda m: None)
+        job, started = manager.start(job_id="fromfollower")
+        assert started
+        assert job.id == "fromfollower"
+
+        joined, started = manager.start(job_id="latecomer")
+        assert not started
+        assert joined is job
+        assert job.joined_ids == ["latecomer"]
+        assert manager.get("latecomer") is job
+
+        release.set()
+        await job.task
+
+    @pytest.mark.anyio
+    async def test_history_is_bounded(self):
+        manager = RefreshManager(
+            _builder(lambda **kw: MagicMock(tracks={})), lambda m: None, history_size=2
+        )
+        for _ in range(3):
+            job, _ = manager.start()
+            await job.task
+        assert len(manager.jobs) == 2
+
+    @pytest.mark.anyio
+    async def test_periodic_refresh(self):
+        manager = RefreshManager(_builder(lambda **kw: MagicMock(tracks={})), lambda m: None)
+        task = asyncio.create_task(manager.run_periodic(0.05))
+        await asyncio.sleep(0.18)
+        task.cancel()
+
+        assert len(manager.jobs) >= 2
+        assert all(job.trigger == "scheduled" for job in manager.jobs.values())
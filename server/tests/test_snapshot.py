@@ -0,0 +1,262 @@
+import asyncio
+import contextlib
+import io
+import os
+import tarfile
+import threading
+import time
+from pathlib import Path
+
+import pytest
+from filelock import FileLock
+from httpx import ASGITransport, AsyncClient
+
+from subsonic_proxy.app import AppState, _ChunkPipe, _stream_from_thread, create_app
+from subsonic_proxy.cache import encode_version
+from subsonic_proxy.metadata import MetadataBuilder
+from subsonic_proxy.snapshot import (
+    Manifest,
+    SnapshotError,
+    _add_file,
+    install_snapshot,
+    read_snapshot,
+    write_snapshot,
+)
+from subsonic_proxy.store import MetadataStore
+from subsonic_proxy.subsonic import SubsonicClient
+from tests.test_transcoder import _create_fake_hls, _create_fake_ladder
+
+TTL = 3600
+
+
+@pytest.fixture
+async def source_cache(settings, mock_subsonic) -> Path:
+    """A cache dir with built metadata, two transcodes, a cover and an audio file."""
+    async with SubsonicClient(settings) as subsonic:
+        builder = MetadataBuilder(settings=settings, subsonic=subsonic)
+        await builder.build()
+        builder.close()
+    cache_dir = Path(settings.cache_dir)
+    _create_fake_hls(cache_dir / "segments" / "0001")
+    _create_fake_hls(cache_dir / "segments" / "0002")
+    (cache_dir / "covers").mkdir()
+    (cache_dir / "covers" / "al-album001.jpg").write_bytes(b"jpeg")
+    (cache_dir / "audio").mkdir()
+    (cache_dir / "audio" / "0001.mp3").write_bytes(b"mp3")
+    return cache_dir
+
+
+def _export(cache_dir: Path, tmp_path: Path) -> bytes:
+    store = MetadataStore(cache_dir / "metadata.db")
+    db_copy = tmp_path / "metadata-copy.db"
+    store.backup_to(db_copy)
+    store.close()
+    out = io.BytesIO()
+    write_snapshot(out, cache_dir, db_copy, TTL)
+    return out.getvalue()
+
+
+def _tar(entries: dict[str, bytes]) -> io.BytesIO:
+    out = io.BytesIO()
+    with tarfile.open(fileobj=out, mode="w") as tar:
+        for name, data in entries.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+    out.seek(0)
+    return out
+
+
+class TestSnapshot:
+    def test_round_trip(self, source_cache, tmp_path):
+        old = time.time() - 600
+        os.utime(source_cache / "segments" / "0001" / "seg000.ts", (old, old))
+        archive = _export(source_cache, tmp_path)
+
+        target = tmp_path / "target"
+        staging = tmp_path / "staging"
+        manifest = read_snapshot(io.BytesIO(archive), staging)
+        installed = install_snapshot(staging, target, manifest)
+
+        assert installed == ["0001", "0002"]
+        assert (target / "segments" / "0002" / "index.m3u8").exists()
+        assert (target / "covers" / "al-album001.jpg").read_bytes() == b"jpeg"
+        assert (target / "audio" / "0001.mp3").read_bytes() == b"mp3"
+        assert (target / "segments" / "0001" / "seg000.ts").stat().st_mtime == pytest.approx(old)
+
+        store = MetadataStore(target / "metadata.db")
+        store.set_cursor("refresh_job", "target's")
+        store.restore_from(staging / "metadata.db")
+        assert store.slot_count() == 7
+        assert store.built_at is not None
+        # The source's crawl state doesn't apply to this node's server
+        assert set(store.album_sync_keys().values()) == {""}
+        assert store.get_cursor("albums_swept_at") is None
+        assert store.get_cursor("refresh_job") == "target's"
+        store.close()
+
+    def test_skips_expired_and_incomplete_transcodes(self, source_cache, tmp_path):
+        old = time.time() - TTL - 60
+        os.utime(source_cache / "segments" / "0001" / "index.m3u8", (old, old))
+        playlist = source_cache / "segments" / "0002" / "index.m3u8"
+        playlist.write_text(playlist.read_text().replace("#EXT-X-ENDLIST\n", ""))
+
+        manifest = read_snapshot(io.BytesIO(_export(source_cache, tmp_path)), tmp_path / "s")
+        assert manifest.slot_files() == {}
+
+    def test_ladder_exported_only_when_every_variant_finished(self, source_cache, tmp_path):
+        _create_fake_ladder(source_cache / "segments" / "0003")
+        _create_fake_ladder(source_cache / "segments" / "0004")
+        variant = source_cache / "segments" / "0004" / "index_1.m3u8"
+        variant.write_text(variant.read_text().replace("#EXT-X-ENDLIST\n", ""))
+
+        manifest = read_snapshot(io.BytesIO(_export(source_cache, tmp_path)), tmp_path / "s")
+        assert sorted(manifest.slot_files()) == ["0001", "0002", "0003"]
+        assert "seg_1_002.ts" in manifest.slot_files()["0003"]
+
+    def test_slot_being_transcoded_is_skipped(self, source_cache, tmp_path):
+        archive = _export(source_cache, tmp_path)
+        target = tmp_path / "target"
+        (target / "locks").mkdir(parents=True)
+        lock = FileLock(target / "locks" / "0001.lock", thread_local=False)
+
+        manifest = read_snapshot(io.BytesIO(archive), tmp_path / "staging")
+        with lock:
+            installed = install_snapshot(tmp_path / "staging", target, manifest)
+        assert installed == ["0002"]
+        assert not (target / "segments" / "0001").exists()
+
+    def test_corrupted_file_rejected(self, source_cache, tmp_path):
+        archive = bytearray(_export(source_cache, tmp_path))
+        offset = archive.find(b"#EXTM3U")
+        archive[offset] = ord("X")
+
+        with pytest.raises(SnapshotError, match="Checksum mismatch"):
+            read_snapshot(io.BytesIO(bytes(archive)), tmp_path / "staging")
+
+    def test_unsafe_path_rejected(self, tmp_path):
+        with pytest.raises(SnapshotError, match="Unsafe path"):
+            read_snapshot(_tar({"segments/../../evil": b"x"}), tmp_path / "staging")
+
+    def test_slot_without_playlist_rejected(self, source_cache, tmp_path):
+        (source_cache / "segments" / "0002" / "index.m3u8").unlink()
+        store = MetadataStore(source_cache / "metadata.db")
+        store.backup_to(tmp_path / "metadata-copy.db")
+        store.close()
+        # Export only checks playlists of complete slots, so build the archive by hand
+        out = io.BytesIO()
+        with tarfile.open(fileobj=out, mode="w|") as tar:
+            manifest = Manifest(created_at=time.time())
+            for arcname, path in (
+                ("metadata.db", tmp_path / "metadata-copy.db"),
+                ("segments/0002/seg000.ts", source_cache / "segments" / "0002" / "seg000.ts"),
+            ):
+                manifest.files.append(_add_file(tar, path, arcname))
+            data = manifest.to_json()
+            info = tarfile.TarInfo("manifest.json")
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+        out.seek(0)
+
+        with pytest.raises(SnapshotError, match="no index.m3u8"):
+            read_snapshot(out, tmp_path / "staging")
+
+    def test_missing_manifest_rejected(self, tmp_path):
+        with pytest.raises(SnapshotError, match="no manifest"):
+            read_snapshot(_tar({"audio/0001.mp3": b"x"}), tmp_path / "staging")
+
+
+class TestSnapshotEndpoints:
+    @pytest.mark.anyio
+    async def test_export_and_import_while_running(self, settings, tmp_path, mock_subsonic):
+        source_app = create_app(settings=settings)
+        target_settings = settings.model_copy(update={"cache_dir": str(tmp_path / "target")})
+        target_app = create_app(settings=target_settings)
+
+        async with source_app.router.lifespan_context(source_app):
+            source: AppState = source_app.state.svc
+            await source.refresher.current.task
+            _create_fake_hls(Path(settings.cache_dir) / "segments" / "0003")
+            transport = ASGITransport(app=source_app)
+            async with AsyncClient(transport=transport, base_url="http://test") as client:
+                resp = await client.get("/admin/snapshot")
+            assert resp.status_code == 200
+            assert resp.headers["content-disposition"] == 'attachment; filename="snapshot.tar"'
+            archive = resp.content
+            assert not list(Path(settings.cache_dir).glob(".snapshot-*"))
+
+        async with target_app.router.lifespan_context(target_app):
+            target: AppState = target_app.state.svc
+            await target.refresher.current.task
+            # An older encode of the slot, which a client may be partway through
+            _create_fake_hls(target.cache.slot_dir("0003"))
+            old_playlist = target.cache.slot_dir("0003") / "index.m3u8"
+            os.utime(old_playlist, (time.time() - 60, time.time() - 60))
+            old_version = encode_version(old_playlist)
+            transport = ASGITransport(app=target_app)
+            async with AsyncClient(transport=transport, base_url="http://test") as client:
+                resp = await client.post("/admin/snapshot", content=archive)
+                assert resp.status_code == 200
+                assert resp.json()["slots"] == 1
+                assert resp.json()["tracks"] == 7
+                version = encode_version(target.cache.slot_dir("0003") / "index.m3u8")
+                assert version != old_version
+                assert target.segment_cache.get("0003", f"{version}/seg000.ts") is not None
+                resp = await client.get(f"/segments/0003/{old_version}/seg000.ts")
+                assert resp.status_code == 200
+
+                # Served from the imported transcode; ffmpeg isn't available here
+                resp = await client.get("/0003.m3u8")
+                assert resp.status_code == 200
+
+                resp = await client.post("/admin/snapshot", content=b"not a tar")
+                assert resp.status_code == 400
+
+    @pytest.mark.anyio
+    async def test_export_writer_stops_when_download_aborted(self):
+        finished = threading.Event()
+
+        def write(out):
+            try:
+                while True:
+                    out.write(b"x" * 1024 * 1024)
+            finally:
+                finished.set()
+
+        stream = _stream_from_thread(write)
+        assert len(await anext(stream)) == 1024 * 1024
+        await stream.aclose()
+        assert await asyncio.to_thread(finished.wait, 5)
+
+    @pytest.mark.anyio
+    async def test_export_fails_when_writer_raises(self):
+        def write(out):
+            out.write(b"x" * 1024 * 1024)
+            raise FileNotFoundError("segments/0001/seg000.ts")
+
+        chunks = []
+        with pytest.raises(FileNotFoundError):
+            async with asyncio.timeout(5):
+                async for chunk in _stream_from_thread(write):
+                    chunks.append(chunk)
+        assert chunks == [b"x" * 1024 * 1024]
+
+    @pytest.mark.anyio
+    async def test_import_extracts_upload_as_it_arrives(self, source_cache, tmp_path):
+        archive = _export(source_cache, tmp_path)
+        pipe = _ChunkPipe(chunk_size=1000, max_chunks=2)
+
+        def extract():
+            try:
+                return read_snapshot(pipe, tmp_path / "staging")
+            finally:
+                pipe.stop()  # The archive's trailing padding is never read
+
+        reader = asyncio.ensure_future(asyncio.to_thread(extract))
+        with contextlib.suppress(OSError):
+            for start in range(0, len(archive), 777):
+                await asyncio.to_thread(pipe.write, archive[start : start + 777])
+            await asyncio.to_thread(pipe.close)
+
+        manifest = await reader
+        assert manifest.slot_files().keys() == {"0001", "0002"}
@@ -1,8 +1,12 @@
+import asyncio
 import hashlib
 
+import httpx
 import pytest
+from httpx import Response
 
-from subsonic_proxy.subsonic import SubsonicClient
+from subsonic_proxy.subsonic import SubsonicClient, SubsonicUnavailable
+from tests.conftest import ALBUM_LIST_RESPONSE, make_album_response
 
 
 class TestAuthParams:
@@ -76,26 +80,6 @@ class TestGetAlbum:
         assert len(album["song"]) == 3
 
 
-class TestGetAllTracks:
-    @pytest.mark.anyio
-    async def test_collects_all_tracks(self, settings, mock_subsonic):
-        async with SubsonicClient(settings) as client:
-            tracks = await client.get_all_tracks()
-
-        assert len(tracks) == 7
-        titles = [t["title"] for t in tracks]
-        assert "Watercolour" in titles
-        assert "Lisa Frank 420" in titles
-        assert "Hidamari" in titles
-
-    @pytest.mark.anyio
-    async def test_respects_max_count(self, settings, mock_subsonic):
-        async with SubsonicClient(settings) as client:
-            tracks = await client.get_all_tracks(max_count=3)
-
-        assert len(tracks) == 3
-
-
 class TestGetStreamUrl:
     def test_includes_auth_and_id(self, settings):
         client = SubsonicClient(settings)
@@ -127,3 +111,100 @@ class TestGetAudioStream:
         assert isinstance(audio_data, bytes)
         # Verify the request was made (mock handled it)
         assert b"FAKE_MP3_DATA_song002" in audio_data
+
+
+@pytest.fixture
+def resilient_settings(settings):
+    return settings.model_copy(
+        update={
+            "subsonic_retries": 2,
+            "subsonic_retry_backoff_seconds": 0.0,
+            "subsonic_breaker_threshold": 3,
+            "subsonic_breaker_reset_seconds": 60.0,
+        }
+    )
+
+
+class TestResilience:
+    @pytest.mark.anyio
+    async def test_retries_transient_failures(self, resilient_settings, mock_subsonic):
+        route = mock_subsonic.get("/rest/getAlbumList2.view")
+        route.side_effect = [
+            httpx.ConnectError("connection refused"),
+            Response(503),
+            Response(200, json=ALBUM_LIST_RESPONSE),
+        ]
+        async with SubsonicClient(resilient_settings) as client:
+            albums = await client.get_album_list()
+            assert client.available
+
+        assert len(albums) == 3
+        assert route.call_count == 3
+
+    @pytest.mark.anyio
+    async def test_gives_up_after_retries(self, resilient_settings, mock_subsonic):
+        route = mock_subsonic.get("/rest/getAlbum.view").mock(return_value=Response(502))
+        settings = resilient_settings.model_copy(update={"subsonic_breaker_threshold": 0})
+        async with SubsonicClient(settings) as client:
+            with pytest.raises(httpx.HTTPStatusError):
+                await client.get_album("album001")
+
+        assert route.call_count == 3
+
+    @pytest.mark.anyio
+    async def test_client_errors_not_retried(self, resilient_settings, mock_subsonic):
+        route = mock_subsonic.get("/rest/getAlbum.view").mock(return_value=Response(404))
+        async with SubsonicClient(resilient_settings) as client:
+            with pytest.raises(httpx.HTTPStatusError):
+                await client.get_album("album001")
+
+        assert route.call_count == 1
+
+    @pytest.mark.anyio
+    async def test_breaker_opens_and_fails_fast(self, resilient_settings, mock_subsonic):
+        route = mock_subsonic.get("/rest/getAlbum.view").mock(
+            side_effect=httpx.ReadTimeout("timed out")
+        )
+        async with SubsonicClient(resilient_settings) as client:
+            with pytest.raises(httpx.ReadTimeout):
+                await client.get_album("album001")
+            assert not client.available
+            assert route.call_count == 3
+
+            with pytest.raises(SubsonicUnavailable):
+                await client.get_album("album001")
+            assert route.call_count == 3
+
+    @pytest.mark.anyio
+    async def test_breaker_closes_after_successful_trial(self, resilient_settings, mock_subsonic):
+        settings = resilient_settings.model_copy(update={"subsonic_breaker_reset_seconds": 0.05})
+        async with SubsonicClient(settings) as client:
+            for _ in range(3):
+                client.breaker.record_failure()
+            with pytest.raises(SubsonicUnavailable):
+                await client.get_album_list()
+
+            await asyncio.sleep(0.06)
+            albums = await client.get_album_list()
+            assert len(albums) == 3
+            assert client.available
+
+    @pytest.mark.anyio
+    async def test_endpoint_concurrency_limited(self, resilient_settings, mock_subsonic):
+        settings = resilient_settings.model_copy(update={"subsonic_endpoint_concurrency": 2})
+        in_flight = 0
+        peak = 0
+
+        async def slow_album(request):
+            nonlocal in_flight, peak
+            in_flight += 1
+            peak = max(peak, in_flight)
+            await asyncio.sleep(0.01)
+            in_flight -= 1
+            return Response(200, json=make_album_response(request.url.params["id"]))
+
+        mock_subsonic.get("/rest/getAlbum.view").mock(side_effect=slow_album)
+        async with SubsonicClient(settings) as client:
+            await asyncio.gather(*(client.get_album("album001") for _ in range(6)))
+
+        assert peak == 2
@@ -1,12 +1,24 @@
+import asyncio
 import os
+import random
+import threading
 import time
 from pathlib import Path
 from unittest.mock import AsyncMock, MagicMock, patch
 
 import pytest
+from filelock import FileLock, Timeout
+from httpx import Response
 
-from subsonic_proxy.cache import CacheManager
-from subsonic_proxy.transcoder import HLSTranscoder
+from subsonic_proxy.cache import CacheManager, SegmentCache, encode_version
+from subsonic_proxy.coordination import FileSemaphore
+from subsonic_proxy.subsonic import SubsonicClient
+from subsonic_proxy.transcoder import (
+    HLSTranscoder,
+    TranscodeError,
+    TranscodeJob,
+    TranscodeTiming,
+)
 
 
 @pytest.fixture
@@ -34,6 +46,25 @@ def transcoder(settings, cache_manager, mock_subsonic_client):
     )
 
 
+def _create_fake_ladder(slot_dir: Path):
+    """Create fake two-variant HLS output with a master playlist."""
+    _create_fake_hls(slot_dir)
+    media = (slot_dir / "index.m3u8").read_text()
+    for variant in ("0", "1"):
+        (slot_dir / f"index_{variant}.m3u8").write_text(media.replace("seg", f"seg_{variant}_"))
+        for i in range(3):
+            (slot_dir / f"seg_{variant}_00{i}.ts").write_bytes(b"\x00" * 1024)
+    (slot_dir / "index.m3u8").write_text(
+        "#EXTM3U\n"
+        "#EXT-X-STREAM-INF:BANDWIDTH=293700,RESOLUTION=640x640\n"
+        "index_0.m3u8\n"
+        '#EXT-X-STREAM-INF:BANDWIDTH=70400,CODECS="mp4a.40.2"\n'
+        "index_1.m3u8\n"
+    )
+    for i in range(3):
+        (slot_dir / f"seg00{i}.ts").unlink()
+
+
 def _create_fake_hls(slot_dir: Path):
     """Create fake HLS files to simulate ffmpeg output."""
     slot_dir.mkdir(parents=True, exist_ok=True)
@@ -117,27 +148,15 @@ class TestHLSTranscoder:
         mock_ffmpeg.assert_not_called()
 
     @pytest.mark.anyio
-    async def test_expired_cache_retranscodes(self, cache_dir, mock_subsonic_client):
+    async def test_expired_cache_retranscodes(self, settings, cache_dir, mock_subsonic_client):
         cache_manager = CacheManager(cache_dir=cache_dir, ttl_seconds=0)
-        settings_with_zero_ttl = type(
-            "S",
-            (),
-            {
+        settings_with_zero_ttl = settings.model_copy(
+            update={
                 "cache_dir": str(cache_dir),
-                "ffmpeg_path": "ffmpeg",
-                "hls_segment_duration": 10,
-                "audio_bitrate": "192k",
-                "video_width": 640,
-                "video_height": 640,
-                "video_framerate": 1,
-                "video_bitrate": "50k",
-                "video_maxrate": "75k",
-                "video_bufsize": "150k",
+                "cache_ttl_seconds": 0,
                 "text_font": "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
-                "fallback_bg_color": "#1a1a2e",
-                "max_concurrent_transcodes": 3,
-            },
-        )()
+            }
+        )
         transcoder = HLSTranscoder(
             settings=settings_with_zero_ttl,
             cache_manager=cache_manager,
@@ -168,6 +187,505 @@ class TestHLSTranscoder:
 
         assert call_count == 1
 
+    @pytest.mark.anyio
+    async def test_expired_encode_retired_on_retranscode(
+        self, settings, cache_dir, mock_subsonic_client
+    ):
+        cache_manager = CacheManager(cache_dir=cache_dir, ttl_seconds=100, retired_seconds=600)
+        transcoder = HLSTranscoder(
+            settings=settings, cache_manager=cache_manager, subsonic_client=mock_subsonic_client
+        )
+        slot_dir = cache_dir / "segments" / "0001"
+        _create_fake_hls(slot_dir)
+        old_time = time.time() - 200
+        os.utime(slot_dir / "index.m3u8", (old_time, old_time))
+        old_version = encode_version(slot_dir / "index.m3u8")
+        track_info = {"title": "Test Song", "artist": "A", "album": "B", "coverArt": None}
+
+        async def fake_ffmpeg(stream_url, output_dir, *args, **kwargs):
+            # Written into a clean directory rather than over the old encode
+            assert not (output_dir / "seg000.ts").exists()
+            _create_fake_hls(output_dir)
+
+        with patch.object(transcoder, "_run_ffmpeg", new=AsyncMock(side_effect=fake_ffmpeg)):
+            await transcoder.ensure_transcoded("0001", "song001", track_info)
+
+        assert (cache_manager.retired_slot_dir("0001", old_version) / "seg002.ts").exists()
+
+    @pytest.mark.anyio
+    async def test_transcode_prefetches_first_segments(
+        self, settings, cache_manager, mock_subsonic_client, cache_dir
+    ):
+        segment_cache = SegmentCache(max_bytes=1024 * 1024)
+        transcoder = HLSTranscoder(
+            settings=settings.model_copy(update={"segment_cache_prefetch": 2}),
+            cache_manager=cache_manager,
+            subsonic_client=mock_subsonic_client,
+            segment_cache=segment_cache,
+        )
+        slot_dir = cache_dir / "segments" / "0001"
+        track_info = {"title": "Test Song", "artist": "A", "album": "B", "coverArt": None}
+
+        async def fake_ffmpeg(*args, **kwargs):
+            _create_fake_hls(slot_dir)
+
+        with patch.object(transcoder, "_run_ffmpeg", new=AsyncMock(side_effect=fake_ffmpeg)):
+            await transcoder.ensure_transcoded("0001", "song001", track_info)
+
+        version = encode_version(slot_dir / "index.m3u8")
+        assert segment_cache.get("0001", f"{version}/seg000.ts") == b"\x00" * 1024
+        assert segment_cache.get("0001", f"{version}/seg001.ts") is not None
+        assert segment_cache.get("0001", f"{version}/seg002.ts") is None
+
+    @pytest.mark.anyio
+    async def test_popular_slot_refreshed_ahead_in_background(
+        self, settings, cache_dir, mock_subsonic_client
+    ):
+        cache_manager = CacheManager(
+            cache_dir=cache_dir,
+            ttl_seconds=100,
+            popular_hits=1,
+            refresh_ahead=0.5,
+            retired_seconds=600,
+        )
+        transcoder = HLSTranscoder(
+            settings=settings, cache_manager=cache_manager, subsonic_client=mock_subsonic_client
+        )
+        slot_dir = cache_dir / "segments" / "0001"
+        _create_fake_hls(slot_dir)
+        old_time = time.time() - 60
+        os.utime(slot_dir / "index.m3u8", (old_time, old_time))
+        old_version = encode_version(slot_dir / "index.m3u8")
+        cache_manager.record_access(slot_dir / "index.m3u8")  # Played before
+        track_info = {"title": "Test Song", "artist": "A", "album": "B", "coverArt": None}
+
+        output_dirs = []
+
+        async def fake_ffmpeg(stream_url, output_dir, *args, **kwargs):
+            output_dirs.append(output_dir)
+            # The live transcode stays in place while the refresh encodes
+            assert (slot_dir / "index.m3u8").exists()
+            _create_fake_hls(output_dir)
+
+        with patch.object(transcoder, "_run_ffmpeg", new=AsyncMock(side_effect=fake_ffmpeg)):
+            m3u8_path = await transcoder.ensure_transcoded("0001", "song001", track_info)
+            assert m3u8_path == slot_dir / "index.m3u8"
+            await transcoder._pending["0001"]
+
+        assert output_dirs == [cache_dir / "segments" / ".0001.refresh"]
+        assert not output_dirs[0].exists()
+        assert time.time() - (slot_dir / "index.m3u8").stat().st_mtime < 10
+        assert transcoder.recent_timings(1)[0].trigger == "refresh_ahead"
+        # The replaced encode stays servable to clients still playing it
+        retired = cache_manager.retired_slot_dir("0001", old_version)
+        assert (retired / "seg002.ts").exists()
+        assert retired.stat().st_mtime > time.time() + 500
+
+    def test_single_file_segment_args(self, settings, cache_manager, mock_subsonic_client):
+        transcoder = HLSTranscoder(
+            settings=settings.model_copy(update={"hls_single_file": True}),
+            cache_manager=cache_manager,
+            subsonic_client=mock_subsonic_client,
+        )
+        args = transcoder._segment_args(Path("/out"))
+        assert args == ["-hls_flags", "single_file", "-hls_segment_filename", "/out/media.ts"]
+
+    def test_fmp4_segment_args(self, settings, cache_manager, mock_subsonic_client):
+        transcoder = HLSTranscoder(
+            settings=settings.model_copy(update={"hls_segment_type": "fmp4"}),
+            cache_manager=cache_manager,
+            subsonic_client=mock_subsonic_client,
+        )
+        args = transcoder._segment_args(Path("/out"))
+        assert args == [
+            "-hls_segment_type",
+            "fmp4",
+            "-hls_fmp4_init_filename",
+            "init.mp4",
+            "-hls_segment_filename",
+            "/out/seg%03d.m4s",
+        ]
+
+    def test_rendition_ladder_args(self, settings, cache_manager, mock_subsonic_client):
+        transcoder = HLSTranscoder(
+            settings=settings.model_copy(
+                update={"hls_renditions": ["192k", "64k"], "hls_audio_only_rendition": True}
+            ),
+            cache_manager=cache_manager,
+            subsonic_client=mock_subsonic_client,
+        )
+        assert transcoder._stream_args() == [
+            *["-map", "0:v", "-map", "1:a", "-map", "0:v", "-map", "1:a", "-map", "1:a"],
+            *["-b:a:0", "192k", "-b:a:1", "64k", "-b:a:2", "64k"],
+            *["-var_stream_map", "v:0,a:0 v:1,a:1 a:2"],
+        ]
+        assert transcoder._segment_args(Path("/out")) == [
+            "-hls_segment_filename",
+            "/out/seg_%v_%03d.ts",
+        ]
+        # 75k video maxrate plus audio, with 10% headroom
+        assert transcoder._master_playlist().splitlines() == [
+            "#EXTM3U",
+            "#EXT-X-VERSION:3",
+            "#EXT-X-STREAM-INF:BANDWIDTH=293700,RESOLUTION=640x640",
+            "index_0.m3u8",
+            "#EXT-X-STREAM-INF:BANDWIDTH=152900,RESOLUTION=640x640",
+            "index_1.m3u8",
+            '#EXT-X-STREAM-INF:BANDWIDTH=70400,CODECS="mp4a.40.2"',
+            "index_2.m3u8",
+        ]
+
+    def test_invalid_segment_type(self, settings, cache_manager, mock_subsonic_client):
+        with pytest.raises(ValueError):
+            HLSTranscoder(
+                settings=settings.model_copy(update={"hls_segment_type": "webm"}),
+                cache_manager=cache_manager,
+                subsonic_client=mock_subsonic_client,
+            )
+
+    def test_multi_worker_semaphore_is_global(self, settings, cache_manager, mock_subsonic_client):
+        transcoder = HLSTranscoder(
+            settings=settings.model_copy(update={"multi_worker": True}),
+            cache_manager=cache_manager,
+            subsonic_client=mock_subsonic_client,
+        )
+        assert isinstance(transcoder._transcode_semaphore, FileSemaphore)
+
+    def test_default_segment_args(self, transcoder):
+        args = transcoder._segment_args(Path("/out"))
+        assert args == ["-hls_segment_filename", "/out/seg%03d.ts"]
+
+    @pytest.mark.anyio
+    async def test_transcode_records_phase_timings(self, transcoder, cache_dir):
+        slot_dir = cache_dir / "segments" / "0001"
+        track_info = {
+            "title": "Test Song",
+            "artist": "A",
+            "album": "B",
+            "coverArt": None,
+            "duration": 24.5,
+        }
+
+        async def fake_ffmpeg(*args, **kwargs):
+            _create_fake_hls(slot_dir)
+
+        with patch.object(transcoder, "_run_ffmpeg", new=AsyncMock(side_effect=fake_ffmpeg)):
+            await transcoder.ensure_transcoded("0001", "song001", track_info)
+            # Cache hits are not transcodes and leave no record
+            await transcoder.ensure_transcoded("0001", "song001", track_info)
+
+        assert len(transcoder.timings) == 1
+        timing = transcoder.timings[0]
+        assert timing.result == "ok"
+        assert set(timing.phases) == {
+            "lock_wait",
+            "semaphore_wait",
+            "cover_art",
+            "overlay",
+            "ffmpeg",
+            "prefetch",
+        }
+        assert timing.output_bytes == 3 * 1024
+        assert timing.realtime_factor == pytest.approx(24.5 / timing.phases["ffmpeg"])
+        assert timing.total_seconds >= sum(timing.phases.values()) * 0.99
+
+    @pytest.mark.anyio
+    async def test_failed_transcode_recorded(self, transcoder):
+        track_info = {"title": "Broken", "artist": "A", "album": "B", "coverArt": None}
+        failing = AsyncMock(side_effect=TranscodeError("ffmpeg failed"))
+
+        with patch.object(transcoder, "_run_ffmpeg", new=failing), pytest.raises(TranscodeError):
+            await transcoder.ensure_transcoded("0002", "song002", track_info)
+
+        assert transcoder.recent_timings()[0].result == "error"
+        assert transcoder.recent_timings()[0].realtime_factor is None
+
+    def test_slowest_timings_sorted(self, transcoder):
+        for slot_id, total in (("0001", 3.0), ("0002", 9.0), ("0003", 1.0)):
+            timing = TranscodeTiming(slot_id=slot_id, title="", started_at=0.0)
+            transcoder._record_timing(timing, total)
+
+        assert [t.slot_id for t in transcoder.slowest_timings(2)] == ["0002", "0001"]
+        assert [t.slot_id for t in transcoder.recent_timings(2)] == ["0003", "0002"]
+
+
+class TestFFmpegProgress:
+    @pytest.fixture
+    def ffmpeg_transcoder(self, settings, cache_manager, mock_subsonic_client, fake_ffmpeg):
+        return HLSTranscoder(
+            settings=settings.model_copy(
+                update={"ffmpeg_path": fake_ffmpeg, "transcode_stall_timeout_seconds": 2}
+            ),
+            cache_manager=cache_manager,
+            subsonic_client=mock_subsonic_client,
+        )
+
+    @pytest.mark.anyio
+    async def test_progress_updates_job(self, ffmpeg_transcoder, tmp_path, monkeypatch):
+        monkeypatch.setenv("FAKE_FFMPEG_DURATION", "25")
+        output_dir = tmp_path / "out"
+        output_dir.mkdir()
+        job = TranscodeJob(slot_id="0001", title="Test", duration=25)
+
+        await ffmpeg_transcoder._run_ffmpeg("input.mp3", output_dir, tmp_path / "r.jpg", job=job)
+
+        assert job.state == "running"
+        assert job.out_time == 25
+        assert job.speed == pytest.approx(125.0)
+        assert job.eta_seconds == 0
+        assert (output_dir / "index.m3u8").exists()
+        assert (output_dir / "seg002.ts").exists()
+
+    @pytest.mark.anyio
+    async def test_stalled_ffmpeg_is_killed(self, ffmpeg_transcoder, tmp_path, monkeypatch):
+        monkeypatch.setenv("FAKE_FFMPEG_HANG", "30")
+        output_dir = tmp_path / "out"
+        output_dir.mkdir()
+
+        start = time.monotonic()
+        with pytest.raises(TranscodeError, match="no progress"):
+            await ffmpeg_transcoder._run_ffmpeg("input.mp3", output_dir, tmp_path / "r.jpg")
+        assert time.monotonic() - start < 10
+
+    @pytest.mark.anyio
+    async def test_ffmpeg_failure_raises(self, ffmpeg_transcoder, tmp_path, monkeypatch):
+        monkeypatch.setenv("FAKE_FFMPEG_EXIT", "1")
+        output_dir = tmp_path / "out"
+        output_dir.mkdir()
+
+        with pytest.raises(TranscodeError, match="fake failure"):
+            await ffmpeg_transcoder._run_ffmpeg("input.mp3", output_dir, tmp_path / "r.jpg")
+
+    @pytest.mark.anyio
+    async def test_job_visible_while_transcoding(self, ffmpeg_transcoder, monkeypatch):
+        monkeypatch.setenv("FAKE_FFMPEG_SECONDS", "1.0")
+        track_info = {"title": "Long Mix", "artist": "A", "album": "B", "duration": 30}
+        task = asyncio.create_task(
+            ffmpeg_transcoder.ensure_transcoded("0001", "input.mp3", track_info)
+        )
+
+        while "0001" not in ffmpeg_transcoder.jobs or not ffmpeg_transcoder.jobs["0001"].out_time:
+            await asyncio.sleep(0.05)
+        job = ffmpeg_transcoder.jobs["0001"].to_dict()
+        assert job["state"] == "running"
+        assert job["duration"] == 30
+        assert 0 < job["out_time"] <= 30
+
+        await task
+        assert ffmpeg_transcoder.jobs == {}
+
+    @pytest.mark.anyio
+    async def test_concurrent_requests_share_one_transcode(
+        self, ffmpeg_transcoder, tmp_path, monkeypatch
+    ):
+        launch_log = tmp_path / "launches.log"
+        monkeypatch.setenv("FAKE_FFMPEG_SECONDS", "0.5")
+        monkeypatch.setenv("FAKE_FFMPEG_LAUNCH_LOG", str(launch_log))
+        track_info = {"title": "Song", "artist": "A", "album": "B", "duration": 30}
+
+        paths = await asyncio.gather(
+            *(
+                ffmpeg_transcoder.ensure_transcoded("0001", "input.mp3", track_info)
+                for _ in range(80)
+            )
+        )
+
+        assert len(set(paths)) == 1
+        assert len(launch_log.read_text().splitlines()) == 1
+        assert ffmpeg_transcoder._pending == {}
+
+    @pytest.mark.anyio
+    async def test_cancelled_waiter_does_not_cancel_transcode(self, ffmpeg_transcoder, monkeypatch):
+        monkeypatch.setenv("FAKE_FFMPEG_SECONDS", "0.5")
+        track_info = {"title": "Song", "artist": "A", "album": "B", "duration": 30}
+        first = asyncio.create_task(
+            ffmpeg_transcoder.ensure_transcoded("0001", "input.mp3", track_info)
+        )
+        second = asyncio.create_task(
+            ffmpeg_transcoder.ensure_transcoded("0001", "input.mp3", track_info)
+        )
+        await asyncio.sleep(0.1)
+        first.cancel()
+
+        path = await second
+        assert path.exists()
+
+    @pytest.fixture
+    async def piped_transcoder(self, settings, cache_manager, fake_ffmpeg, mock_subsonic):
+        async with SubsonicClient(settings) as subsonic:
+            yield HLSTranscoder(
+                settings=settings.model_copy(
+                    update={"ffmpeg_path": fake_ffmpeg, "ffmpeg_input": "pipe"}
+                ),
+                cache_manager=cache_manager,
+                subsonic_client=subsonic,
+            )
+
+    @pytest.mark.anyio
+    async def test_source_piped_through_subsonic_client(
+        self, piped_transcoder, tmp_path, monkeypatch
+    ):
+        input_log = tmp_path / "input.log"
+        monkeypatch.setenv("FAKE_FFMPEG_INPUT_LOG", str(input_log))
+        output_dir = tmp_path / "out"
+        output_dir.mkdir()
+
+        await piped_transcoder._run_ffmpeg(
+            "https://secret-url", output_dir, tmp_path / "r.jpg", track_id="song001"
+        )
+
+        # No credentials on the command line; the audio arrived on stdin
+        assert input_log.read_bytes() == b"pipe:0\nFAKE_MP3_DATA_song001"
+        assert (output_dir / "index.m3u8").exists()
+
+    @pytest.mark.anyio
+    async def test_failed_source_stream_fails_transcode(
+        self, piped_transcoder, tmp_path, mock_subsonic
+    ):
+        mock_subsonic.get("/rest/stream.view").mock(return_value=Response(404))
+        output_dir = tmp_path / "out"
+        output_dir.mkdir()
+
+        with pytest.raises(TranscodeError, match="Streaming track song001"):
+            await piped_transcoder._run_ffmpeg(
+                "unused", output_dir, tmp_path / "r.jpg", track_id="song001"
+            )
+        assert not (output_dir / "index.m3u8").exists()
+
+    @pytest.mark.anyio
+    async def test_rendition_ladder_in_one_run(
+        self, settings, cache_manager, fake_ffmpeg, tmp_path, monkeypatch
+    ):
+        launch_log = tmp_path / "launches.log"
+        monkeypatch.setenv("FAKE_FFMPEG_LAUNCH_LOG", str(launch_log))
+        transcoder = HLSTranscoder(
+            settings=settings.model_copy(
+                update={"ffmpeg_path": fake_ffmpeg, "hls_renditions": ["128k", "64k"]}
+            ),
+            cache_manager=cache_manager,
+            subsonic_client=MagicMock(),
+        )
+        track_info = {"title": "Song", "artist": "A", "album": "B", "duration": 30}
+        m3u8_path = await transcoder.ensure_transcoded("0001", "input.mp3", track_info)
+
+        assert len(launch_log.read_text().splitlines()) == 1
+        assert "#EXT-X-STREAM-INF" in m3u8_path.read_text()
+        slot_dir = m3u8_path.parent
+        for variant in ("0", "1"):
+            assert "#EXT-X-ENDLIST" in (slot_dir / f"index_{variant}.m3u8").read_text()
+            assert (slot_dir / f"seg_{variant}_000.ts").exists()
+        assert transcoder.is_cached("0001")
+
+    def test_apply_progress(self):
+        job = TranscodeJob(slot_id="0001", title="", duration=100)
+        job.apply_progress("out_time_us", "40000000")
+        job.apply_progress("speed", "2.5x")
+        assert job.out_time == 40
+        assert job.eta_seconds == 24
+        job.apply_progress("out_time_us", "N/A")
+        job.apply_progress("speed", "N/A")
+        assert job.out_time == 40
+        assert job.eta_seconds is None
+
+
+class TestLockWait:
+    @pytest.fixture
+    def short_lock_transcoder(self, settings, cache_manager, mock_subsonic_client):
+        return HLSTranscoder(
+            settings=settings.model_copy(update={"transcode_lock_timeout_seconds": 0}),
+            cache_manager=cache_manager,
+            subsonic_client=mock_subsonic_client,
+        )
+
+    def _hold_lock(self, lock_path, seconds: float) -> threading.Event:
+        held = threading.Event()
+
+        def hold():
+            with FileLock(lock_path):
+                held.set()
+                time.sleep(seconds)
+
+        threading.Thread(target=hold, daemon=True).start()
+        held.wait()
+        return held
+
+    @pytest.mark.anyio
+    async def test_times_out_without_progressing_holder(self, short_lock_transcoder):
+        lock_path = short_lock_transcoder._get_lock_path("0001")
+        self._hold_lock(lock_path, 3)
+
+        with pytest.raises(Timeout):
+            await short_lock_transcoder._acquire_lock(FileLock(lock_path), "0001")
+
+    @pytest.mark.anyio
+    async def test_waits_while_holder_progresses(self, short_lock_transcoder):
+        lock_path = short_lock_transcoder._get_lock_path("0001")
+        short_lock_transcoder.jobs["0001"] = TranscodeJob(
+            slot_id="0001",
+            title="",
+            duration=600,
+            state="running",
+            progress_path=short_lock_transcoder._get_progress_path("0001"),
+        )
+        short_lock_transcoder.jobs["0001"].mark_progress()
+        self._hold_lock(lock_path, 1.5)
+
+        lock = FileLock(lock_path, thread_local=False)
+        await short_lock_transcoder._acquire_lock(lock, "0001")
+        assert lock.is_locked
+        lock.release()
+
+    @pytest.mark.anyio
+    async def test_waits_while_holder_in_other_worker_progresses(self, short_lock_transcoder):
+        lock_path = short_lock_transcoder._get_lock_path("0001")
+        # Only the progress file is shared with the other worker, not its jobs
+        short_lock_transcoder._get_progress_path("0001").touch()
+        self._hold_lock(lock_path, 1.5)
+
+        lock = FileLock(lock_path, thread_local=False)
+        await short_lock_transcoder._acquire_lock(lock, "0001")
+        assert lock.is_locked
+        lock.release()
+
+    @pytest.mark.anyio
+    async def test_times_out_when_holder_progress_stalled(self, short_lock_transcoder):
+        lock_path = short_lock_transcoder._get_lock_path("0001")
+        progress_path = short_lock_transcoder._get_progress_path("0001")
+        progress_path.touch()
+        stalled = time.time() - short_lock_transcoder._stall_timeout - 1
+        os.utime(progress_path, (stalled, stalled))
+        self._hold_lock(lock_path, 3)
+
+        with pytest.raises(Timeout):
+            await short_lock_transcoder._acquire_lock(FileLock(lock_path), "0001")
+
+
+class TestSegmentCache:
+    def test_evicts_least_recently_used_over_budget(self):
+        cache = SegmentCache(max_bytes=300)
+        cache.put("0001", "seg000.ts", b"a" * 100)
+        cache.put("0001", "seg001.ts", b"b" * 100)
+        cache.put("0001", "seg002.ts", b"c" * 100)
+        cache.get("0001", "seg000.ts")
+        cache.put("0002", "seg000.ts", b"d" * 100)
+
+        assert cache.size == 300
+        assert cache.get("0001", "seg001.ts") is None
+        assert cache.get("0001", "seg000.ts") is not None
+
+    def test_admits_on_second_read(self):
+        cache = SegmentCache(max_bytes=300)
+        assert not cache.should_admit("0001", "seg000.ts")
+        assert cache.should_admit("0001", "seg000.ts")
+
+    def test_invalidate_slot(self):
+        cache = SegmentCache(max_bytes=300)
+        cache.put("0001", "seg000.ts", b"a" * 100)
+        cache.put("0002", "seg000.ts", b"b" * 100)
+        cache.invalidate_slot("0001")
+        assert cache.get("0001", "seg000.ts") is None
+        assert cache.size == 100
+
 
 class TestCacheManager:
     def test_not_expired_within_ttl(self, cache_dir, cache_manager):
@@ -196,9 +714,262 @@ class TestCacheManager:
         manager.cleanup()
         assert not slot_dir.exists()
 
+    def test_cleanup_removes_retired_encodes_when_due(self, cache_dir):
+        manager = CacheManager(cache_dir=cache_dir, ttl_seconds=3600, retired_seconds=60)
+        for slot_id in ("0001", "0002"):
+            _create_fake_hls(cache_dir / "segments" / slot_id)
+            manager.retire_slot(cache_dir / "segments" / slot_id)
+        due = next((cache_dir / "segments").glob(".0001@*"))
+        os.utime(due, (time.time() - 1, time.time() - 1))
+
+        manager.cleanup()
+        assert not due.exists()
+        assert len(list((cache_dir / "segments").glob(".0002@*"))) == 1
+
+    def test_cleanup_retires_expired_encodes(self, cache_dir):
+        manager = CacheManager(cache_dir=cache_dir, ttl_seconds=0, retired_seconds=60)
+        slot_dir = cache_dir / "segments" / "0001"
+        _create_fake_hls(slot_dir)
+        old_time = time.time() - 10
+        os.utime(slot_dir / "index.m3u8", (old_time, old_time))
+        version = encode_version(slot_dir / "index.m3u8")
+
+        manager.cleanup()
+        assert not slot_dir.exists()
+        assert (manager.retired_slot_dir("0001", version) / "seg000.ts").exists()
+
     def test_cleanup_keeps_fresh(self, cache_dir, cache_manager):
         slot_dir = cache_dir / "segments" / "0001"
         _create_fake_hls(slot_dir)
 
         cache_manager.cleanup()
         assert slot_dir.exists()
+
+    def test_jitter_spreads_expiry(self, cache_dir):
+        manager = CacheManager(cache_dir=cache_dir, ttl_seconds=1000, ttl_jitter=0.2)
+        ttls = [manager.ttl_for(cache_dir / f"{i}.jpg", mtime=0.0, now=0.0) for i in range(200)]
+        assert all(800 <= ttl <= 1200 for ttl in ttls)
+        assert max(ttls) - min(ttls) > 300
+        # Stable for one file generation
+        assert manager.ttl_for(cache_dir / "0.jpg", mtime=0.0, now=0.0) == ttls[0]
+
+    def test_popular_items_live_longer(self, cache_dir):
+        manager = CacheManager(
+            cache_dir=cache_dir, ttl_seconds=1000, popular_hits=4, popular_multiplier=3.0
+        )
+        rare, popular = cache_dir / "rare.jpg", cache_dir / "popular.jpg"
+        for _ in range(4):
+            manager.record_access(popular, now=0.0)
+        manager.record_access(rare, now=0.0)
+
+        assert manager.ttl_for(popular, mtime=0.0, now=0.0) == pytest.approx(3000)
+        assert manager.ttl_for(rare, mtime=0.0, now=0.0) == pytest.approx(1500)
+        # Counts decay once an item stops being played
+        assert manager.ttl_for(popular, mtime=0.0, now=10000.0) < 1100
+
+    def test_refresh_ahead_only_for_popular_items_near_expiry(self, cache_dir):
+        manager = CacheManager(
+            cache_dir=cache_dir, ttl_seconds=1000, popular_hits=2, refresh_ahead=0.8
+        )
+        path = cache_dir / "0001.mp3"
+        path.parent.mkdir(parents=True)
+        path.write_bytes(b"mp3")
+        now = path.stat().st_mtime
+        manager.record_access(path, now=now + 900)
+        assert not manager.should_refresh_ahead(path, now=now + 900)
+
+        manager.record_access(path, now=now + 900)
+        assert manager.should_refresh_ahead(path, now=now + 900)
+        assert not manager.should_refresh_ahead(path, now=now + 500)
+
+    def test_max_age_follows_jittered_ttl_and_refresh_ahead(self, cache_dir):
+        manager = CacheManager(cache_dir=cache_dir, ttl_seconds=1000, ttl_jitter=0.2)
+        paths = [cache_dir / f"{i}.m3u8" for i in range(50)]
+        for path in paths:
+            ttl = manager.ttl_for(path, mtime=0.0, now=100.0)
+            assert manager.max_age(path, mtime=0.0, now=100.0) == pytest.approx(ttl - 100)
+        assert manager.max_age(paths[0], mtime=0.0, now=5000.0) == 0
+
+        manager.refresh_ahead = 0.8
+        ttl = manager.ttl_for(paths[0], mtime=0.0, now=100.0)
+        assert manager.max_age(paths[0], mtime=0.0, now=100.0) == pytest.approx(0.8 * ttl - 100)
+
+    def test_max_age_ignores_popularity_bonus(self, cache_dir):
+        manager = CacheManager(
+            cache_dir=cache_dir, ttl_seconds=1000, popular_hits=1, popular_multiplier=4.0
+        )
+        path = cache_dir / "0001.m3u8"
+        manager.record_access(path, now=0.0)
+        assert manager.ttl_for(path, mtime=0.0, now=0.0) == pytest.approx(4000)
+        # The bonus lapses if the item stops being played, so it is not promised
+        assert manager.max_age(path, mtime=0.0, now=0.0) == pytest.approx(1000)
+
+    def test_expiry_cliff_smoothed(self, cache_dir):
+        """Simulate a library warmed up at once and then played for three hours.
+
+        With one shared TTL every item expires in the same minute and the next wave of
+        requests all miss; jitter, popularity and refresh-ahead spread those misses out
+        and keep the hot items cached.
+        """
+        ttl = 3600
+        items = [cache_dir / f"{i:04d}.mp3" for i in range(200)]
+        weights = [1 / (rank + 1) for rank in range(len(items))]  # Zipf-like popularity
+
+        def simulate(manager: CacheManager) -> tuple[float, int]:
+            rng = random.Random(0)
+            start = time.time()
+            mtimes = dict.fromkeys(items, start)
+            worst_minute, total_misses = 0.0, 0
+            for minute in range(1, 180):
+                now = start + minute * 60
+                misses = 0
+                requests = rng.choices(items, weights, k=40)
+                for path in requests:
+                    os.utime(path, (mtimes[path], mtimes[path]))
+                    manager.record_access(path, now=now)
+                    if manager.is_expired(path, now=now):
+                        misses += 1
+                        mtimes[path] = now
+                    elif manager.should_refresh_ahead(path, now=now):
+                        mtimes[path] = now
+                worst_minute = max(worst_minute, misses / len(requests))
+                total_misses += misses
+            return worst_minute, total_misses
+
+        cache_dir.mkdir(parents=True)
+        for path in items:
+            path.write_bytes(b"mp3")
+
+        baseline = simulate(CacheManager(cache_dir=cache_dir, ttl_seconds=ttl))
+        smoothed = simulate(
+            CacheManager(
+                cache_dir=cache_dir,
+                ttl_seconds=ttl,
+                ttl_jitter=0.2,
+                popular_hits=5,
+                popular_multiplier=4.0,
+                refresh_ahead=0.8,
+            )
+        )
+        assert baseline[0] > 0.5
+        assert smoothed[0] < 0.2
+        assert smoothed[1] < baseline[1] / 2
+
+
+class TestTieredCache:
+    @pytest.fixture
+    def tiered(self, tmp_path):
+        return CacheManager(
+            cache_dir=tmp_path / "disk",
+            ttl_seconds=3600,
+            popular_hits=2,
+            hot_dir=tmp_path / "hot",
+            hot_max_bytes=2 * 3 * 1024 + 500,  # Room for two fake transcodes
+        )
+
+    def test_lookup_prefers_hot_tier(self, tiered, tmp_path):
+        assert tiered.new_slot_dir("0001") == tmp_path / "hot" / "segments" / "0001"
+        assert tiered.slot_dir("0001") == tmp_path / "disk" / "segments" / "0001"
+
+        _create_fake_hls(tmp_path / "disk" / "segments" / "0001")
+        assert tiered.slot_dir("0001") == tmp_path / "disk" / "segments" / "0001"
+        _create_fake_hls(tmp_path / "hot" / "segments" / "0001")
+        assert tiered.slot_dir("0001") == tmp_path / "hot" / "segments" / "0001"
+
+    def test_least_recently_used_demoted_to_disk(self, tiered, tmp_path):
+        for slot_id in ("0001", "0002"):
+            _create_fake_hls(tiered.new_slot_dir(slot_id))
+            tiered.admit(f"segments/{slot_id}")
+        old_time = time.time() - 100
+        os.utime(tmp_path / "hot" / "segments" / "0001" / "index.m3u8", (old_time, old_time))
+        tiered.touch("segments/0001")
+
+        _create_fake_hls(tiered.new_slot_dir("0003"))
+        tiered.admit("segments/0003")
+
+        assert not (tmp_path / "hot" / "segments" / "0002").exists()
+        assert tiered.slot_dir("0002") == tmp_path / "disk" / "segments" / "0002"
+        assert (tiered.slot_dir("0002") / "seg002.ts").exists()
+        assert tiered.slot_dir("0001") == tmp_path / "hot" / "segments" / "0001"
+        assert tiered.hot_size <= tiered.hot_max_bytes
+
+    def test_demotion_keeps_mtime(self, tiered, tmp_path):
+        _create_fake_hls(tiered.new_slot_dir("0001"))
+        old_time = time.time() - 100
+        os.utime(tmp_path / "hot" / "segments" / "0001" / "index.m3u8", (old_time, old_time))
+        tiered.admit("segments/0001")
+        for slot_id in ("0002", "0003"):
+            _create_fake_hls(tiered.new_slot_dir(slot_id))
+            tiered.admit(f"segments/{slot_id}")
+
+        m3u8 = tiered.slot_dir("0001") / "index.m3u8"
+        assert m3u8.parent.parent.parent == tmp_path / "disk"
+        assert m3u8.stat().st_mtime == pytest.approx(old_time)
+
+    def test_slot_being_transcoded_not_demoted(self, tiered, tmp_path):
+        for slot_id in ("0001", "0002"):
+            _create_fake_hls(tiered.new_slot_dir(slot_id))
+            tiered.admit(f"segments/{slot_id}")
+        (tmp_path / "disk" / "locks").mkdir(parents=True)
+        with FileLock(tmp_path / "disk" / "locks" / "0001.lock", thread_local=False):
+            _create_fake_hls(tiered.new_slot_dir("0003"))
+            tiered.admit("segments/0003")
+
+        assert tiered.slot_dir("0001") == tmp_path / "hot" / "segments" / "0001"
+        assert tiered.slot_dir("0002") == tmp_path / "disk" / "segments" / "0002"
+
+    def test_retiring_disk_copy_leaves_hot_accounting(self, tiered, tmp_path):
+        _create_fake_hls(tmp_path / "disk" / "segments" / "0001")
+        _create_fake_hls(tiered.new_slot_dir("0001"))
+        tiered.admit("segments/0001")
+        hot_size = tiered.hot_size
+
+        tiered.retired_seconds = 60
+        tiered.retire_slot(tmp_path / "disk" / "segments" / "0001")
+        assert tiered.hot_size == hot_size
+        tiered.retired_seconds = 0
+        tiered.retire_slot(tiered.new_slot_dir("0001"))
+        assert tiered.hot_size == 0
+
+    def test_popular_disk_entry_promoted(self, tiered, tmp_path):
+        _create_fake_hls(tmp_path / "disk" / "segments" / "0001")
+        m3u8 = tiered.slot_dir("0001") / "index.m3u8"
+        tiered.record_access(m3u8)
+        assert not tiered.should_promote("segments/0001")
+        tiered.record_access(m3u8)
+        tiered.record_access(m3u8)
+        assert tiered.should_promote("segments/0001")
+
+        tiered.promote("segments/0001")
+        assert tiered.slot_dir("0001") == tmp_path / "hot" / "segments" / "0001"
+        assert not (tmp_path / "disk" / "segments" / "0001").exists()
+        assert not tiered.should_promote("segments/0001")
+
+    def test_existing_hot_entries_accounted(self, tiered, tmp_path):
+        _create_fake_hls(tiered.new_slot_dir("0001"))
+        reloaded = CacheManager(
+            cache_dir=tmp_path / "disk",
+            ttl_seconds=3600,
+            hot_dir=tmp_path / "hot",
+            hot_max_bytes=1024,
+        )
+        assert reloaded.hot_size > 3 * 1024
+
+    @pytest.mark.anyio
+    async def test_new_transcode_written_to_hot_tier(
+        self, settings, tiered, tmp_path, mock_subsonic_client
+    ):
+        transcoder = HLSTranscoder(
+            settings=settings, cache_manager=tiered, subsonic_client=mock_subsonic_client
+        )
+        track_info = {"title": "Test Song", "artist": "A", "album": "B", "coverArt": None}
+
+        async def fake_ffmpeg(stream_url, output_dir, *args, **kwargs):
+            _create_fake_hls(output_dir)
+
+        with patch.object(transcoder, "_run_ffmpeg", new=AsyncMock(side_effect=fake_ffmpeg)):
+            m3u8_path = await transcoder.ensure_transcoded("0001", "song001", track_info)
+
+        assert m3u8_path == tmp_path / "hot" / "segments" / "0001" / "index.m3u8"
+        assert tiered.hot_size > 0
+        assert transcoder.is_cached("0001")